@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import DailyProductionKPI
+from .models import DailyProductionKPI, RollupWatermark
 
 @admin.register(DailyProductionKPI)
 class DailyProductionKPIAdmin(admin.ModelAdmin):
@@ -17,7 +17,8 @@ class DailyProductionKPIAdmin(admin.ModelAdmin):
             'fields': ('mos_completed', 'units_produced')
         }),
         ('Performance Indicators', {
-            'fields': ('avg_lead_time_hours', 'on_time_completion_rate')
+            'fields': ('avg_lead_time_hours', 'on_time_completion_rate',
+                       'on_time_count', 'due_date_count')
         }),
         ('System Fields', {
             'fields': ('updated_at',),
@@ -29,3 +30,9 @@ class DailyProductionKPIAdmin(admin.ModelAdmin):
         if obj:  # editing an existing object
             return self.readonly_fields + ('date',)
         return self.readonly_fields
+
+
+@admin.register(RollupWatermark)
+class RollupWatermarkAdmin(admin.ModelAdmin):
+    list_display = ('name', 'value', 'updated_at')
+    readonly_fields = ('updated_at',)
@@ -0,0 +1,189 @@
+"""
+Cached analytics overview.
+
+compute_overview results are kept in the Django cache per ``days``. An entry
+is fresh for settings.ANALYTICS_OVERVIEW_CACHE_TTL seconds. Once it expires,
+or a write invalidates it, it is still served for up to
+ANALYTICS_OVERVIEW_STALE_TTL more seconds while one background thread
+recomputes it. Only a missing or fully expired entry makes the request wait.
+
+Recomputations are single-flight: in a process, concurrent requests for the
+same ``days`` share one Future. Only when settings.CACHE_IS_SHARED says every
+process uses the same cache backend does a short cache.add lock also pick one
+worker across processes, the others waiting for its entry to appear.
+
+Invalidation works like the ATP timelines: MO and WorkOrder saves, bulk MO
+status changes and every stock posting bump a generation number once their
+transaction commits. A partial overview (a section timed out) is cached as
+already stale. Without a shared cache both the entries and the generation are
+per process: each process computes its own overview, and sees a write made in
+another process only once its entry is older than the fresh TTL.
+"""
+
+import logging
+import threading
+import time
+from concurrent.futures import Future
+from typing import Dict, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import connection, transaction
+
+from .services import compute_overview
+
+logger = logging.getLogger(__name__)
+
+CACHE_PREFIX = "analytics-overview"
+GENERATION_KEY = f"{CACHE_PREFIX}:generation"
+# how long a worker may hold the cross-process lock (and others wait for it)
+LOCK_TIMEOUT = 30
+POLL_INTERVAL = 0.1
+
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+
+def overview_changed():
+    """Orders or stock changed: mark every cached overview stale on commit."""
+    transaction.on_commit(_bump_generation)
+
+
+def _bump_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, None)
+
+
+def _generation() -> int:
+    return cache.get_or_set(GENERATION_KEY, 0, None)
+
+
+def _ttl() -> int:
+    return max(int(getattr(settings, "ANALYTICS_OVERVIEW_CACHE_TTL", 60)), 0)
+
+
+def _stale_ttl() -> int:
+    return max(int(getattr(settings, "ANALYTICS_OVERVIEW_STALE_TTL", 300)), 0)
+
+
+def _shared() -> bool:
+    return bool(getattr(settings, "CACHE_IS_SHARED", False))
+
+
+def _key(days: int) -> str:
+    return f"{CACHE_PREFIX}:{days}"
+
+
+def get_overview(days: int = 30) -> Dict:
+    """compute_overview(days), served from the cache when possible."""
+    key = _key(days)
+    entry = cache.get(key)
+    if entry is not None:
+        age = time.time() - entry["computed_at"]
+        if entry["generation"] == _generation() and age < _ttl():
+            return entry["data"]
+        if age < _ttl() + _stale_ttl():
+            refresh_in_background(days)
+            return entry["data"]
+    future, leader = _claim(key)
+    if leader:
+        _run(future, days, wait=True)
+    data = future.result()
+    if data is None:
+        # joined a background refresh that left the work to another worker's
+        # lock: wait for (or take over) that computation instead
+        data = _compute(days, wait=True)
+    return data
+
+
+def refresh_in_background(days: int):
+    """Recompute the overview for ``days`` on a thread, unless one already is."""
+    future, leader = _claim(_key(days))
+    if leader:
+        threading.Thread(
+            target=_run_in_thread, args=(future, days), name=f"{CACHE_PREFIX}-{days}", daemon=True
+        ).start()
+
+
+def _claim(key: str) -> Tuple[Future, bool]:
+    """The in-flight computation of ``key``, and whether the caller must run it."""
+    with _inflight_lock:
+        future = _inflight.get(key)
+        if future is not None:
+            return future, False
+        future = _inflight[key] = Future()
+        return future, True
+
+
+def _run(future: Future, days: int, wait: bool):
+    key = _key(days)
+    try:
+        future.set_result(_compute(days, wait))
+    except Exception as exc:
+        future.set_exception(exc)
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
+
+
+def _run_in_thread(future: Future, days: int):
+    try:
+        _run(future, days, wait=False)
+        if future.exception() is not None:
+            logger.error(
+                "Background overview refresh failed for days=%s",
+                days,
+                exc_info=future.exception(),
+            )
+    finally:
+        # the thread opened its own connection; do not leave it to the GC
+        connection.close()
+
+
+def _compute(days: int, wait: bool):
+    """
+    Compute and store the overview, unless another worker holds the lock: a
+    background refresh then leaves it to that worker (returns None), a waiting
+    request polls for its result and computes itself if none arrives in time.
+    With a per-process cache there is no other worker to wait for.
+    """
+    key = _key(days)
+    # read before computing, so a write landing meanwhile leaves the entry stale
+    generation = _generation()
+    if not _shared():
+        # _claim already made this the only computation of ``days`` here
+        return _store(key, days, generation)
+    lock = f"{key}:lock"
+    owned = cache.add(lock, 1, LOCK_TIMEOUT)
+    if not owned:
+        if not wait:
+            return None
+        started = time.time()
+        deadline = time.monotonic() + LOCK_TIMEOUT
+        while not owned and time.monotonic() < deadline:
+            time.sleep(POLL_INTERVAL)
+            entry = cache.get(key)
+            if entry is not None and entry["computed_at"] >= started:
+                return entry["data"]
+            # the lock is gone without a result (failed or expired): take over
+            owned = cache.add(lock, 1, LOCK_TIMEOUT)
+    try:
+        return _store(key, days, generation)
+    finally:
+        if owned:
+            cache.delete(lock)
+
+
+def _store(key: str, days: int, generation):
+    data = compute_overview(days=days)
+    if data.get("partial"):
+        # sections timed out: serve it, but refresh on the next read
+        generation = None
+    cache.set(
+        key,
+        {"data": data, "computed_at": time.time(), "generation": generation},
+        _ttl() + _stale_ttl(),
+    )
+    return data
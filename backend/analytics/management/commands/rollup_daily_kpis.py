@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+
+from analytics.services import rollup_daily_kpis
+
+
+class Command(BaseCommand):
+    help = (
+        "Fold manufacturing orders completed since the last run into "
+        "DailyProductionKPI. Safe to run as often as needed."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Ignore the watermark and recompute every day.",
+        )
+
+    def handle(self, *args, **options):
+        result = rollup_daily_kpis(rebuild=options["rebuild"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Rolled up {result['days']} days (watermark {result['watermark']})."
+            )
+        )
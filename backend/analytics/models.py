@@ -9,9 +9,10 @@ class DailyProductionKPI(models.Model):
     mos_completed = models.PositiveIntegerField(
         default=0, help_text="Total Manufacturing Orders completed on this date."
     )
+    # same scale as ManufacturingOrder.qty, with room for a day's sum
     units_produced = models.DecimalField(
-        max_digits=12,
-        decimal_places=2,
+        max_digits=22,
+        decimal_places=4,
         default=0.00,
         help_text="Total units of finished goods produced.",
     )
@@ -23,6 +24,13 @@ class DailyProductionKPI(models.Model):
         default=0.0,
         help_text="Percentage of MOs completed on or before their due date (0.0 to 1.0).",
     )
+    # additive counts behind on_time_completion_rate, so ranges can be summed
+    on_time_count = models.PositiveIntegerField(
+        default=0, help_text="MOs completed on or before their due date."
+    )
+    due_date_count = models.PositiveIntegerField(
+        default=0, help_text="Completed MOs that had a due date."
+    )
 
     # This timestamp tells us when the snapshot itself was created or last updated
     updated_at = models.DateTimeField(auto_now=True)
@@ -34,3 +42,17 @@ class DailyProductionKPI(models.Model):
 
     def __str__(self):
         return f"KPIs for {self.date.strftime('%Y-%m-%d')}"
+
+
+class RollupWatermark(models.Model):
+    """
+    How far a rollup job has read its source: the latest completion time it
+    has already folded into its aggregate table.
+    """
+
+    name = models.CharField(max_length=64, primary_key=True)
+    value = models.DateTimeField(null=True, blank=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return f"{self.name} @ {self.value}"
@@ -1,154 +1,236 @@
-from datetime import date, timedelta
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from datetime import date, datetime, time, timedelta
 from decimal import Decimal
+from typing import Optional
 
+from django.conf import settings
+from django.db import connection, transaction
 from django.db.models import (
+    Avg,
     Count,
-    Sum,
-    Max,
+    DurationField,
+    ExpressionWrapper,
     F,
+    FloatField,
+    Max,
     Q,
-    ExpressionWrapper,
-    DurationField,
-    DateField,
+    Sum,
+    Window,
 )
-from django.db.models.functions import Cast, TruncWeek, TruncMonth
+from django.db.models.functions import RowNumber, TruncDate, TruncWeek
 from django.utils import timezone
 
-from manufacturing.models import ManufacturingOrder, WorkOrder
-from inventory.models import Product, StockBalance
+from manufacturing.models import ManufacturingOrder
+from inventory.models import ProductAvailability
+
+from .models import DailyProductionKPI, RollupWatermark
+
+KPI_ROLLUP = "daily_production_kpi"
+# completions committed late can carry a timestamp just below the watermark;
+# re-reading a short overlap is harmless because whole days are recomputed
+WATERMARK_OVERLAP = timedelta(minutes=15)
+
+logger = logging.getLogger(__name__)
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def _day_start(day: date) -> datetime:
+    return timezone.make_aware(datetime.combine(day, time.min))
 
 
 def _completed_mos_qs(start_date, end_date):
     """
-    Return queryset of MOs considered completed in the interval.
-    We consider an MO completed if:
-      - status == DONE
-      OR
-      - all its work_orders are COMPLETED (we detect by comparing counts)
-    We annotate completed_at as Max(work_orders.completed_at).
+    MOs completed between start_date and end_date (inclusive), as a range
+    scan of the (status, completed_at) index.
     """
-    mos = (
-        ManufacturingOrder.objects.annotate(
-            total_ops=Count("work_orders"),
-            completed_ops=Count(
-                "work_orders", filter=Q(work_orders__status=WorkOrder.Status.COMPLETED)
-            ),
-            completed_at=Max("work_orders__completed_at"),
-        ).filter(
-            Q(status=ManufacturingOrder.Status.DONE)
-            | Q(total_ops__gt=0, total_ops=F("completed_ops"))
-        )
-        # completed_at may be null for some MOs that are marked DONE without WOs; prefer completed_at annotation
+    return _completed_mos().filter(
+        completed_at__gte=_day_start(start_date),
+        completed_at__lt=_day_start(end_date + timedelta(days=1)),
     )
 
-    # restrict by completed_at between start_date and end_date (inclusive)
-    mos = mos.filter(
-        completed_at__date__gte=start_date, completed_at__date__lte=end_date
+
+def _completed_mos(since=None):
+    """Every DONE MO, optionally only those completed after ``since``."""
+    mos = ManufacturingOrder.objects.filter(
+        status=ManufacturingOrder.Status.DONE, completed_at__isnull=False
     )
+    if since is not None:
+        mos = mos.filter(completed_at__gt=since)
     return mos
 
 
-def compute_overview(days: int = 30):
+def _daily_rows(days):
     """
-    Compute dashboard metrics for the last `days` days (including today).
-    Returns a dict ready for JSON response.
+    DailyProductionKPI rows (unsaved) for ``days``, recomputed from the orders
+    in one grouped aggregate: count, units and on-time counts by conditional
+    aggregation, lead time as Avg of the completed_at - created_at duration.
     """
-    end_dt = timezone.now().date()
-    start_dt = end_dt - timedelta(days=days - 1)
-
-    result = {"start_date": str(start_dt), "end_date": str(end_dt)}
-
-    completed_qs = _completed_mos_qs(start_dt, end_dt)
+    rows = (
+        _completed_mos_qs(min(days), max(days))
+        .annotate(day=TruncDate("completed_at"))
+        .values("day")
+        .annotate(
+            count=Count("id"),
+            units=Sum("qty"),
+            lead=Avg(
+                ExpressionWrapper(
+                    F("completed_at") - F("created_at"), output_field=DurationField()
+                )
+            ),
+            with_due=Count("id", filter=Q(due_date__isnull=False)),
+            on_time=Count("id", filter=Q(due_date__gte=F("day"))),
+        )
+        .order_by("day")
+    )
+    return [
+        DailyProductionKPI(
+            date=row["day"],
+            mos_completed=row["count"],
+            units_produced=row["units"] or Decimal("0"),
+            avg_lead_time_hours=(
+                row["lead"].total_seconds() / 3600.0 if row["lead"] is not None else 0.0
+            ),
+            on_time_completion_rate=(
+                row["on_time"] / row["with_due"] if row["with_due"] else 0.0
+            ),
+            on_time_count=row["on_time"],
+            due_date_count=row["with_due"],
+        )
+        for row in rows
+        if row["day"] in days
+    ]
 
-    # Orders Completed and Units Produced
-    mos_completed = completed_qs.count()
-    units_produced_agg = completed_qs.aggregate(total_units=Sum("qty"))
-    units_produced = Decimal(units_produced_agg["total_units"] or 0)
 
-    result["mos_completed"] = mos_completed
-    result["units_produced"] = str(units_produced)
+def rollup_daily_kpis(rebuild: bool = False):
+    """
+    Fold orders completed since the watermark into DailyProductionKPI.
 
-    # Avg lead time hours (avg of completed_at - created_at)
-    # compute per-MO duration in seconds, then average -> hours
-    durations = completed_qs.annotate(
-        lead_time=ExpressionWrapper(
-            (
-                Cast(F("completed_at"), output_field=DateField())
-                - Cast(F("created_at"), output_field=DateField())
-            ),
-            output_field=DurationField(),
+    Only the days those orders completed on are recomputed (in full, so the
+    upsert is idempotent); the watermark then moves to the latest completion
+    seen. Concurrent runs serialize on the watermark row. ``rebuild`` ignores
+    the watermark, recomputes every day and drops rows of days left without
+    completions (after a backfill of historical completion times).
+    Returns {"days": <rows upserted>, "watermark": <iso datetime or None>}.
+    """
+    with transaction.atomic():
+        mark, _ = RollupWatermark.objects.select_for_update().get_or_create(
+            name=KPI_ROLLUP
         )
-    )
-    # fallback: compute using timestamps where available using seconds
-    # safer compute using completed_at and created_at datetimes
-    durations = completed_qs.annotate(
-        lead_seconds=ExpressionWrapper(
-            F("completed_at") - F("created_at"), output_field=DurationField()
+        since = mark.value - WATERMARK_OVERLAP if mark.value and not rebuild else None
+        touched = dict(
+            _completed_mos(since)
+            .annotate(day=TruncDate("completed_at"))
+            .values("day")
+            .annotate(latest=Max("completed_at"))
+            .values_list("day", "latest")
         )
-    ).exclude(lead_seconds__isnull=True)
-
-    # Sum seconds and count
-    total_seconds = 0
-    count_for_lead = 0
-    for row in durations.values_list("lead_seconds", flat=True):
-        if row is None:
-            continue
-        # Django returns timedelta
-        total_seconds += row.total_seconds()
-        count_for_lead += 1
-
-    avg_lead_hours = (
-        (total_seconds / 3600.0 / count_for_lead) if count_for_lead else 0.0
+        if rebuild:
+            DailyProductionKPI.objects.exclude(date__in=list(touched)).delete()
+        if touched:
+            DailyProductionKPI.objects.bulk_create(
+                _daily_rows(set(touched)),
+                update_conflicts=True,
+                unique_fields=["date"],
+                update_fields=[
+                    "mos_completed",
+                    "units_produced",
+                    "avg_lead_time_hours",
+                    "on_time_completion_rate",
+                    "on_time_count",
+                    "due_date_count",
+                    "updated_at",
+                ],
+            )
+            latest = max(touched.values())
+            mark.value = max(latest, mark.value) if mark.value else latest
+            mark.save(update_fields=["value", "updated_at"])
+    return {"days": len(touched), "watermark": mark.value.isoformat() if mark.value else None}
+
+
+def _kpi_section(start_dt, end_dt):
+    # Orders Completed, Units Produced, lead time and on-time rate come from
+    # the pre-aggregated daily rows; completions fold them in on commit (see
+    # analytics.signals) and the rollup_daily_kpis command catches up the rest
+    kpis = DailyProductionKPI.objects.filter(
+        date__gte=start_dt, date__lte=end_dt
+    ).aggregate(
+        completed=Sum("mos_completed"),
+        units=Sum("units_produced"),
+        lead_hours=Sum(
+            F("avg_lead_time_hours") * F("mos_completed"), output_field=FloatField()
+        ),
+        on_time=Sum("on_time_count"),
+        with_due=Sum("due_date_count"),
     )
-    result["avg_lead_time_hours"] = round(avg_lead_hours, 2)
+    mos_completed = kpis["completed"] or 0
+    return {
+        "mos_completed": mos_completed,
+        "units_produced": str(Decimal(kpis["units"] or 0)),
+        "avg_lead_time_hours": round(
+            (kpis["lead_hours"] or 0.0) / mos_completed if mos_completed else 0.0, 2
+        ),
+        "on_time_completion_rate": round(
+            kpis["on_time"] / kpis["with_due"] if kpis["with_due"] else 0.0, 4
+        ),
+    }
 
-    # On-time completion rate
-    # Only consider MOs that have a due_date set
-    mos_with_due = completed_qs.filter(due_date__isnull=False)
-    due_total = mos_with_due.count()
-    on_time_total = mos_with_due.filter(completed_at__date__lte=F("due_date")).count()
-    on_time_rate = (on_time_total / due_total) if due_total else 0.0
-    result["on_time_completion_rate"] = round(on_time_rate, 4)
 
+def _weekly_volume_section(start_dt, end_dt):
     # Production Volume Over Time (group by week)
     weekly = (
-        completed_qs.annotate(week=TruncWeek("completed_at"))
+        _completed_mos_qs(start_dt, end_dt)
+        .annotate(week=TruncWeek("completed_at"))
         .values("week")
         .annotate(units=Sum("qty"))
         .order_by("week")
     )
-    result["production_volume_by_week"] = [
-        {
-            "week_start": w["week"].date().isoformat() if w["week"] else None,
-            "units": str(w["units"] or 0),
-        }
-        for w in weekly
-    ]
+    return {
+        "production_volume_by_week": [
+            {
+                "week_start": w["week"].date().isoformat() if w["week"] else None,
+                "units": str(w["units"] or 0),
+            }
+            for w in weekly
+        ]
+    }
 
+
+def _status_breakdown_section(start_dt, end_dt):
     # Order status breakdown (counts of current orders by status)
     status_counts = (
         ManufacturingOrder.objects.values("status")
         .annotate(count=Count("id"))
         .order_by("status")
     )
-    result["order_status_breakdown"] = {s["status"]: s["count"] for s in status_counts}
+    return {"order_status_breakdown": {s["status"]: s["count"] for s in status_counts}}
+
 
+def _top_products_section(start_dt, end_dt):
     # Top 5 Most Produced Products (by units produced in period)
     top_products = (
-        completed_qs.values("product__id", "product__sku", "product__name")
+        _completed_mos_qs(start_dt, end_dt)
+        .values("product__id", "product__sku", "product__name")
         .annotate(total_units=Sum("qty"))
         .order_by("-total_units")[:5]
     )
-    result["top_products"] = [
-        {
-            "product_id": p["product__id"],
-            "sku": p["product__sku"],
-            "name": p["product__name"],
-            "units": str(p["total_units"] or 0),
-        }
-        for p in top_products
-    ]
+    return {
+        "top_products": [
+            {
+                "product_id": p["product__id"],
+                "sku": p["product__sku"],
+                "name": p["product__name"],
+                "units": str(p["total_units"] or 0),
+            }
+            for p in top_products
+        ]
+    }
+
 
+def _delayed_orders_section(start_dt, end_dt):
     # Active Orders with Delays: In-progress orders past due date
     today = timezone.now().date()
     delayed_qs = ManufacturingOrder.objects.filter(
@@ -159,56 +241,145 @@ def compute_overview(days: int = 30):
         due_date__isnull=False,
         due_date__lt=today,
     ).order_by("due_date")
-    result["delayed_orders"] = [
-        {
-            "id": mo.pk,
-            "mo_number": mo.mo_number,
-            "product_id": mo.product_id,
-            "qty": str(mo.qty),
-            "due_date": mo.due_date.isoformat(),
-            "status": mo.status,
-        }
-        for mo in delayed_qs[:50]
-    ]
+    return {
+        "delayed_orders": [
+            {
+                "id": mo.pk,
+                "mo_number": mo.mo_number,
+                "product_id": mo.product_id,
+                "qty": str(mo.qty),
+                "due_date": mo.due_date.isoformat(),
+                "status": mo.status,
+            }
+            for mo in delayed_qs[:50]
+        ]
+    }
 
+
+def _inventory_levels_section(start_dt, end_dt):
     # Inventory Levels: top 5 raw materials and top 5 finished goods by available qty
-    # compute total available per product using StockBalance
-    raw_products = (
-        Product.objects.filter(product_type="RAW")
+    # read the denormalized per-product totals instead of summing StockBalance
+    # one query for both lists: rank products by availability within each type
+    ranked = (
+        ProductAvailability.objects.filter(product__product_type__in=["RAW", "FINISHED"])
+        .select_related("product")
         .annotate(
-            total_available=Sum("stock_balances__qty_on_hand")
-            - Sum("stock_balances__reserved_qty")
-        )
-        .order_by("-total_available")[:5]
-    )
-    finished_products = (
-        Product.objects.filter(product_type="FINISHED")
-        .annotate(
-            total_available=Sum("stock_balances__qty_on_hand")
-            - Sum("stock_balances__reserved_qty")
+            rank=Window(
+                RowNumber(),
+                partition_by=F("product__product_type"),
+                order_by=F("available").desc(),
+            )
         )
-        .order_by("-total_available")[:5]
+        .filter(rank__lte=5)
+        .order_by("product__product_type", "rank")
     )
+    top = {"RAW": [], "FINISHED": []}
+    for a in ranked:
+        top[a.product.product_type].append(a)
 
     def _serialize_prod(qs):
-        out = []
-        for p in qs:
-            qty = (
-                p.total_available
-                if getattr(p, "total_available", None) is not None
-                else 0
-            )
-            out.append(
-                {
-                    "product_id": p.id,
-                    "sku": p.sku,
-                    "name": p.name,
-                    "available_qty": str(qty or 0),
-                }
+        return [
+            {
+                "product_id": a.product_id,
+                "sku": a.product.sku,
+                "name": a.product.name,
+                "available_qty": str(a.available or 0),
+            }
+            for a in qs
+        ]
+
+    return {
+        "top_raw_materials_by_qty": _serialize_prod(top["RAW"]),
+        "top_finished_products_by_qty": _serialize_prod(top["FINISHED"]),
+    }
+
+
+# name -> section(start_date, end_date) returning its keys of the overview
+OVERVIEW_SECTIONS = {
+    "kpis": _kpi_section,
+    "weekly_volume": _weekly_volume_section,
+    "status_breakdown": _status_breakdown_section,
+    "top_products": _top_products_section,
+    "delayed_orders": _delayed_orders_section,
+    "inventory_levels": _inventory_levels_section,
+}
+
+
+def _section_pool() -> ThreadPoolExecutor:
+    """
+    One bounded pool per process, shared by every overview request, so slow
+    or timed-out sections can never hold more than the pool size in threads.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(
+                max_workers=max(int(getattr(settings, "ANALYTICS_OVERVIEW_WORKERS", 6)), 1),
+                thread_name_prefix="analytics-overview",
             )
-        return out
+        return _pool
+
+
+def _run_section(section, start_dt, end_dt):
+    try:
+        return section(start_dt, end_dt)
+    finally:
+        # pool threads outlive the request: release this section's connection
+        connection.close()
+
+
+def _run_parallel(start_dt, end_dt, result):
+    """
+    Evaluate every section on the pool, each on its worker's own connection,
+    and merge whatever finishes within ANALYTICS_OVERVIEW_SECTION_TIMEOUT.
+    Sections that time out or fail are listed in ``missing_sections``.
+    """
+    timeout = float(getattr(settings, "ANALYTICS_OVERVIEW_SECTION_TIMEOUT", 10))
+    pool = _section_pool()
+    futures = {
+        pool.submit(_run_section, section, start_dt, end_dt): name
+        for name, section in OVERVIEW_SECTIONS.items()
+    }
+    done, not_done = wait(futures, timeout=timeout)
+    parts, missing = {}, []
+    for future in not_done:
+        # still queued: drop it; already running: let it finish on the pool
+        future.cancel()
+        missing.append(futures[future])
+    for future in done:
+        try:
+            parts[futures[future]] = future.result()
+        except Exception:
+            logger.exception("Analytics overview section %s failed", futures[future])
+            missing.append(futures[future])
+    # merge in section order, so the keys come out as in a serial run
+    for name in OVERVIEW_SECTIONS:
+        result.update(parts.get(name, {}))
+    if missing:
+        result["partial"] = True
+        result["missing_sections"] = [n for n in OVERVIEW_SECTIONS if n in missing]
+    return result
 
-    result["top_raw_materials_by_qty"] = _serialize_prod(raw_products)
-    result["top_finished_products_by_qty"] = _serialize_prod(finished_products)
 
+def compute_overview(days: int = 30, parallel: Optional[bool] = None):
+    """
+    Compute dashboard metrics for the last `days` days (including today).
+    Returns a dict ready for JSON response.
+
+    With ``parallel`` (default: settings.ANALYTICS_OVERVIEW_PARALLEL) the
+    sections run concurrently on a bounded thread pool, so latency is that of
+    the slowest section; a section still running at the timeout is left out
+    and the result is flagged ``partial``. Each section then reads on its own
+    connection and cannot see the caller's uncommitted writes.
+    """
+    end_dt = timezone.now().date()
+    start_dt = end_dt - timedelta(days=days - 1)
+
+    result = {"start_date": str(start_dt), "end_date": str(end_dt)}
+    if parallel is None:
+        parallel = getattr(settings, "ANALYTICS_OVERVIEW_PARALLEL", False)
+    if parallel:
+        return _run_parallel(start_dt, end_dt, result)
+    for section in OVERVIEW_SECTIONS.values():
+        result.update(section(start_dt, end_dt))
     return result
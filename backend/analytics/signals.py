@@ -0,0 +1,41 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from inventory.signals import stock_levels_changed
+from manufacturing.models import ManufacturingOrder, WorkOrder
+from manufacturing.signals import orders_changed
+
+from .cache import overview_changed
+from .services import rollup_daily_kpis
+
+
+@receiver(post_save, sender=ManufacturingOrder)
+@receiver(post_delete, sender=ManufacturingOrder)
+@receiver(post_save, sender=WorkOrder)
+@receiver(post_delete, sender=WorkOrder)
+def invalidate_overview_on_order_change(sender, **kwargs):
+    overview_changed()
+
+
+@receiver(orders_changed)
+@receiver(stock_levels_changed)
+def invalidate_overview_on_bulk_change(sender, **kwargs):
+    # StockBalance saves land here too, through refresh_product_availability
+    overview_changed()
+
+
+@receiver(post_save, sender=ManufacturingOrder)
+def roll_up_kpis_on_completion(sender, instance, update_fields=None, **kwargs):
+    if instance.status != ManufacturingOrder.Status.DONE or instance.completed_at is None:
+        return
+    if update_fields is None or {"status", "completed_at"} & set(update_fields):
+        # after commit, so dashboard reads never take the watermark lock;
+        # a failure is logged and left for the rollup_daily_kpis command
+        transaction.on_commit(_roll_up_and_invalidate, robust=True)
+
+
+def _roll_up_and_invalidate():
+    rollup_daily_kpis()
+    # again after the rollup, so no overview is cached from the old rows
+    overview_changed()
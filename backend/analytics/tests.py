@@ -1,4 +1,6 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase
+from django.urls import reverse
+from rest_framework.test import APITestCase
 from django.utils import timezone
 from datetime import timedelta
 from decimal import Decimal
@@ -32,4 +34,364 @@ class KPITests(TestCase):
                 date=future_date,
                 mos_completed=1,
                 units_produced=Decimal('10.00')
-            )
\ No newline at end of file
+            )
+
+class DailyKPIRollupTests(TestCase):
+    def setUp(self):
+        from inventory.models import Product
+        from manufacturing.models import ManufacturingOrder, WorkCenter, WorkOrder
+
+        self.now = timezone.now()
+        self.product = Product.objects.create(name='Crate', sku='CRATE', product_type='FINISHED', unit_of_measure='units')
+        self.wc = WorkCenter.objects.create(name='Packing')
+        self.mos = []
+        for qty, due_offset, done_offset in ((Decimal('4'), 0, 0), (Decimal('6'), -1, 0), (Decimal('5'), None, -1)):
+            mo = ManufacturingOrder.objects.create(
+                product=self.product, qty=qty, status=ManufacturingOrder.Status.DONE,
+                due_date=(self.now + timedelta(days=due_offset)).date() if due_offset is not None else None,
+                completed_at=self.now + timedelta(days=done_offset),
+            )
+            ManufacturingOrder.objects.filter(pk=mo.pk).update(created_at=self.now + timedelta(days=done_offset, hours=-10))
+            WorkOrder.objects.create(
+                mo=mo, operation_no=1, title='Pack', work_center=self.wc,
+                status=WorkOrder.Status.COMPLETED, completed_at=self.now + timedelta(days=done_offset),
+            )
+            self.mos.append(mo)
+
+    def test_rollup_only_touches_new_days(self):
+        from .services import rollup_daily_kpis
+
+        self.assertEqual(rollup_daily_kpis()['days'], 2)
+        today = DailyProductionKPI.objects.get(date=timezone.localdate(self.now))
+        self.assertEqual((today.mos_completed, today.units_produced), (2, Decimal('10.00')))
+        self.assertEqual((today.on_time_count, today.due_date_count), (1, 2))
+        self.assertAlmostEqual(today.avg_lead_time_hours, 10.0)
+        # only the overlap behind the watermark is re-read: today, not yesterday
+        before = DailyProductionKPI.objects.get(date=timezone.localdate(self.now) - timedelta(days=1)).updated_at
+        self.assertEqual(rollup_daily_kpis()['days'], 1)
+        self.assertEqual(
+            DailyProductionKPI.objects.get(date=timezone.localdate(self.now) - timedelta(days=1)).updated_at, before
+        )
+
+    def test_fractional_quantities_keep_their_scale(self):
+        from manufacturing.models import ManufacturingOrder
+
+        from .services import rollup_daily_kpis
+
+        ManufacturingOrder.objects.filter(pk=self.mos[0].pk).update(qty=Decimal('2.5'))
+        ManufacturingOrder.objects.filter(pk=self.mos[1].pk).update(qty=Decimal('0.3333'))
+        rollup_daily_kpis()
+        today = DailyProductionKPI.objects.get(date=timezone.localdate(self.now))
+        self.assertEqual(today.units_produced, Decimal('2.8333'))
+
+    def test_overview_sums_daily_rows(self):
+        from .services import compute_overview, rollup_daily_kpis
+
+        # the overview only reads the rolled-up rows
+        self.assertEqual(compute_overview(days=7)['mos_completed'], 0)
+        rollup_daily_kpis()
+        data = compute_overview(days=7)
+        self.assertEqual(data['mos_completed'], 3)
+        self.assertEqual(Decimal(data['units_produced']), Decimal('15'))
+        self.assertEqual(data['avg_lead_time_hours'], 10.0)
+        self.assertEqual(data['on_time_completion_rate'], 0.5)
+        self.assertEqual(compute_overview(days=1)['mos_completed'], 2)
+
+
+class CompletedAtBackfillTests(TestCase):
+    def test_backfill_uses_last_work_order_completion(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from inventory.models import Product
+        from manufacturing.models import ManufacturingOrder, WorkCenter, WorkOrder
+
+        product = Product.objects.create(name='Tray', sku='TRAY', product_type='FINISHED', unit_of_measure='units')
+        wc = WorkCenter.objects.create(name='Press')
+        done = timezone.now() - timedelta(days=3)
+        legacy = [
+            ManufacturingOrder.objects.create(product=product, qty=1, status=ManufacturingOrder.Status.DONE)
+            for _ in range(3)
+        ]
+        for mo in legacy[:2]:
+            for hours in (1, 2):
+                WorkOrder.objects.create(
+                    mo=mo, operation_no=hours, title='Press', work_center=wc,
+                    status=WorkOrder.Status.COMPLETED, completed_at=done + timedelta(hours=hours),
+                )
+        call_command('backfill_mo_completed_at', chunk_size=1, stdout=StringIO())
+        self.assertEqual(
+            [mo.completed_at for mo in ManufacturingOrder.objects.filter(pk__in=[m.pk for m in legacy]).order_by('pk')],
+            [done + timedelta(hours=2), done + timedelta(hours=2), None],
+        )
+
+    def test_backfill_rebuilds_daily_kpis_behind_the_watermark(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from inventory.models import Product
+        from manufacturing.models import ManufacturingOrder, WorkCenter, WorkOrder
+        from .models import RollupWatermark
+        from .services import KPI_ROLLUP
+
+        product = Product.objects.create(name='Tray', sku='TRAY', product_type='FINISHED', unit_of_measure='units')
+        wc = WorkCenter.objects.create(name='Press')
+        done = timezone.now() - timedelta(days=3)
+        mo = ManufacturingOrder.objects.create(product=product, qty=2, status=ManufacturingOrder.Status.DONE)
+        WorkOrder.objects.create(
+            mo=mo, operation_no=1, title='Press', work_center=wc,
+            status=WorkOrder.Status.COMPLETED, completed_at=done,
+        )
+        # rolled up under the old rule, and a watermark already past it
+        stale_day = timezone.localdate() - timedelta(days=10)
+        DailyProductionKPI.objects.create(date=stale_day, mos_completed=4, units_produced=Decimal('4'))
+        RollupWatermark.objects.create(name=KPI_ROLLUP, value=timezone.now())
+
+        call_command('backfill_mo_completed_at', stdout=StringIO())
+        self.assertFalse(DailyProductionKPI.objects.filter(date=stale_day).exists())
+        row = DailyProductionKPI.objects.get(date=timezone.localdate(done))
+        self.assertEqual((row.mos_completed, row.units_produced), (1, Decimal('2')))
+
+
+class OverviewQueryBudgetTests(APITestCase):
+    # KPI sum, weekly volume, status breakdown, top products, delayed orders
+    # and both inventory lists; the overview itself never writes
+    QUERY_BUDGET = 6
+
+    def setUp(self):
+        from account.models import CustomUser
+        from django.core.cache import cache
+        from inventory.models import Product, StockBalance
+
+        cache.clear()
+
+        self.user = CustomUser.objects.create_user(
+            email='owner@example.com', password='testpass123', loginid='owner', is_staff=True
+        )
+        self.client.force_authenticate(user=self.user)
+        self.now = timezone.now()
+        for i in range(4):
+            product = Product.objects.create(
+                name=f'Item {i}', sku=f'ITEM{i}', product_type='FINISHED' if i % 2 else 'RAW', unit_of_measure='units'
+            )
+            StockBalance.objects.create(product=product, warehouse='MAIN', qty_on_hand=Decimal(i + 1))
+        self.product = product
+
+    def _get_within_budget(self, days):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('analytics-overview'), {'days': days})
+        self.assertLessEqual(len(queries), self.QUERY_BUDGET, [q['sql'][:80] for q in queries])
+        return response
+
+    def _complete(self, count, days_ago):
+        from manufacturing.models import ManufacturingOrder
+
+        # completions roll themselves up once committed
+        with self.captureOnCommitCallbacks(execute=True):
+            for _ in range(count):
+                ManufacturingOrder.objects.create(
+                    product=self.product, qty=Decimal('2'), status=ManufacturingOrder.Status.DONE,
+                    due_date=self.now.date(), completed_at=self.now - timedelta(days=days_ago),
+                )
+
+    def test_overview_query_count_does_not_grow_with_history(self):
+        self._complete(20, 12)
+        self._complete(20, 5)
+        response = self._get_within_budget(30)
+        self.assertEqual(response.data['mos_completed'], 40)
+        self.assertEqual(len(response.data['top_raw_materials_by_qty']), 2)
+
+        self._complete(3, 0)
+        response = self._get_within_budget(365)
+        self.assertEqual(response.data['mos_completed'], 43)
+        self.assertEqual(response.data['on_time_completion_rate'], 1.0)
+
+
+class OverviewCacheTests(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+
+        cache.clear()
+
+    def _age_entry(self, days, seconds):
+        from django.core.cache import cache
+        from .cache import _key
+
+        entry = cache.get(_key(days))
+        entry['computed_at'] -= seconds
+        cache.set(_key(days), entry)
+
+    def test_fresh_entry_is_served_without_recomputing(self):
+        from unittest import mock
+        from .cache import get_overview
+
+        first = get_overview(30)
+        with mock.patch('analytics.cache.compute_overview') as compute:
+            self.assertEqual(get_overview(30), first)
+        compute.assert_not_called()
+
+    def test_mo_write_serves_stale_and_refreshes_in_background(self):
+        from unittest import mock
+        from inventory.models import Product
+        from manufacturing.models import ManufacturingOrder
+        from .cache import get_overview
+
+        stale = get_overview(30)
+        product = Product.objects.create(name='Widget', sku='W1', product_type='FINISHED', unit_of_measure='units')
+        with self.captureOnCommitCallbacks(execute=True):
+            ManufacturingOrder.objects.create(product=product, qty=Decimal('1'))
+        with mock.patch('analytics.cache.refresh_in_background') as refresh:
+            self.assertEqual(get_overview(30), stale)
+        refresh.assert_called_once_with(30)
+
+    def test_stock_posting_invalidates(self):
+        from unittest import mock
+        from inventory.models import Product, StockBalance
+        from .cache import get_overview
+
+        get_overview(7)
+        product = Product.objects.create(name='Bolt', sku='B1', product_type='RAW', unit_of_measure='units')
+        with self.captureOnCommitCallbacks(execute=True):
+            StockBalance.objects.create(product=product, warehouse='MAIN', qty_on_hand=Decimal('5'))
+        with mock.patch('analytics.cache.refresh_in_background') as refresh:
+            get_overview(7)
+        refresh.assert_called_once_with(7)
+
+    def test_expired_entry_is_recomputed_inline(self):
+        from unittest import mock
+        from django.test import override_settings
+        from .cache import get_overview
+
+        get_overview(30)
+        with override_settings(ANALYTICS_OVERVIEW_CACHE_TTL=10, ANALYTICS_OVERVIEW_STALE_TTL=10):
+            self._age_entry(30, 5)
+            with mock.patch('analytics.cache.compute_overview', return_value={'fresh': False}) as compute:
+                get_overview(30)
+            compute.assert_not_called()
+            self._age_entry(30, 20)
+            with mock.patch('analytics.cache.compute_overview', return_value={'fresh': True}):
+                self.assertEqual(get_overview(30), {'fresh': True})
+
+    def test_request_joining_a_skipped_background_refresh_gets_data(self):
+        from concurrent.futures import Future
+        from unittest import mock
+        from django.test import override_settings
+        from . import cache as overview_cache
+
+        # a background refresh found another worker's lock and gave up
+        skipped = Future()
+        skipped.set_result(None)
+        key = overview_cache._key(9)
+        overview_cache._inflight[key] = skipped
+        try:
+            with override_settings(CACHE_IS_SHARED=True), \
+                    mock.patch('analytics.cache.compute_overview', return_value={'days': 9}):
+                self.assertEqual(overview_cache.get_overview(9), {'days': 9})
+        finally:
+            overview_cache._inflight.pop(key, None)
+
+    def test_cross_process_lock_only_with_a_shared_cache(self):
+        from django.core.cache import cache
+        from unittest import mock
+        from django.test import override_settings
+        from . import cache as overview_cache
+
+        # another process appears to hold the lock
+        cache.set(f'{overview_cache._key(5)}:lock', 1)
+        with override_settings(CACHE_IS_SHARED=True), \
+                mock.patch('analytics.cache.compute_overview', return_value={'days': 5}) as compute:
+            self.assertIsNone(overview_cache._compute(5, wait=False))
+        compute.assert_not_called()
+        # per-process cache: the lock means nothing, compute here
+        with override_settings(CACHE_IS_SHARED=False), \
+                mock.patch('analytics.cache.compute_overview', return_value={'days': 5}):
+            self.assertEqual(overview_cache._compute(5, wait=False), {'days': 5})
+
+    def test_concurrent_requests_share_one_computation(self):
+        import threading
+        import time
+        from unittest import mock
+        from .cache import get_overview
+
+        calls = []
+
+        def slow_overview(days):
+            calls.append(days)
+            time.sleep(0.2)
+            return {'days': days}
+
+        results = []
+        with mock.patch('analytics.cache.compute_overview', side_effect=slow_overview):
+            threads = [
+                threading.Thread(target=lambda: results.append(get_overview(14))) for _ in range(5)
+            ]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertEqual(calls, [14])
+        self.assertEqual(results, [{'days': 14}] * 5)
+
+
+class ParallelOverviewTests(TransactionTestCase):
+    # sections read on the pool threads' own connections, which cannot see
+    # the data of a TestCase transaction
+
+    def setUp(self):
+        from inventory.models import Product, StockBalance
+        from manufacturing.models import ManufacturingOrder
+
+        now = timezone.now()
+        for i, kind in enumerate(['RAW', 'FINISHED']):
+            product = Product.objects.create(
+                name=f'Item {i}', sku=f'PAR{i}', product_type=kind, unit_of_measure='units'
+            )
+            StockBalance.objects.create(product=product, warehouse='MAIN', qty_on_hand=Decimal(i + 3))
+        ManufacturingOrder.objects.create(
+            product=product, qty=Decimal('4'), status=ManufacturingOrder.Status.DONE,
+            due_date=now.date(), completed_at=now - timedelta(days=2),
+        )
+        ManufacturingOrder.objects.create(
+            product=product, qty=Decimal('1'), status=ManufacturingOrder.Status.RELEASED,
+            due_date=now.date() - timedelta(days=3),
+        )
+
+    def test_parallel_matches_serial(self):
+        from .services import compute_overview
+
+        parallel = compute_overview(30, parallel=True)
+        serial = compute_overview(30, parallel=False)
+        self.assertEqual(parallel, serial)
+        self.assertEqual(list(parallel), list(serial))
+        self.assertEqual(parallel['mos_completed'], 1)
+        self.assertEqual(len(parallel['delayed_orders']), 1)
+
+    def test_slow_or_failing_sections_give_partial_result(self):
+        import threading
+        from unittest import mock
+        from django.test import override_settings
+        from . import services
+
+        release = threading.Event()
+
+        def slow(start_dt, end_dt):
+            release.wait(5)
+            return {'delayed_orders': []}
+
+        def broken(start_dt, end_dt):
+            raise RuntimeError('boom')
+
+        sections = {'delayed_orders': slow, 'top_products': broken}
+        try:
+            with mock.patch.dict(services.OVERVIEW_SECTIONS, sections), override_settings(
+                ANALYTICS_OVERVIEW_SECTION_TIMEOUT=0.5
+            ), self.assertLogs('analytics.services', level='ERROR'):
+                result = services.compute_overview(30, parallel=True)
+        finally:
+            release.set()
+        self.assertTrue(result['partial'])
+        self.assertEqual(result['missing_sections'], ['top_products', 'delayed_orders'])
+        self.assertNotIn('delayed_orders', result)
+        self.assertEqual(result['mos_completed'], 1)
+        self.assertIn('order_status_breakdown', result)
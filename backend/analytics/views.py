@@ -3,7 +3,7 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import permissions, status
 
-from . import services as analytics_services
+from .cache import get_overview
 
 
 class IsOwnerOrReadOnly(permissions.BasePermission):
@@ -26,5 +26,5 @@ class AnalyticsOverviewView(APIView):
             return Response(
                 {"detail": "days must be > 0"}, status=status.HTTP_400_BAD_REQUEST
             )
-        data = analytics_services.compute_overview(days=days)
+        data = get_overview(days=days)
         return Response(data)
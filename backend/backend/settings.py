@@ -78,6 +78,9 @@ TEMPLATES = [
 ]
 
 WSGI_APPLICATION = "backend.wsgi.application"
+# the shop-floor event stream (/api/manufacturing/events/) is long-lived and
+# async: deploy with an ASGI server so it does not hold a WSGI worker per client
+ASGI_APPLICATION = "backend.asgi.application"
 
 
 # Database
@@ -147,6 +150,38 @@ SERVER_EMAIL = DEFAULT_FROM_EMAIL
 
 SITE_NAME = "Fabriq"
 
+# ATP timelines and the analytics overview are invalidated by bumping a
+# generation number in the default cache, which other worker processes only see
+# when the backend is shared (Redis, Memcached, the database cache), e.g.
+#   {"BACKEND": "django.core.cache.backends.redis.RedisCache", "LOCATION": "redis://127.0.0.1:6379"}
+# Set CACHE_IS_SHARED once it is. With the per-process LocMemCache below,
+# cached timelines only live a few seconds, so writes made by another worker
+# show up once they expire.
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+}
+CACHE_IS_SHARED = False
+
+# MO numbers are taken from a database sequence in blocks of this size per process
+MO_NUMBER_BLOCK_SIZE = 50
+MO_NUMBER_DEFAULT_PREFIX = "MO"
+# SKU prefix -> MO number prefix, e.g. {"BIKE-": "MOB"}; longest match wins
+MO_NUMBER_PREFIXES = {}
+
+# shop-floor event stream broker: "local" (single process) or "postgres" (LISTEN/NOTIFY)
+SHOP_FLOOR_EVENT_BROKER = "local"
+
+# analytics overview cache: seconds an entry is fresh, then seconds it may still
+# be served (stale) while a background refresh recomputes it
+ANALYTICS_OVERVIEW_CACHE_TTL = 60
+ANALYTICS_OVERVIEW_STALE_TTL = 300
+# evaluate the overview sections concurrently, on a pool of this many threads
+# (each with its own database connection); a section still running after the
+# timeout (seconds) is left out and the overview is flagged "partial"
+ANALYTICS_OVERVIEW_PARALLEL = False
+ANALYTICS_OVERVIEW_WORKERS = 6
+ANALYTICS_OVERVIEW_SECTION_TIMEOUT = 10
+
 AUTH_USER_MODEL = "account.CustomUser"
 
 # Custom User Model
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Product, StockLedgerEntry, StockBalance
+from .models import Product, StockLedgerEntry, StockBalance, ProductAvailability, StockReservation
 
 @admin.register(Product)
 class ProductAdmin(admin.ModelAdmin):
@@ -34,3 +34,15 @@ class StockBalanceAdmin(admin.ModelAdmin):
     list_filter = ('warehouse',)
     search_fields = ('product__name', 'product__sku', 'warehouse')
     raw_id_fields = ('product',)
+
+@admin.register(ProductAvailability)
+class ProductAvailabilityAdmin(admin.ModelAdmin):
+    list_display = ('product', 'on_hand', 'reserved', 'available', 'updated_at')
+    search_fields = ('product__name', 'product__sku')
+    readonly_fields = ('product', 'on_hand', 'reserved', 'available', 'updated_at')
+
+@admin.register(StockReservation)
+class StockReservationAdmin(admin.ModelAdmin):
+    list_display = ('id', 'mo', 'product', 'balance', 'qty', 'created_at')
+    search_fields = ('product__sku', 'mo__mo_number')
+    raw_id_fields = ('balance', 'product', 'mo')
@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from inventory.models import Product, ProductAvailability
+from inventory.services import (
+    compute_availability_from_balances,
+    refresh_product_availability,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Rebuild ProductAvailability from StockBalance in chunks of products. "
+        "With --verify-only, report drifted rows without writing."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=1000)
+        parser.add_argument(
+            "--verify-only",
+            action="store_true",
+            help="Only compare stored rows with StockBalance totals.",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        verify_only = options["verify_only"]
+        checked = drifted = 0
+        last_id = 0
+
+        while True:
+            ids = list(
+                Product.objects.filter(pk__gt=last_id)
+                .order_by("pk")
+                .values_list("pk", flat=True)[:chunk_size]
+            )
+            if not ids:
+                break
+            last_id = ids[-1]
+
+            expected = compute_availability_from_balances(ids)
+            stored = {
+                a.product_id: a
+                for a in ProductAvailability.objects.filter(product_id__in=ids)
+            }
+            stale = []
+            for pid, totals in expected.items():
+                row = stored.get(pid)
+                if row is None or any(
+                    getattr(row, field) != value for field, value in totals.items()
+                ):
+                    stale.append(pid)
+                    if verify_only:
+                        self.stdout.write(
+                            f"product {pid}: stored="
+                            f"{None if row is None else (row.on_hand, row.reserved, row.available)} "
+                            f"expected={(totals['on_hand'], totals['reserved'], totals['available'])}"
+                        )
+            checked += len(ids)
+            drifted += len(stale)
+
+            if stale and not verify_only:
+                with transaction.atomic():
+                    refresh_product_availability(stale)
+
+        action = "found" if verify_only else "rebuilt"
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Checked {checked} products, {action} {drifted} drifted rows."
+            )
+        )
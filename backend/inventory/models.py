@@ -29,6 +29,12 @@ class Product(models.Model):
         max_digits=18, decimal_places=4, default=Decimal("0.00")
     )
     default_warehouse = models.CharField(max_length=100, blank=True, null=True)
+    standard_cost = models.DecimalField(
+        max_digits=18,
+        decimal_places=4,
+        default=Decimal("0.00"),
+        help_text="Purchase/standard cost per unit, used by the BOM cost rollup",
+    )
 
     created_at = models.DateTimeField(default=timezone.now, editable=False)
     updated_at = models.DateTimeField(auto_now=True)
@@ -44,6 +50,13 @@ class Product(models.Model):
         ordering = ("sku",)
         indexes = [models.Index(fields=["sku", "name"])]
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remembered so post_save can tell a cost change (BOM cost rollup)
+        instance._loaded_standard_cost = instance.__dict__.get("standard_cost")
+        return instance
+
     def __str__(self):
         return f"{self.sku} - {self.name}"
 
@@ -114,3 +127,65 @@ class StockBalance(models.Model):
     def __str__(self):
         wh = self.warehouse or "global"
         return f"{self.product.sku} @ {wh}: on_hand={self.qty_on_hand} reserved={self.reserved_qty}"
+
+
+class ProductAvailability(models.Model):
+    """
+    Denormalized per-product totals over all StockBalance rows.
+    Maintained by inventory.services in the same transaction as every balance
+    mutation so availability checks are indexed point lookups instead of
+    GROUP BY queries over StockBalance.
+    """
+
+    product = models.OneToOneField(
+        Product,
+        primary_key=True,
+        on_delete=models.CASCADE,
+        related_name="availability",
+    )
+    on_hand = models.DecimalField(
+        max_digits=18, decimal_places=4, default=Decimal("0.00")
+    )
+    reserved = models.DecimalField(
+        max_digits=18, decimal_places=4, default=Decimal("0.00")
+    )
+    available = models.DecimalField(
+        max_digits=18, decimal_places=4, default=Decimal("0.00")
+    )
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name_plural = "Product availability"
+        indexes = [models.Index(fields=["available"])]
+
+    def __str__(self):
+        return f"{self.product_id}: available={self.available}"
+
+
+class StockReservation(models.Model):
+    """
+    Quantity of one StockBalance held for a manufacturing order.
+    StockBalance.reserved_qty is the sum of these rows; they record which
+    warehouse each hold was taken from so it can be released or consumed.
+    """
+
+    id = models.BigAutoField(primary_key=True)
+    balance = models.ForeignKey(
+        StockBalance, on_delete=models.CASCADE, related_name="reservations"
+    )
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="reservations"
+    )
+    mo = models.ForeignKey(
+        "manufacturing.ManufacturingOrder",
+        on_delete=models.CASCADE,
+        related_name="stock_reservations",
+    )
+    qty = models.DecimalField(max_digits=18, decimal_places=4)
+    created_at = models.DateTimeField(default=timezone.now, editable=False)
+
+    class Meta:
+        unique_together = ("mo", "balance")
+
+    def __str__(self):
+        return f"{self.qty} of {self.product_id} @ balance {self.balance_id} for MO {self.mo_id}"
@@ -15,6 +15,7 @@ class ProductSerializer(serializers.ModelSerializer):
             "unit_of_measure",
             "reorder_level",
             "default_warehouse",
+            "standard_cost",
             "created_at",
             "updated_at",
             "created_by",
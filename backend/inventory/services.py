@@ -1,13 +1,521 @@
+from collections import OrderedDict
 from decimal import Decimal
-from django.db.models import F, Sum
-from .models import StockBalance
+from typing import Dict, Iterable, List, Tuple
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Q, Sum, Value, When
+from django.utils import timezone
+
+from .models import (
+    Product,
+    ProductAvailability,
+    StockBalance,
+    StockLedgerEntry,
+    StockReservation,
+)
+
+QTY_QUANT = Decimal("0.0001")
+# number of balances touched by one conditional reservation UPDATE
+RESERVATION_BATCH_SIZE = 200
+RESERVATION_ATTEMPTS = 3
+
+
+class InsufficientStockError(ValueError):
+    """Raised when a posting would drive on-hand stock of a product below zero."""
+
+
+class _ReservationConflict(Exception):
+    """A conditional reservation UPDATE lost a race; re-plan and retry."""
 
 
 def aggregate_available_for_products(product_ids):
-    balances = (
+    """
+    Return {product_id: available} from the denormalized ProductAvailability rows.
+    Products without any StockBalance are absent from the mapping.
+    """
+    rows = ProductAvailability.objects.filter(product_id__in=product_ids).values_list(
+        "product_id", "available"
+    )
+    return {pid: (available or Decimal("0")) for pid, available in rows}
+
+
+def compute_availability_from_balances(product_ids) -> Dict[int, Dict]:
+    """
+    Aggregate StockBalance rows for product_ids in one GROUP BY query.
+    Returns {product_id: {"on_hand", "reserved", "available"}}; products with
+    no balance rows map to zeros.
+    """
+    totals = {
+        pid: {"on_hand": Decimal("0"), "reserved": Decimal("0")}
+        for pid in product_ids
+    }
+    rows = (
         StockBalance.objects.filter(product_id__in=product_ids)
-        .annotate(available=F("qty_on_hand") - F("reserved_qty"))
         .values("product_id")
-        .annotate(total_available=Sum("available"))
+        .annotate(on_hand=Sum("qty_on_hand"), reserved=Sum("reserved_qty"))
+    )
+    for row in rows:
+        totals[row["product_id"]] = {
+            "on_hand": row["on_hand"] or Decimal("0"),
+            "reserved": row["reserved"] or Decimal("0"),
+        }
+    for t in totals.values():
+        t["available"] = t["on_hand"] - t["reserved"]
+    return totals
+
+
+def refresh_product_availability(product_ids) -> None:
+    """
+    Recompute ProductAvailability for the given products from their StockBalance
+    rows and upsert them. Callers mutating StockBalance run this inside the same
+    transaction, after the balance writes, so the two tables never drift.
+    """
+    product_ids = sorted(set(product_ids))
+    if not product_ids:
+        return
+    totals = compute_availability_from_balances(product_ids)
+    now = timezone.now()
+    ProductAvailability.objects.bulk_create(
+        [
+            ProductAvailability(product_id=pid, updated_at=now, **t)
+            for pid, t in totals.items()
+        ],
+        update_conflicts=True,
+        unique_fields=["product"],
+        update_fields=["on_hand", "reserved", "available", "updated_at"],
+    )
+    # local import: manufacturing depends on inventory, not the other way round
+    from manufacturing.promise import timelines_changed
+
+    # local import: signals.py imports this module
+    from .signals import stock_levels_changed
+
+    timelines_changed()
+    stock_levels_changed.send(sender=ProductAvailability, product_ids=product_ids)
+
+
+def _lock_balances(product_ids: Iterable[int]) -> List[StockBalance]:
+    """
+    Lock every StockBalance row of the given products.
+    Rows are always locked in (product, warehouse, id) order so two postings
+    touching overlapping products acquire their locks in the same sequence
+    and cannot deadlock each other.
+    """
+    return list(
+        StockBalance.objects.select_for_update()
+        .filter(product_id__in=sorted(set(product_ids)))
+        .order_by("product_id", "warehouse", "id")
+    )
+
+
+def post_stock_movements(movements: List[Dict], created_by=None) -> List[StockLedgerEntry]:
+    """
+    Apply a batch of stock movements atomically.
+    Each movement is a dict:
+      {"product_id": int, "qty": Decimal (signed), "transaction_type": str, "notes": str,
+       "reservations": [(balance_id, qty), ...],  # optional
+       "mo_id": int}  # optional, tags the shop-floor event
+    Negative quantities first consume the listed reservations (releasing them),
+    then draw unreserved stock from the product's balances in lock order;
+    positive quantities land in the product's default warehouse balance
+    (created when the product has no balance yet).
+    All affected balances are locked once, written with a single bulk_update and
+    every ledger row is inserted with a single bulk_create.
+    Raises InsufficientStockError if any product would go below zero on hand.
+    """
+    movements = [m for m in movements if Decimal(m["qty"]) != 0]
+    if not movements:
+        return []
+
+    product_ids = sorted({int(m["product_id"]) for m in movements})
+    with transaction.atomic():
+        balances = _lock_balances(product_ids)
+        by_product: Dict[int, List[StockBalance]] = OrderedDict(
+            (pid, []) for pid in product_ids
+        )
+        for bal in balances:
+            by_product[bal.product_id].append(bal)
+
+        receiving = sorted(
+            {int(m["product_id"]) for m in movements if Decimal(m["qty"]) > 0}
+        )
+        warehouses = dict(
+            Product.objects.filter(pk__in=receiving).values_list(
+                "id", "default_warehouse"
+            )
+        )
+        # products receiving stock without any balance row get one in their default warehouse
+        missing = [pid for pid in receiving if not by_product[pid]]
+        if missing:
+            StockBalance.objects.bulk_create(
+                [StockBalance(product_id=pid, warehouse=warehouses.get(pid)) for pid in missing],
+                ignore_conflicts=True,
+            )
+            for bal in _lock_balances(missing):
+                by_product[bal.product_id].append(bal)
+
+        totals = {
+            pid: sum((b.qty_on_hand for b in rows), Decimal("0"))
+            for pid, rows in by_product.items()
+        }
+        touched: Dict[int, StockBalance] = {}
+        entries: List[StockLedgerEntry] = []
+        now = timezone.now()
+
+        for m in movements:
+            pid = int(m["product_id"])
+            qty = Decimal(m["qty"]).quantize(QTY_QUANT)
+            rows = by_product[pid]
+            if qty > 0:
+                target = next(
+                    (b for b in rows if b.warehouse == warehouses.get(pid)), rows[0]
+                )
+                target.qty_on_hand += qty
+                touched[target.pk] = target
+            else:
+                remaining = -qty
+                by_id = {b.pk: b for b in rows}
+                for balance_id, held in m.get("reservations", ()):
+                    bal = by_id[balance_id]
+                    take = min(Decimal(held), remaining)
+                    bal.reserved_qty -= Decimal(held)
+                    bal.qty_on_hand -= take
+                    remaining -= take
+                    touched[bal.pk] = bal
+                for bal in rows:
+                    if remaining <= 0:
+                        break
+                    take = min(bal.qty_on_hand - bal.reserved_qty, remaining)
+                    if take <= 0:
+                        continue
+                    bal.qty_on_hand -= take
+                    remaining -= take
+                    touched[bal.pk] = bal
+                if remaining > 0:
+                    raise InsufficientStockError(
+                        f"Insufficient stock for product {pid}: short by {remaining}."
+                    )
+            totals[pid] += qty
+            entries.append(
+                StockLedgerEntry(
+                    product_id=pid,
+                    transaction_type=m["transaction_type"],
+                    quantity_changed=qty,
+                    new_stock_quantity=totals[pid],
+                    notes=m.get("notes", ""),
+                    created_by=created_by,
+                    created_at=now,
+                )
+            )
+
+        for bal in touched.values():
+            bal.updated_at = now
+        StockBalance.objects.bulk_update(
+            list(touched.values()), ["qty_on_hand", "reserved_qty", "updated_at"]
+        )
+        Product.objects.bulk_update(
+            [Product(pk=pid, stock_quantity=totals[pid]) for pid in product_ids],
+            ["stock_quantity"],
+        )
+        refresh_product_availability(product_ids)
+        entries = StockLedgerEntry.objects.bulk_create(entries)
+        _publish_postings(movements, entries)
+        if receiving:
+            _notify_stock_increased(receiving)
+        return entries
+
+
+def _notify_stock_increased(product_ids, exclude_mo_ids=()):
+    # local import: signals.py imports this module
+    from .signals import stock_available_increased
+
+    stock_available_increased.send(
+        sender=StockBalance, product_ids=list(product_ids), exclude_mo_ids=exclude_mo_ids
     )
-    return {b["product_id"]: (b["total_available"] or Decimal("0")) for b in balances}
+
+
+def _publish_postings(movements: List[Dict], entries: List[StockLedgerEntry]):
+    # local import: manufacturing depends on inventory, not the other way round
+    from manufacturing.events import STOCK_POSTED, publish
+
+    for m, entry in zip(movements, entries):
+        publish(
+            STOCK_POSTED,
+            {
+                "product_id": entry.product_id,
+                "transaction_type": entry.transaction_type,
+                "quantity_changed": str(entry.quantity_changed),
+                "new_stock_quantity": str(entry.new_stock_quantity),
+            },
+            mo_id=m.get("mo_id"),
+        )
+
+
+def _plan_reservations(demand: Dict, product_ids: List[int]) -> List[Tuple]:
+    """
+    Split demand {(mo_id, product_id): qty} across the products' balances with
+    free stock, in (product, warehouse, id) order, using one read.
+    Returns [(mo_id, product_id, balance_id, qty), ...].
+    Raises InsufficientStockError listing every short product.
+    """
+    free: Dict[int, List[List]] = {pid: [] for pid in product_ids}
+    rows = (
+        StockBalance.objects.filter(product_id__in=product_ids)
+        .annotate(free=F("qty_on_hand") - F("reserved_qty"))
+        .filter(free__gt=0)
+        .order_by("product_id", "warehouse", "id")
+        .values_list("id", "product_id", "free")
+    )
+    for balance_id, pid, qty_free in rows:
+        free[pid].append([balance_id, qty_free])
+
+    plan = []
+    shortages = {}
+    for (mo_id, pid), required in demand.items():
+        remaining = required
+        for slot in free[pid]:
+            if remaining <= 0:
+                break
+            take = min(slot[1], remaining)
+            if take <= 0:
+                continue
+            slot[1] -= take
+            remaining -= take
+            plan.append((mo_id, pid, slot[0], take))
+        if remaining > 0:
+            shortages[pid] = shortages.get(pid, Decimal("0")) + remaining
+    if shortages:
+        detail = ", ".join(f"{pid}: short by {qty}" for pid, qty in sorted(shortages.items()))
+        raise InsufficientStockError(f"Insufficient available stock ({detail}).")
+    return plan
+
+
+def _apply_reservation_batch(batch: List[Tuple[int, Decimal]], now) -> None:
+    """
+    Reserve qty on each (balance_id, qty) with one conditional UPDATE:
+    every row must still have qty_on_hand - reserved_qty >= qty, otherwise
+    fewer rows match and the whole attempt is abandoned.
+    """
+    qty_field = DecimalField(max_digits=18, decimal_places=4)
+    condition = Q()
+    whens = []
+    for balance_id, qty in batch:
+        condition |= Q(pk=balance_id, qty_on_hand__gte=F("reserved_qty") + Value(qty, output_field=qty_field))
+        whens.append(When(pk=balance_id, then=Value(qty, output_field=qty_field)))
+    updated = StockBalance.objects.filter(condition).update(
+        reserved_qty=F("reserved_qty") + Case(*whens, output_field=qty_field),
+        updated_at=now,
+    )
+    if updated != len(batch):
+        raise _ReservationConflict()
+
+
+def reserve_materials(requests: List[Tuple[int, List[Dict]]]) -> List[StockReservation]:
+    """
+    Reserve stock for one or more manufacturing orders, all or nothing.
+    requests: [(mo_id, materials_snapshot), ...]
+    Demand is split across warehouses from a single read of free stock, then
+    applied with conditional F()-expression UPDATEs, one round trip per batch of
+    balances, without taking explicit row locks. If a concurrent writer consumed
+    the stock in between, the attempt is rolled back and re-planned.
+    Raises InsufficientStockError when the snapshot cannot be covered.
+    """
+    demand: Dict[Tuple[int, int], Decimal] = OrderedDict()
+    for mo_id, snapshot in requests:
+        for line in snapshot or []:
+            key = (mo_id, int(line["component_id"]))
+            demand[key] = demand.get(key, Decimal("0")) + Decimal(line["required_qty"])
+    demand = OrderedDict((k, v) for k, v in demand.items() if v > 0)
+    if not demand:
+        return []
+    product_ids = sorted({pid for _, pid in demand})
+
+    for _ in range(RESERVATION_ATTEMPTS):
+        plan = _plan_reservations(demand, product_ids)
+        per_balance: Dict[int, Decimal] = {}
+        for _mo, _pid, balance_id, qty in plan:
+            per_balance[balance_id] = per_balance.get(balance_id, Decimal("0")) + qty
+        items = sorted(per_balance.items())
+        now = timezone.now()
+        try:
+            with transaction.atomic():
+                for start in range(0, len(items), RESERVATION_BATCH_SIZE):
+                    _apply_reservation_batch(
+                        items[start : start + RESERVATION_BATCH_SIZE], now
+                    )
+                reservations = StockReservation.objects.bulk_create(
+                    [
+                        StockReservation(
+                            mo_id=mo_id,
+                            product_id=pid,
+                            balance_id=balance_id,
+                            qty=qty,
+                            created_at=now,
+                        )
+                        for mo_id, pid, balance_id, qty in plan
+                    ]
+                )
+                refresh_product_availability(product_ids)
+                _refresh_requirements({mo_id for mo_id, _pid in demand})
+                return reservations
+        except _ReservationConflict:
+            continue
+    raise InsufficientStockError(
+        "Could not reserve materials: stock changed concurrently, please retry."
+    )
+
+
+def _refresh_requirements(mo_ids):
+    # local import: manufacturing depends on inventory, not the other way round
+    from manufacturing.requirements import refresh_reserved
+
+    refresh_reserved(mo_ids)
+
+
+def release_reservations(mo_ids: Iterable[int]) -> Dict[int, Decimal]:
+    """
+    Release every reservation held by the given MOs in bulk: balances are locked
+    in the same order as postings, written with one bulk_update, and the
+    reservation rows removed with one DELETE.
+    Returns {product_id: released_qty}.
+    """
+    mo_ids = list(mo_ids)
+    with transaction.atomic():
+        held = list(
+            StockReservation.objects.select_for_update()
+            .filter(mo_id__in=mo_ids)
+            .order_by("id")
+            .values_list("id", "product_id", "balance_id", "qty")
+        )
+        if not held:
+            return {}
+        per_balance: Dict[int, Decimal] = {}
+        released: Dict[int, Decimal] = {}
+        for _id, pid, balance_id, qty in held:
+            per_balance[balance_id] = per_balance.get(balance_id, Decimal("0")) + qty
+            released[pid] = released.get(pid, Decimal("0")) + qty
+
+        balances = [
+            b for b in _lock_balances(released) if b.pk in per_balance
+        ]
+        now = timezone.now()
+        for bal in balances:
+            bal.reserved_qty = max(bal.reserved_qty - per_balance[bal.pk], Decimal("0"))
+            bal.updated_at = now
+        StockBalance.objects.bulk_update(balances, ["reserved_qty", "updated_at"])
+        StockReservation.objects.filter(pk__in=[h[0] for h in held]).delete()
+        refresh_product_availability(released)
+        _refresh_requirements(mo_ids)
+        _notify_stock_increased(released, exclude_mo_ids=mo_ids)
+        return released
+
+
+def apply_wo_completion(wo_id, completed_by, version=None):
+    """
+    Complete a WorkOrder and post the resulting stock movements.
+    - Marks the WO as COMPLETED and sets completed_at through the work-order
+      state machine (a compare-and-set on status and, if given, ``version``;
+      raises manufacturing.workflow.TransitionConflict when it does not match).
+    - When it was the last open WO of its MO, consumes the MO's materials_snapshot
+      and produces mo.qty of the finished product in the same transaction, then
+      marks the MO DONE. Otherwise the MO is moved to IN_PROGRESS.
+    The MO row is locked so concurrent completions of sibling work orders are
+    serialized on the MO; the WO itself is updated without a row lock.
+    Returns a JSON-ready dict describing the outcome.
+    """
+    # local import: manufacturing depends on inventory, not the other way round
+    from manufacturing.models import ManufacturingOrder, WorkOrder
+    from manufacturing.requirements import mark_consumed
+    from manufacturing.workflow import compare_and_set
+
+    with transaction.atomic():
+        mo_id, wc_id = WorkOrder.objects.values_list("mo_id", "work_center_id").get(
+            pk=wo_id
+        )
+        mo = ManufacturingOrder.objects.select_for_update().get(pk=mo_id)
+        completed_at = timezone.now()
+        new_version = compare_and_set(
+            wo_id,
+            "complete",
+            version=version,
+            scope=(mo_id, wc_id),
+            completed_at=completed_at,
+        )
+
+        result = {
+            "work_order_id": wo_id,
+            "status": WorkOrder.Status.COMPLETED,
+            "version": new_version,
+            "completed_at": completed_at.isoformat(),
+            "mo_id": mo.pk,
+            "stock_posted": False,
+            "ledger_entries": [],
+        }
+
+        if mo.work_orders.exclude(status=WorkOrder.Status.COMPLETED).exists():
+            if mo.status != ManufacturingOrder.Status.IN_PROGRESS:
+                mo.status = ManufacturingOrder.Status.IN_PROGRESS
+                mo.save(update_fields=["status", "updated_at"])
+            result["mo_status"] = mo.status
+            return result
+
+        ref = mo.mo_number or f"MO-{mo.pk}"
+        held: Dict[int, List[Tuple[int, Decimal]]] = {}
+        held_ids: Dict[int, List[int]] = {}
+        for res_id, pid, balance_id, qty in (
+            StockReservation.objects.filter(mo=mo)
+            .order_by("id")
+            .values_list("id", "product_id", "balance_id", "qty")
+        ):
+            held.setdefault(pid, []).append((balance_id, qty))
+            held_ids.setdefault(pid, []).append(res_id)
+        # one movement per component: a snapshot may list a component twice,
+        # and its reservations must only be consumed once
+        required: Dict[int, Decimal] = {}
+        for line in mo.materials_snapshot or []:
+            cid = int(line["component_id"])
+            required[cid] = required.get(cid, Decimal("0")) + Decimal(line["required_qty"])
+        movements = [
+            {
+                "product_id": cid,
+                "qty": -qty,
+                "transaction_type": StockLedgerEntry.TransactionType.STOCK_OUT,
+                "notes": f"{ref} Consumption",
+                "mo_id": mo.pk,
+                "reservations": held.get(cid, []),
+            }
+            for cid, qty in required.items()
+        ]
+        consumed_ids = [res_id for cid in required for res_id in held_ids.pop(cid, [])]
+        movements.append(
+            {
+                "product_id": mo.product_id,
+                "qty": Decimal(mo.qty),
+                "transaction_type": StockLedgerEntry.TransactionType.STOCK_IN,
+                "notes": f"{ref} Production",
+                "mo_id": mo.pk,
+            }
+        )
+        entries = post_stock_movements(movements, created_by=completed_by)
+        StockReservation.objects.filter(pk__in=consumed_ids).delete()
+        if held_ids:
+            # holds on components that are no longer part of the snapshot
+            release_reservations([mo.pk])
+        mark_consumed([mo.pk])
+
+        mo.status = ManufacturingOrder.Status.DONE
+        mo.completed_at = completed_at
+        mo.save(update_fields=["status", "completed_at", "updated_at"])
+
+        result["mo_status"] = mo.status
+        result["stock_posted"] = True
+        result["ledger_entries"] = [
+            {
+                "product_id": e.product_id,
+                "transaction_type": e.transaction_type,
+                "quantity_changed": str(e.quantity_changed),
+                "new_stock_quantity": str(e.new_stock_quantity),
+            }
+            for e in entries
+        ]
+        return result
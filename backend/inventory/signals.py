@@ -0,0 +1,33 @@
+from django.db.models import QuerySet
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import Signal, receiver
+
+from .models import StockBalance
+from .services import refresh_product_availability
+
+# Sent inside the posting transaction when available stock of ``product_ids``
+# may have gone up (receipts, released reservations, manual balance edits).
+# ``exclude_mo_ids`` are orders whose stock is being given back and must not
+# pick it up again.
+stock_available_increased = Signal()
+
+# Sent after ProductAvailability of ``product_ids`` was recomputed, i.e. after
+# every StockBalance write whichever path made it (bulk postings included).
+stock_levels_changed = Signal()
+
+
+@receiver(post_save, sender=StockBalance)
+def sync_availability_on_balance_save(sender, instance, **kwargs):
+    # ad-hoc saves (admin, shell, fixtures); service paths refresh explicitly
+    refresh_product_availability([instance.product_id])
+    stock_available_increased.send(
+        sender=StockBalance, product_ids=[instance.product_id], exclude_mo_ids=()
+    )
+
+
+@receiver(post_delete, sender=StockBalance)
+def sync_availability_on_balance_delete(sender, instance, origin=None, **kwargs):
+    # when the delete cascades from a Product, its availability row goes with it
+    origin_model = origin.model if isinstance(origin, QuerySet) else type(origin)
+    if origin is None or origin_model is StockBalance:
+        refresh_product_availability([instance.product_id])
@@ -4,6 +4,7 @@ from rest_framework import status
 from django.urls import reverse
 from .models import Product, StockBalance
 from decimal import Decimal
+from django.db.models import Sum
 
 class InventoryTests(APITestCase):
     def setUp(self):
@@ -70,3 +71,193 @@ class StockMovementTests(APITestCase):
             .values_list('qty_on_hand', flat=True)
         )
         self.assertEqual(total_stock, Decimal('150.00'))
+
+
+class WorkOrderCompletionPostingTests(APITestCase):
+    def setUp(self):
+        from manufacturing.models import ManufacturingOrder, WorkCenter, WorkOrder
+
+        self.raw = Product.objects.create(
+            name='Steel', sku='RAW001', product_type='RAW', unit_of_measure='kg'
+        )
+        self.finished = Product.objects.create(
+            name='Table', sku='FIN001', product_type='FINISHED',
+            unit_of_measure='units', default_warehouse='MAIN'
+        )
+        StockBalance.objects.create(product=self.raw, warehouse='A', qty_on_hand=Decimal('3.00'))
+        StockBalance.objects.create(product=self.raw, warehouse='B', qty_on_hand=Decimal('10.00'))
+        self.mo = ManufacturingOrder.objects.create(
+            product=self.finished,
+            qty=Decimal('2'),
+            materials_snapshot=[{'component_id': self.raw.id, 'required_qty': '5.0000'}],
+        )
+        wc = WorkCenter.objects.create(name='Assembly')
+        self.wo1 = WorkOrder.objects.create(mo=self.mo, operation_no=1, title='Cut', work_center=wc)
+        self.wo2 = WorkOrder.objects.create(mo=self.mo, operation_no=2, title='Weld', work_center=wc)
+
+    def test_stock_posted_only_when_last_work_order_completes(self):
+        from .services import apply_wo_completion
+        from .models import StockLedgerEntry
+
+        first = apply_wo_completion(self.wo1.id, None)
+        self.assertFalse(first['stock_posted'])
+        self.assertEqual(first['mo_status'], 'IN_PROGRESS')
+        self.assertEqual(StockLedgerEntry.objects.count(), 0)
+
+        second = apply_wo_completion(self.wo2.id, None)
+        self.assertTrue(second['stock_posted'])
+        self.assertEqual(second['mo_status'], 'DONE')
+        self.mo.refresh_from_db()
+        self.assertEqual(self.mo.completed_at.isoformat(), second['completed_at'])
+        # consumption drains warehouse A first, then B (lock order)
+        self.assertEqual(
+            list(StockBalance.objects.filter(product=self.raw).order_by('warehouse')
+                 .values_list('qty_on_hand', flat=True)),
+            [Decimal('0'), Decimal('8')],
+        )
+        produced = StockBalance.objects.get(product=self.finished)
+        self.assertEqual(produced.warehouse, 'MAIN')
+        self.assertEqual(produced.qty_on_hand, Decimal('2'))
+        self.assertEqual(StockLedgerEntry.objects.count(), 2)
+
+    def test_insufficient_stock_rolls_back(self):
+        from .services import apply_wo_completion, InsufficientStockError
+
+        self.mo.materials_snapshot = [{'component_id': self.raw.id, 'required_qty': '50'}]
+        self.mo.save()
+        apply_wo_completion(self.wo1.id, None)
+        with self.assertRaises(InsufficientStockError):
+            apply_wo_completion(self.wo2.id, None)
+        self.wo2.refresh_from_db()
+        self.assertEqual(self.wo2.status, 'PENDING')
+        self.assertEqual(StockBalance.objects.filter(product=self.finished).count(), 0)
+
+
+class ProductAvailabilityTests(APITestCase):
+    def setUp(self):
+        self.product = Product.objects.create(
+            name='Bolt', sku='BOLT01', product_type='RAW', unit_of_measure='units'
+        )
+
+    def test_balance_saves_keep_availability_in_sync(self):
+        from .models import ProductAvailability
+        from .services import aggregate_available_for_products
+
+        main = StockBalance.objects.create(
+            product=self.product, warehouse='MAIN', qty_on_hand=Decimal('20'), reserved_qty=Decimal('5')
+        )
+        StockBalance.objects.create(product=self.product, warehouse='AUX', qty_on_hand=Decimal('4'))
+        row = ProductAvailability.objects.get(product=self.product)
+        self.assertEqual((row.on_hand, row.reserved, row.available), (Decimal('24'), Decimal('5'), Decimal('19')))
+        self.assertEqual(aggregate_available_for_products([self.product.id]), {self.product.id: Decimal('19')})
+
+        main.delete()
+        row.refresh_from_db()
+        self.assertEqual(row.available, Decimal('4'))
+
+    def test_rebuild_command_repairs_drift(self):
+        from io import StringIO
+        from django.core.management import call_command
+        from .models import ProductAvailability
+
+        StockBalance.objects.create(product=self.product, warehouse='MAIN', qty_on_hand=Decimal('7'))
+        ProductAvailability.objects.filter(product=self.product).update(available=Decimal('0'))
+
+        out = StringIO()
+        call_command('rebuild_product_availability', '--verify-only', stdout=out)
+        self.assertIn('found 1 drifted', out.getvalue())
+        self.assertEqual(ProductAvailability.objects.get(product=self.product).available, Decimal('0'))
+
+        call_command('rebuild_product_availability', '--chunk-size', '1', stdout=StringIO())
+        self.assertEqual(ProductAvailability.objects.get(product=self.product).available, Decimal('7'))
+
+
+class StockReservationTests(APITestCase):
+    def setUp(self):
+        from manufacturing.models import ManufacturingOrder
+
+        self.raw = Product.objects.create(
+            name='Paint', sku='PAINT1', product_type='RAW', unit_of_measure='l'
+        )
+        self.finished = Product.objects.create(
+            name='Chair', sku='CHAIR1', product_type='FINISHED', unit_of_measure='units'
+        )
+        StockBalance.objects.create(product=self.raw, warehouse='A', qty_on_hand=Decimal('4'))
+        StockBalance.objects.create(product=self.raw, warehouse='B', qty_on_hand=Decimal('6'))
+        self.snapshot = [{'component_id': self.raw.id, 'required_qty': '7.0000'}]
+        self.mo1 = ManufacturingOrder.objects.create(
+            product=self.finished, qty=1, materials_snapshot=self.snapshot
+        )
+        self.mo2 = ManufacturingOrder.objects.create(
+            product=self.finished, qty=1, materials_snapshot=self.snapshot
+        )
+
+    def test_reservation_spans_warehouses_and_blocks_double_promise(self):
+        from .services import (
+            InsufficientStockError,
+            aggregate_available_for_products,
+            reserve_materials,
+        )
+
+        reservations = reserve_materials([(self.mo1.id, self.snapshot)])
+        self.assertEqual(sorted(r.qty for r in reservations), [Decimal('3'), Decimal('4')])
+        self.assertEqual(aggregate_available_for_products([self.raw.id])[self.raw.id], Decimal('3'))
+
+        with self.assertRaises(InsufficientStockError):
+            reserve_materials([(self.mo2.id, self.snapshot)])
+        self.assertEqual(
+            sum(StockBalance.objects.filter(product=self.raw).values_list('reserved_qty', flat=True)),
+            Decimal('7'),
+        )
+
+    def test_release_restores_availability(self):
+        from .models import StockReservation
+        from .services import aggregate_available_for_products, release_reservations, reserve_materials
+
+        reserve_materials([(self.mo1.id, self.snapshot)])
+        released = release_reservations([self.mo1.id])
+        self.assertEqual(released, {self.raw.id: Decimal('7')})
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(aggregate_available_for_products([self.raw.id])[self.raw.id], Decimal('10'))
+
+    def test_completion_consumes_reserved_stock(self):
+        from manufacturing.models import WorkCenter, WorkOrder
+        from .models import StockReservation
+        from .services import apply_wo_completion, reserve_materials
+
+        reserve_materials([(self.mo1.id, self.snapshot)])
+        wo = WorkOrder.objects.create(
+            mo=self.mo1, operation_no=1, title='Paint', work_center=WorkCenter.objects.create(name='Booth')
+        )
+        apply_wo_completion(wo.id, None)
+        balances = StockBalance.objects.filter(product=self.raw)
+        self.assertEqual(sum(b.qty_on_hand for b in balances), Decimal('3'))
+        self.assertEqual(sum(b.reserved_qty for b in balances), Decimal('0'))
+        self.assertFalse(StockReservation.objects.exists())
+
+    def test_completion_consumes_duplicate_snapshot_lines_once(self):
+        from manufacturing.models import WorkCenter, WorkOrder
+        from .models import StockLedgerEntry, StockReservation
+        from .services import apply_wo_completion, reserve_materials
+
+        split = [
+            {'component_id': self.raw.id, 'required_qty': '3.0000'},
+            {'component_id': self.raw.id, 'required_qty': '4.0000'},
+        ]
+        self.mo1.materials_snapshot = split
+        self.mo1.save(update_fields=['materials_snapshot'])
+        reserve_materials([(self.mo1.id, split)])
+        wo = WorkOrder.objects.create(
+            mo=self.mo1, operation_no=1, title='Paint', work_center=WorkCenter.objects.create(name='Booth')
+        )
+        apply_wo_completion(wo.id, None)
+        balances = StockBalance.objects.filter(product=self.raw)
+        self.assertEqual(sum(b.qty_on_hand for b in balances), Decimal('3'))
+        self.assertEqual(sum(b.reserved_qty for b in balances), Decimal('0'))
+        self.assertFalse(StockReservation.objects.exists())
+        self.assertEqual(
+            StockLedgerEntry.objects.filter(
+                product=self.raw, transaction_type=StockLedgerEntry.TransactionType.STOCK_OUT
+            ).aggregate(total=Sum('quantity_changed'))['total'],
+            Decimal('-7'),
+        )
@@ -41,3 +41,22 @@ class ProductViewSet(viewsets.ModelViewSet):
 
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
+
+    @action(detail=True, methods=["get"], url_path="projection")
+    def projection(self, request, pk=None):
+        """
+        GET /api/inventory/products/{pk}/projection/?days=90
+        Projected on-hand per day from open manufacturing orders' production
+        and consumption.
+        """
+        # local import: manufacturing depends on inventory, not the other way round
+        from manufacturing.projection import HORIZON_DAYS, get_projection
+
+        product = self.get_object()
+        try:
+            days = int(request.query_params.get("days", HORIZON_DAYS))
+        except ValueError:
+            return Response(
+                {"days": "Must be an integer."}, status=status.HTTP_400_BAD_REQUEST
+            )
+        return Response(get_projection(product.pk, days=days))
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import WorkCenter, BillOfMaterials, BOMItem, BOMOperation, ManufacturingOrder, WorkOrder
+from .models import WorkCenter, BillOfMaterials, BOMItem, BOMOperation, ManufacturingOrder, MaterialRequirement, WorkOrder
 
 @admin.register(WorkCenter)
 class WorkCenterAdmin(admin.ModelAdmin):
@@ -9,7 +9,7 @@ class WorkCenterAdmin(admin.ModelAdmin):
 
 @admin.register(BillOfMaterials)
 class BillOfMaterialsAdmin(admin.ModelAdmin):
-    list_display = ('product', 'version', 'effective_from', 'created_at')
+    list_display = ('product', 'version', 'output_qty', 'effective_from', 'created_at')
     list_filter = ('effective_from', 'version')
     search_fields = ('product__name', 'product__sku', 'version')
     readonly_fields = ('created_at', 'updated_at')
@@ -29,16 +29,23 @@ class BOMOperationAdmin(admin.ModelAdmin):
 
 @admin.register(ManufacturingOrder)
 class ManufacturingOrderAdmin(admin.ModelAdmin):
-    list_display = ('mo_number', 'product', 'qty', 'due_date', 'status', 'created_at')
+    list_display = ('mo_number', 'product', 'qty', 'due_date', 'status', 'created_at', 'completed_at')
     list_filter = ('status', 'due_date')
     search_fields = ('mo_number', 'product__name', 'notes')
-    readonly_fields = ('created_at', 'updated_at')
+    readonly_fields = ('created_at', 'updated_at', 'completed_at')
     raw_id_fields = ('product', 'linked_bom')
 
 @admin.register(WorkOrder)
 class WorkOrderAdmin(admin.ModelAdmin):
-    list_display = ('mo', 'operation_no', 'title', 'work_center', 'status', 'assigned_to')
+    list_display = ('mo', 'operation_no', 'title', 'work_center', 'status', 'assigned_to', 'planned_start', 'planned_end')
     list_filter = ('status', 'work_center')
     search_fields = ('title', 'mo__mo_number', 'notes')
     readonly_fields = ('created_at', 'updated_at')
     raw_id_fields = ('mo', 'work_center', 'assigned_to')
+
+@admin.register(MaterialRequirement)
+class MaterialRequirementAdmin(admin.ModelAdmin):
+    list_display = ('mo', 'component', 'required_qty', 'reserved_qty', 'consumed_qty', 'mo_status')
+    list_filter = ('mo_status',)
+    search_fields = ('mo__mo_number', 'component__sku', 'component__name')
+    raw_id_fields = ('mo', 'component')
@@ -0,0 +1,119 @@
+"""
+Where-used index over the active BOMs (see models.BOMClosure).
+
+A change to the BOM of product P can only alter the closure rows of P and of
+P's ancestors, which the closure itself lists. refresh_closure recomputes
+just those products bottom-up, reusing the stored rows of every unaffected
+sub-assembly instead of walking its tree again.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, Iterable, Tuple
+
+from django.db import transaction
+
+from .explosion import BOMCycleError, active_boms_for_products, line_factor
+from .models import BillOfMaterials, BOMClosure, BOMItem
+
+QTY_QUANT = Decimal("0.00000001")
+BATCH_SIZE = 2000
+
+# {descendant_id: (qty_per_unit, depth)}
+Closure = Dict[int, Tuple[Decimal, int]]
+
+
+def _compute(affected, lines, stored) -> Dict[int, Closure]:
+    memo: Dict[int, Closure] = {}
+    on_path = []
+
+    def visit(product_id) -> Closure:
+        if product_id in memo:
+            return memo[product_id]
+        if product_id in on_path:
+            cycle = on_path[on_path.index(product_id):] + [product_id]
+            raise BOMCycleError(
+                "BOM cycle detected: " + " -> ".join(f"product {p}" for p in cycle)
+            )
+        on_path.append(product_id)
+        closure: Closure = {}
+
+        def add(descendant, qty, depth):
+            old_qty, old_depth = closure.get(descendant, (Decimal("0"), depth))
+            closure[descendant] = (old_qty + qty, min(old_depth, depth))
+
+        for component_id, factor in lines.get(product_id, ()):
+            add(component_id, factor, 1)
+            below = visit(component_id) if component_id in affected else stored.get(component_id, {})
+            for descendant, (qty, depth) in below.items():
+                add(descendant, factor * qty, depth + 1)
+        on_path.pop()
+        memo[product_id] = closure
+        return closure
+
+    return {product_id: visit(product_id) for product_id in affected}
+
+
+@transaction.atomic
+def refresh_closure(product_ids: Iterable[int]) -> int:
+    """
+    Recompute the closure rows of ``product_ids`` and of everything that uses
+    them. Raises BOMCycleError (rolling back) if the active BOMs now form a
+    cycle. Returns the number of rows written.
+    """
+    product_ids = set(product_ids)
+    if not product_ids:
+        return 0
+    affected = product_ids | set(
+        BOMClosure.objects.filter(descendant_id__in=product_ids).values_list(
+            "ancestor_id", flat=True
+        )
+    )
+    active = active_boms_for_products(affected)
+    bom_product = {bom_id: product_id for product_id, (bom_id, _) in active.items()}
+    lines = defaultdict(list)
+    for bom_id, component_id, qty_per_unit, scrap_pct in BOMItem.objects.filter(
+        bom_id__in=list(bom_product)
+    ).values_list("bom_id", "component_id", "qty_per_unit", "scrap_pct"):
+        lines[bom_product[bom_id]].append((component_id, line_factor(qty_per_unit, scrap_pct)))
+
+    outside = {c for rows in lines.values() for c, _ in rows} - affected
+    stored: Dict[int, Closure] = defaultdict(dict)
+    for ancestor, descendant, qty, depth in BOMClosure.objects.filter(
+        ancestor_id__in=outside
+    ).values_list("ancestor_id", "descendant_id", "qty_per_unit", "depth"):
+        stored[ancestor][descendant] = (qty, depth)
+
+    computed = _compute(affected, lines, stored)
+    BOMClosure.objects.filter(ancestor_id__in=affected).delete()
+    rows = [
+        BOMClosure(
+            ancestor_id=ancestor,
+            descendant_id=descendant,
+            qty_per_unit=qty.quantize(QTY_QUANT),
+            depth=depth,
+        )
+        for ancestor, closure in computed.items()
+        for descendant, (qty, depth) in closure.items()
+    ]
+    BOMClosure.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    return len(rows)
+
+
+@transaction.atomic
+def rebuild_closure() -> int:
+    """Recompute the whole closure from the active BOMs."""
+    BOMClosure.objects.all().delete()
+    return refresh_closure(
+        set(BillOfMaterials.objects.values_list("product_id", flat=True).distinct())
+    )
+
+
+def where_used(component_id: int, max_depth=None, finished_only=False):
+    """Closure rows whose descendant is ``component_id``, nearest users first."""
+    qs = BOMClosure.objects.filter(descendant_id=component_id).select_related("ancestor")
+    if max_depth is not None:
+        qs = qs.filter(depth__lte=max_depth)
+    if finished_only:
+        qs = qs.filter(ancestor__product_type="FINISHED")
+    return qs.order_by("depth", "ancestor__sku")
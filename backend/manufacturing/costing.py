@@ -0,0 +1,226 @@
+"""
+Standard-cost rollup for bills of materials.
+
+Per unit of a BOM's product:
+- material: sum of line factor (qty_per_unit incl. scrap) x component unit
+  cost, where a component with its own active BOM costs that BOM's total and
+  any other component its Product.standard_cost;
+- labour: sum of BOMOperation.est_hours x WorkCenter.cost_per_hour, divided
+  by the BOM's output_qty;
+- overhead: sum of BOMOperation.est_hours x WorkCenter.overhead_per_hour,
+  divided by output_qty.
+(est_hours is per run of the routing, as in the WorkOrders an MO gets; one run
+yields output_qty units.)
+
+The graph is loaded in a fixed number of queries and costed level by level
+(Kahn's algorithm), so a full-catalog run never recurses per product. Results
+are cached in BOMCost; the invalidate_* helpers drop only the rows above a
+change, using the where-used closure to find the ancestors.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, Iterable, Optional
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from inventory.models import Product
+
+from .explosion import BOMCycleError, _pick_active, line_factor
+from .models import BillOfMaterials, BOMClosure, BOMCost, BOMItem, BOMOperation
+
+COST_QUANT = Decimal("0.0001")
+COST_FIELDS = ("material_cost", "labour_cost", "overhead_cost", "unit_cost")
+BATCH_SIZE = 1000
+
+
+def _scope(bom_ids):
+    """BOM rows to cost: everything, or the requested BOMs plus all BOMs below them."""
+    boms = BillOfMaterials.objects.all()
+    if bom_ids is not None:
+        # a non-active BOM's lines are not in the closure, so start from them too
+        roots = set(
+            BillOfMaterials.objects.filter(pk__in=bom_ids).values_list("product_id", flat=True)
+        ) | set(
+            BOMItem.objects.filter(bom_id__in=bom_ids).values_list("component_id", flat=True)
+        )
+        below = set(
+            BOMClosure.objects.filter(ancestor_id__in=roots).values_list(
+                "descendant_id", flat=True
+            )
+        )
+        boms = boms.filter(Q(pk__in=bom_ids) | Q(product_id__in=roots | below))
+    return list(boms.values_list("id", "product_id", "updated_at"))
+
+
+def rollup_costs(
+    bom_ids: Optional[Iterable[int]] = None, force: bool = False
+) -> Dict[int, Dict[str, Decimal]]:
+    """
+    Return {bom_id: {material_cost, labour_cost, overhead_cost, unit_cost}}
+    for ``bom_ids`` (default: every BOM). Valid cached rows are reused unless
+    ``force``; everything recomputed is written back to BOMCost.
+    Raises BOMCycleError if the active BOMs contain a cycle.
+    """
+    requested = None if bom_ids is None else set(bom_ids)
+    if requested is not None and not force:
+        # invalidation drops every row above a change, so a row stamped with
+        # its BOM's current updated_at is still good for the whole subtree
+        hits = {
+            row.bom_id: {f: getattr(row, f) for f in COST_FIELDS}
+            for row in BOMCost.objects.filter(
+                bom_id__in=requested, bom_updated_at=F("bom__updated_at")
+            )
+        }
+        if len(hits) == len(requested):
+            return hits
+    rows = _scope(requested)
+    if not rows:
+        return {}
+    versions = {bom_id: updated_at for bom_id, _, updated_at in rows}
+    active = {pid: bom_id for pid, (bom_id, _) in _pick_active(rows).items()}
+    needed = set(versions) if requested is None else (requested & set(versions)) | set(
+        active.values()
+    )
+
+    lines = defaultdict(list)
+    for bom_id, component_id, qty, scrap in BOMItem.objects.filter(
+        bom_id__in=needed
+    ).values_list("bom_id", "component_id", "qty_per_unit", "scrap_pct"):
+        lines[bom_id].append((component_id, line_factor(qty, scrap)))
+    routing = defaultdict(lambda: [Decimal("0"), Decimal("0")])
+    for bom_id, hours, output, rate, overhead in BOMOperation.objects.filter(
+        bom_id__in=needed
+    ).values_list(
+        "bom_id",
+        "est_hours",
+        "bom__output_qty",
+        "work_center__cost_per_hour",
+        "work_center__overhead_per_hour",
+    ):
+        # hours per unit of output
+        hours = Decimal(hours or 0) / (Decimal(output) if output else Decimal("1"))
+        routing[bom_id][0] += hours * Decimal(rate or 0)
+        routing[bom_id][1] += hours * Decimal(overhead or 0)
+    purchased = dict(
+        Product.objects.filter(
+            pk__in={c for bom_lines in lines.values() for c, _ in bom_lines}
+        ).values_list("id", "standard_cost")
+    )
+    cached = {}
+    if not force:
+        for row in BOMCost.objects.filter(bom_id__in=needed):
+            if row.bom_updated_at == versions.get(row.bom_id):
+                cached[row.bom_id] = {f: getattr(row, f) for f in COST_FIELDS}
+
+    # Kahn: a BOM is ready once the active BOMs of all its components are costed
+    waiting_on = {}
+    dependents = defaultdict(list)
+    for bom_id in needed:
+        deps = {active[c] for c, _ in lines[bom_id] if c in active} - {bom_id}
+        if any(active.get(c) == bom_id for c, _ in lines[bom_id]):
+            raise BOMCycleError(f"BOM cycle detected: BOM {bom_id} contains its own product")
+        waiting_on[bom_id] = len(deps)
+        for dep in deps:
+            dependents[dep].append(bom_id)
+
+    results: Dict[int, Dict[str, Decimal]] = {}
+    level = [b for b, n in waiting_on.items() if n == 0]
+    while level:
+        next_level = []
+        for bom_id in level:
+            results[bom_id] = cached.get(bom_id) or _cost(
+                lines[bom_id], routing.get(bom_id), active, results, purchased
+            )
+            for parent in dependents[bom_id]:
+                waiting_on[parent] -= 1
+                if waiting_on[parent] == 0:
+                    next_level.append(parent)
+        level = next_level
+    if len(results) != len(needed):
+        stuck = sorted(b for b in needed if b not in results)
+        raise BOMCycleError(
+            "BOM cycle detected among: " + ", ".join(f"BOM {b}" for b in stuck)
+        )
+
+    _store({b: results[b] for b in results if b not in cached}, versions)
+    if requested is None:
+        return results
+    return {b: results[b] for b in requested if b in results}
+
+
+def _cost(bom_lines, routing, active, results, purchased) -> Dict[str, Decimal]:
+    material = Decimal("0")
+    for component_id, factor in bom_lines:
+        if component_id in active:
+            unit = results[active[component_id]]["unit_cost"]
+        else:
+            unit = Decimal(purchased.get(component_id) or 0)
+        material += factor * unit
+    labour, overhead = routing or (Decimal("0"), Decimal("0"))
+    cost = {
+        "material_cost": material.quantize(COST_QUANT),
+        "labour_cost": labour.quantize(COST_QUANT),
+        "overhead_cost": overhead.quantize(COST_QUANT),
+    }
+    cost["unit_cost"] = cost["material_cost"] + cost["labour_cost"] + cost["overhead_cost"]
+    return cost
+
+
+def _store(computed, versions):
+    if not computed:
+        return
+    now = timezone.now()
+    BOMCost.objects.bulk_create(
+        [
+            BOMCost(bom_id=bom_id, bom_updated_at=versions[bom_id], computed_at=now, **cost)
+            for bom_id, cost in computed.items()
+        ],
+        update_conflicts=True,
+        unique_fields=["bom"],
+        update_fields=[*COST_FIELDS, "bom_updated_at", "computed_at"],
+        batch_size=BATCH_SIZE,
+    )
+
+
+def _ancestors(product_ids):
+    return set(
+        BOMClosure.objects.filter(descendant_id__in=product_ids).values_list(
+            "ancestor_id", flat=True
+        )
+    )
+
+
+@transaction.atomic
+def invalidate_products(product_ids: Iterable[int]) -> int:
+    """A product's standard cost changed: drop the BOMs using it and everything above."""
+    product_ids = set(product_ids)
+    direct = set(
+        BOMItem.objects.filter(component_id__in=product_ids).values_list("bom_id", flat=True)
+    )
+    if not direct:
+        return 0
+    parents = set(
+        BillOfMaterials.objects.filter(pk__in=direct).values_list("product_id", flat=True)
+    )
+    deleted, _ = BOMCost.objects.filter(
+        Q(bom_id__in=direct) | Q(bom__product_id__in=parents | _ancestors(parents))
+    ).delete()
+    return deleted
+
+
+@transaction.atomic
+def invalidate_boms(bom_ids: Iterable[int]) -> int:
+    """BOM lines, routing or rates changed: drop those BOMs and everything above."""
+    bom_ids = set(bom_ids)
+    if not bom_ids:
+        return 0
+    products = set(
+        BillOfMaterials.objects.filter(pk__in=bom_ids).values_list("product_id", flat=True)
+    )
+    deleted, _ = BOMCost.objects.filter(
+        Q(bom_id__in=bom_ids) | Q(bom__product_id__in=_ancestors(products))
+    ).delete()
+    return deleted
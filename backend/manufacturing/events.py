@@ -0,0 +1,213 @@
+"""
+Shop-floor event stream.
+
+Work order transitions, MO status changes and stock postings are published
+here once their transaction commits, and fanned out to the SSE subscribers
+served by views.shop_floor_events. Two brokers are available, chosen with
+settings.SHOP_FLOOR_EVENT_BROKER:
+
+- "local" (default): in-process fan-out. Only clients connected to the same
+  worker process see an event, which is enough for a single ASGI worker.
+- "postgres": events go through pg_notify on one channel and every process
+  runs a LISTEN thread that feeds its own local fan-out, so all workers see
+  every event.
+"""
+
+import asyncio
+import itertools
+import json
+import logging
+import select
+import threading
+from typing import Dict, List, Optional
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "shop_floor_events"
+QUEUE_SIZE = 1000
+
+WORK_ORDER_STATUS = "work_order.status"
+MO_STATUS = "manufacturing_order.status"
+STOCK_POSTED = "stock.posted"
+
+
+class Subscription:
+    """One connected client: an asyncio queue plus its filters."""
+
+    def __init__(self, broker, loop, work_center_id=None, mo_id=None):
+        self.broker = broker
+        self.loop = loop
+        self.work_center_id = work_center_id
+        self.mo_id = mo_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+        self.dropped = 0
+
+    def matches(self, event: Dict) -> bool:
+        if self.work_center_id is not None and event.get("work_center_id") != self.work_center_id:
+            return False
+        if self.mo_id is not None and event.get("mo_id") != self.mo_id:
+            return False
+        return True
+
+    def _put(self, event):
+        # runs on the subscriber's loop; a client that stops reading loses events
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+    def close(self):
+        self.broker.unsubscribe(self)
+
+
+class LocalBroker:
+    def __init__(self):
+        self._subscriptions: List[Subscription] = []
+        self._lock = threading.Lock()
+        self._ids = itertools.count(1)
+
+    def subscribe(self, work_center_id=None, mo_id=None, loop=None) -> Subscription:
+        sub = Subscription(
+            self, loop or asyncio.get_running_loop(), work_center_id=work_center_id, mo_id=mo_id
+        )
+        with self._lock:
+            self._subscriptions.append(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription):
+        with self._lock:
+            if sub in self._subscriptions:
+                self._subscriptions.remove(sub)
+
+    def publish(self, event: Dict):
+        self.dispatch(event)
+
+    def dispatch(self, event: Dict):
+        """Hand an event to every matching subscriber of this process."""
+        event.setdefault("id", next(self._ids))
+        with self._lock:
+            targets = [sub for sub in self._subscriptions if sub.matches(event)]
+        for sub in targets:
+            try:
+                sub.loop.call_soon_threadsafe(sub._put, event)
+            except RuntimeError:
+                # the subscriber's loop is gone; the client disconnected
+                self.unsubscribe(sub)
+
+
+class PostgresBroker(LocalBroker):
+    """
+    Publishes with pg_notify; a daemon thread per process LISTENs on its own
+    connection and dispatches what it receives to the local subscribers.
+    """
+
+    POLL_SECONDS = 5
+
+    def __init__(self, alias="default"):
+        super().__init__()
+        self.alias = alias
+        self._listener: Optional[threading.Thread] = None
+
+    def subscribe(self, *args, **kwargs) -> Subscription:
+        self._ensure_listener()
+        return super().subscribe(*args, **kwargs)
+
+    def publish(self, event: Dict):
+        with connections[self.alias].cursor() as cursor:
+            cursor.execute("SELECT pg_notify(%s, %s)", [CHANNEL, json.dumps(event)])
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._listener is None or not self._listener.is_alive():
+                self._listener = threading.Thread(
+                    target=self._listen, name="shop-floor-listener", daemon=True
+                )
+                self._listener.start()
+
+    def _listen(self):
+        conn = connections.create_connection(self.alias)
+        try:
+            conn.ensure_connection()
+            raw = conn.connection
+            raw.autocommit = True
+            with raw.cursor() as cursor:
+                cursor.execute(f"LISTEN {CHANNEL}")
+            while True:
+                for payload in self._wait(raw):
+                    try:
+                        self.dispatch(json.loads(payload))
+                    except ValueError:
+                        logger.warning("Ignoring malformed shop-floor event: %r", payload)
+        except Exception:
+            logger.exception("Shop-floor event listener stopped")
+        finally:
+            conn.close()
+
+    def _wait(self, raw):
+        if hasattr(raw, "poll"):
+            # psycopg2
+            if select.select([raw], [], [], self.POLL_SECONDS) != ([], [], []):
+                raw.poll()
+                while raw.notifies:
+                    yield raw.notifies.pop(0).payload
+        else:
+            # psycopg 3
+            for notify in raw.notifies(timeout=self.POLL_SECONDS):
+                yield notify.payload
+
+
+_BROKERS = {"local": LocalBroker, "postgres": PostgresBroker}
+_broker = None
+_broker_lock = threading.Lock()
+
+
+def get_broker() -> LocalBroker:
+    global _broker
+    if _broker is None:
+        with _broker_lock:
+            if _broker is None:
+                name = getattr(settings, "SHOP_FLOOR_EVENT_BROKER", "local")
+                _broker = _BROKERS[name]()
+    return _broker
+
+
+def publish(event_type: str, data: Dict, work_center_id=None, mo_id=None):
+    """
+    Queue an event for delivery when the current transaction commits (at once
+    outside a transaction). Nothing is sent for work that is rolled back.
+    """
+    event = {
+        "type": event_type,
+        "work_center_id": work_center_id,
+        "mo_id": mo_id,
+        "at": timezone.now().isoformat(),
+        "data": data,
+    }
+    transaction.on_commit(lambda: _send(event))
+
+
+def _send(event):
+    try:
+        get_broker().publish(event)
+    except Exception:
+        # a broken event channel must never fail the request that committed
+        logger.exception("Could not publish shop-floor event %s", event["type"])
+
+
+def publish_work_order_changes(rows):
+    """rows: iterable of (wo_id, mo_id, work_center_id, status, version)."""
+    for wo_id, mo_id, work_center_id, status, version in rows:
+        publish(
+            WORK_ORDER_STATUS,
+            {"work_order_id": wo_id, "status": status, "version": version},
+            work_center_id=work_center_id,
+            mo_id=mo_id,
+        )
+
+
+def publish_mo_status(mo_id, status):
+    publish(MO_STATUS, {"mo_id": mo_id, "status": status}, mo_id=mo_id)
@@ -0,0 +1,188 @@
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.core.cache import cache
+
+from .models import BillOfMaterials, BOMItem
+
+CACHE_PREFIX = "bom-explosion"
+CACHE_TIMEOUT = 60 * 60 * 24
+
+
+class BOMCycleError(ValueError):
+    """Raised when a BOM (directly or through sub-assemblies) contains itself."""
+
+
+def _pick_active(rows: Iterable[Tuple[int, int, object]]) -> Dict[int, Tuple[int, object]]:
+    """
+    From (bom_id, product_id, updated_at) rows return {product_id: (bom_id, updated_at)}.
+    A product's most recently created BOM is the one used to explode it.
+    """
+    active: Dict[int, Tuple[int, object]] = {}
+    for bom_id, product_id, updated_at in rows:
+        if product_id not in active or bom_id > active[product_id][0]:
+            active[product_id] = (bom_id, updated_at)
+    return active
+
+
+def active_boms_for_products(product_ids) -> Dict[int, Tuple[int, object]]:
+    """Return {product_id: (bom_id, updated_at)} for products that have a BOM."""
+    if not product_ids:
+        return {}
+    return _pick_active(
+        BillOfMaterials.objects.filter(product_id__in=product_ids).values_list(
+            "id", "product_id", "updated_at"
+        )
+    )
+
+
+def line_factor(qty_per_unit, scrap_pct) -> Decimal:
+    """Quantity of a component consumed per unit of its parent, scrap included."""
+    return Decimal(qty_per_unit) * (Decimal("1") + Decimal(scrap_pct or 0) / Decimal("100"))
+
+
+def _load_tree(root_ids: List[int]):
+    """
+    Load every BOM reachable from root_ids level by level: one BOMItem query and
+    one BillOfMaterials query per level, however many roots are loaded at once.
+    Returns (lines, active) where lines is {bom_id: [(component_id, factor)]}
+    and active is {product_id: (bom_id, updated_at)} for every component seen.
+    """
+    lines: Dict[int, List[Tuple[int, Decimal]]] = {}
+    active: Dict[int, Tuple[int, object]] = {}
+    seen_products = set()
+    frontier = list(root_ids)
+    while frontier:
+        for bom_id in frontier:
+            lines.setdefault(bom_id, [])
+        new_products = set()
+        for bom_id, component_id, qty_per_unit, scrap_pct in BOMItem.objects.filter(
+            bom_id__in=frontier
+        ).values_list("bom_id", "component_id", "qty_per_unit", "scrap_pct"):
+            lines[bom_id].append((component_id, line_factor(qty_per_unit, scrap_pct)))
+            if component_id not in seen_products:
+                new_products.add(component_id)
+        seen_products |= new_products
+        found = active_boms_for_products(new_products)
+        active.update(found)
+        frontier = sorted({bom_id for bom_id, _ in found.values()} - set(lines))
+    return lines, active
+
+
+def _flatten(root_id: int, lines, active, memo) -> Dict[int, Decimal]:
+    """Depth-first flatten of one BOM into {leaf_component_id: qty per unit}."""
+    on_path = []
+
+    def visit(bom_id):
+        if bom_id in memo:
+            return memo[bom_id]
+        if bom_id in on_path:
+            cycle = on_path[on_path.index(bom_id):] + [bom_id]
+            raise BOMCycleError(
+                "BOM cycle detected: " + " -> ".join(f"BOM {b}" for b in cycle)
+            )
+        on_path.append(bom_id)
+        vector: Dict[int, Decimal] = {}
+        for component_id, factor in lines[bom_id]:
+            if component_id not in active:
+                vector[component_id] = vector.get(component_id, Decimal("0")) + factor
+                continue
+            for leaf, qty in visit(active[component_id][0]).items():
+                vector[leaf] = vector.get(leaf, Decimal("0")) + factor * qty
+        on_path.pop()
+        memo[bom_id] = vector
+        return vector
+
+    return visit(root_id)
+
+
+def _cache_key(bom_id, updated_at) -> str:
+    return f"{CACHE_PREFIX}:{bom_id}:{updated_at.timestamp() if updated_at else 0}"
+
+
+def _current_fingerprints(entries) -> Dict[str, object]:
+    """
+    One query re-validates any number of cached explosions: for every product in
+    their fingerprints, return the BOM that would be chosen now.
+    """
+    products = {int(p) for entry in entries for p in entry["fingerprint"]}
+    return {
+        str(product): [bom_id, updated_at.isoformat()]
+        for product, (bom_id, updated_at) in active_boms_for_products(products).items()
+    }
+
+
+def explode_boms(
+    boms: Iterable[BillOfMaterials], errors: Optional[Dict[int, str]] = None
+) -> Dict[int, Dict[int, Decimal]]:
+    """
+    Return the flattened per-unit requirement vector for each BOM:
+    {bom_id: {leaf_component_id: qty_per_unit_incl_scrap}}.
+    Components that have their own BOM are exploded recursively (scrap applied
+    at every level). Vectors are cached per (bom id, updated_at) and validated
+    with a single query on reuse; misses for all BOMs are loaded together in a
+    bounded number of queries (two per BOM level).
+    Raises BOMCycleError if a BOM contains itself, unless an ``errors`` dict is
+    given: cyclic BOMs are then recorded there ({bom_id: message}) and left out
+    of the result.
+    """
+    boms = list(boms)
+    result: Dict[int, Dict[int, Decimal]] = {}
+    keys = {bom.pk: _cache_key(bom.pk, bom.updated_at) for bom in boms}
+    cached = cache.get_many(list(keys.values())) if keys else {}
+    current = _current_fingerprints(cached.values()) if cached else {}
+    misses = []
+    for bom in boms:
+        entry = cached.get(keys[bom.pk])
+        if entry is not None and all(
+            current.get(product) == expected
+            for product, expected in entry["fingerprint"].items()
+        ):
+            result[bom.pk] = {int(c): Decimal(q) for c, q in entry["vector"].items()}
+        else:
+            misses.append(bom.pk)
+    if not misses:
+        return result
+
+    lines, active = _load_tree(misses)
+    memo: Dict[int, Dict[int, Decimal]] = {}
+    to_cache = {}
+    for bom_id in misses:
+        try:
+            vector = _flatten(bom_id, lines, active, memo)
+        except BOMCycleError as e:
+            if errors is None:
+                raise
+            errors[bom_id] = str(e)
+            continue
+        result[bom_id] = vector
+        # every product reachable from this BOM, with the BOM chosen for it (or None)
+        reachable = set()
+        stack = [bom_id]
+        visited = set()
+        while stack:
+            node = stack.pop()
+            if node in visited:
+                continue
+            visited.add(node)
+            for component_id, _ in lines[node]:
+                reachable.add(component_id)
+                if component_id in active:
+                    stack.append(active[component_id][0])
+        fingerprint = {
+            str(p): (
+                [active[p][0], active[p][1].isoformat()] if p in active else None
+            )
+            for p in reachable
+        }
+        to_cache[keys[bom_id]] = {
+            "fingerprint": fingerprint,
+            "vector": {str(c): str(q) for c, q in vector.items()},
+        }
+    cache.set_many(to_cache, CACHE_TIMEOUT)
+    return result
+
+
+def explode_bom(bom: BillOfMaterials) -> Dict[int, Decimal]:
+    """Flattened per-unit requirement vector of a single BOM."""
+    return explode_boms([bom])[bom.pk]
@@ -0,0 +1,42 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from manufacturing.models import ManufacturingOrder
+from manufacturing.requirements import write_requirements
+
+
+class Command(BaseCommand):
+    help = (
+        "Create MaterialRequirement rows from existing materials snapshots, "
+        "in batches. MOs that already have rows are skipped unless --rebuild."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+        parser.add_argument(
+            "--rebuild", action="store_true", help="Rewrite rows for every MO."
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        qs = (
+            ManufacturingOrder.objects.exclude(materials_snapshot__isnull=True)
+            .only("id", "status", "materials_snapshot")
+            .order_by("pk")
+        )
+        if not options["rebuild"]:
+            qs = qs.filter(material_requirements__isnull=True)
+        migrated = 0
+        rows = 0
+        last_id = 0
+        while True:
+            mos = list(qs.filter(pk__gt=last_id)[:chunk_size])
+            if not mos:
+                break
+            last_id = mos[-1].pk
+            with transaction.atomic():
+                rows += len(write_requirements(mos))
+            migrated += len(mos)
+        self.stdout.write(
+            self.style.SUCCESS(f"Wrote {rows} requirement rows for {migrated} orders.")
+        )
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from manufacturing.projection import HORIZON_DAYS, build_projections
+
+
+class Command(BaseCommand):
+    help = (
+        f"Rebuild the {HORIZON_DAYS}-day projected stock of every product from the "
+        "open manufacturing orders. Run daily so projections start on today."
+    )
+
+    def handle(self, *args, **options):
+        rows = build_projections()
+        self.stdout.write(self.style.SUCCESS(f"Projected {rows} products."))
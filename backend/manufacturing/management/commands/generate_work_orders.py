@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from manufacturing.models import ManufacturingOrder
+from manufacturing.services import generate_work_orders_for_mos
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate missing work orders for open manufacturing orders "
+        "(e.g. after an import) in chunks, one bulk insert per chunk."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--chunk-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        closed = (ManufacturingOrder.Status.DONE, ManufacturingOrder.Status.CANCELLED)
+        qs = (
+            ManufacturingOrder.objects.exclude(status__in=closed)
+            .filter(linked_bom__isnull=False)
+            .only("id", "linked_bom_id")
+            .order_by("pk")
+        )
+        created = 0
+        last_id = 0
+        while True:
+            mos = list(qs.filter(pk__gt=last_id)[:chunk_size])
+            if not mos:
+                break
+            last_id = mos[-1].pk
+            with transaction.atomic():
+                created += len(generate_work_orders_for_mos(mos))
+        self.stdout.write(self.style.SUCCESS(f"Created {created} work orders."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from manufacturing.closure import rebuild_closure
+
+
+class Command(BaseCommand):
+    help = "Rebuild the BOM where-used closure table from the active BOMs."
+
+    def handle(self, *args, **options):
+        rows = rebuild_closure()
+        self.stdout.write(self.style.SUCCESS(f"Wrote {rows} closure rows."))
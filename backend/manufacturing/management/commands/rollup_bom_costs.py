@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from manufacturing.costing import rollup_costs
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute the standard cost of every BOM bottom-up and refresh the "
+        "cost cache. Without --force, still-valid cached costs are kept."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--force", action="store_true")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            costs = rollup_costs(force=options["force"])
+        self.stdout.write(self.style.SUCCESS(f"Costed {len(costs)} BOMs."))
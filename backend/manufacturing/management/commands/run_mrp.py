@@ -0,0 +1,45 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from manufacturing.mrp import run_mrp
+
+
+class Command(BaseCommand):
+    help = (
+        "Net all open manufacturing orders against stock and report per-component "
+        "shortage dates and suggested purchase quantities."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--json", action="store_true", help="Print the full result as JSON."
+        )
+        parser.add_argument(
+            "--all",
+            action="store_true",
+            help="List every component with demand, not only those needing a purchase.",
+        )
+
+    def handle(self, *args, **options):
+        result = run_mrp()
+        if options["json"]:
+            self.stdout.write(json.dumps(result, indent=2))
+            return
+
+        rows = result["components"]
+        if not options["all"]:
+            rows = [r for r in rows if r["suggested_purchase_qty"] != "0.0000"]
+        for r in rows:
+            self.stdout.write(
+                f"{r['sku'] or r['component_id']}: demand={r['demand_qty']} "
+                f"supply={r['supply_qty']} shortage={r['shortage_qty']} "
+                f"first_short={r['first_shortage_date'] or '-'} "
+                f"buy={r['suggested_purchase_qty']}"
+            )
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"MRP netted {result['open_mos']} open orders, "
+                f"{len(rows)} components listed."
+            )
+        )
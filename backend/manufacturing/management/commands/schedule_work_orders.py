@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from manufacturing.scheduling import schedule_work_orders
+
+
+class Command(BaseCommand):
+    help = (
+        "Assign planned start/end times to open work orders with the "
+        "finite-capacity scheduler. With --mo only the work centers downstream "
+        "of the given manufacturing orders are rescheduled."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--mo", type=int, action="append", dest="mo_ids")
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            summary = schedule_work_orders(mo_ids=options["mo_ids"])
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Scheduled {summary['scheduled']} work orders on "
+                f"{summary['work_centers']} work centers "
+                f"({summary['updated']} updated, horizon {summary['horizon_end']})."
+            )
+        )
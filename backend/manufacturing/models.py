@@ -9,6 +9,9 @@ class WorkCenter(models.Model):
     description = models.TextField(blank=True)
     capacity = models.PositiveIntegerField(default=1, help_text="Concurrent operators")
     cost_per_hour = models.DecimalField(max_digits=12, decimal_places=2, default=0.00)
+    overhead_per_hour = models.DecimalField(
+        max_digits=12, decimal_places=2, default=0.00, help_text="Overhead absorbed per hour"
+    )
     location = models.CharField(max_length=255, blank=True)
     tags = models.JSONField(null=True, blank=True, help_text="List of tags or metadata")
 
@@ -30,6 +33,12 @@ class BillOfMaterials(models.Model):
     product = models.ForeignKey(Product, on_delete=models.PROTECT, related_name="boms")
     version = models.CharField(max_length=64, default="v1")
     effective_from = models.DateField(null=True, blank=True)
+    output_qty = models.DecimalField(
+        max_digits=18,
+        decimal_places=6,
+        default=1,
+        help_text="Units of product one run of the routing yields (operation hours are per run)",
+    )
     notes = models.TextField(blank=True)
 
     created_at = models.DateTimeField(default=timezone.now, editable=False)
@@ -123,13 +132,25 @@ class ManufacturingOrder(models.Model):
 
     created_at = models.DateTimeField(default=timezone.now, editable=False)
     updated_at = models.DateTimeField(auto_now=True)
+    # set with status DONE when the last work order completes
+    completed_at = models.DateTimeField(null=True, blank=True)
     created_by = models.ForeignKey(
         settings.AUTH_USER_MODEL, null=True, blank=True, on_delete=models.SET_NULL
     )
 
+    class Meta:
+        indexes = [models.Index(fields=["status", "completed_at"])]
+
     def __str__(self):
         return self.mo_number or f"MO-{self.pk}"
 
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        # remembered so post_save can tell a status change (shop-floor events)
+        instance._loaded_status = instance.__dict__.get("status")
+        return instance
+
 
 class WorkOrder(models.Model):
     class Status(models.TextChoices):
@@ -164,6 +185,17 @@ class WorkOrder(models.Model):
     )
     started_at = models.DateTimeField(null=True, blank=True)
     completed_at = models.DateTimeField(null=True, blank=True)
+    planned_start = models.DateTimeField(
+        null=True, blank=True, help_text="Set by the finite-capacity scheduler"
+    )
+    planned_end = models.DateTimeField(null=True, blank=True)
+    version = models.PositiveIntegerField(
+        default=0, help_text="Bumped by every status transition (optimistic locking)"
+    )
+    transition_token = models.UUIDField(
+        null=True, blank=True, editable=False,
+        help_text="Written by each bulk transition, to tell its rows from a concurrent one's",
+    )
     notes = models.TextField(blank=True)
 
     created_at = models.DateTimeField(default=timezone.now, editable=False)
@@ -175,6 +207,115 @@ class WorkOrder(models.Model):
     class Meta:
         ordering = ("mo", "operation_no")
         unique_together = ("mo", "operation_no")
+        indexes = [models.Index(fields=["work_center", "planned_start"])]
 
     def __str__(self):
         return f"WO {self.mo.mo_number or self.mo.pk} - Op {self.operation_no}: {self.title}"
+
+
+class MaterialRequirement(models.Model):
+    """
+    One row per (MO, component) of ManufacturingOrder.materials_snapshot, kept
+    in step with it so "which open MOs need component X" is an index lookup.
+    mo_status mirrors the MO's status for the (component, mo_status) index.
+    """
+
+    mo = models.ForeignKey(
+        ManufacturingOrder,
+        on_delete=models.CASCADE,
+        related_name="material_requirements",
+    )
+    component = models.ForeignKey(
+        Product, on_delete=models.PROTECT, related_name="material_requirements"
+    )
+    required_qty = models.DecimalField(max_digits=18, decimal_places=4)
+    reserved_qty = models.DecimalField(max_digits=18, decimal_places=4, default=0)
+    consumed_qty = models.DecimalField(max_digits=18, decimal_places=4, default=0)
+    mo_status = models.CharField(max_length=32, choices=ManufacturingOrder.Status.choices)
+
+    class Meta:
+        unique_together = ("mo", "component")
+        indexes = [models.Index(fields=["component", "mo_status"])]
+
+    def __str__(self):
+        return f"{self.mo} needs {self.required_qty} x {self.component_id}"
+
+
+class BOMClosure(models.Model):
+    """
+    Transitive closure of the active BOMs: one row per (ancestor product,
+    descendant component) reachable through them, with the total quantity of
+    the descendant per unit of the ancestor (summed over all paths, scrap
+    included) and the length of the shortest path. Maintained by
+    manufacturing.closure; read by the where-used API.
+    """
+
+    ancestor = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="bom_descendants"
+    )
+    descendant = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="bom_ancestors"
+    )
+    qty_per_unit = models.DecimalField(max_digits=28, decimal_places=8)
+    depth = models.PositiveSmallIntegerField()
+
+    class Meta:
+        unique_together = ("ancestor", "descendant")
+        indexes = [models.Index(fields=["descendant", "depth"])]
+
+    def __str__(self):
+        return f"{self.ancestor_id} -> {self.descendant_id} x {self.qty_per_unit}"
+
+
+class BOMCost(models.Model):
+    """
+    Cached standard cost per unit of a BOM's product, rolled up bottom-up by
+    manufacturing.costing. bom_updated_at is the BOM version the row was
+    computed for; rows are deleted when anything below them changes.
+    """
+
+    bom = models.OneToOneField(
+        BillOfMaterials, on_delete=models.CASCADE, primary_key=True, related_name="cost"
+    )
+    material_cost = models.DecimalField(max_digits=18, decimal_places=4)
+    labour_cost = models.DecimalField(max_digits=18, decimal_places=4)
+    overhead_cost = models.DecimalField(max_digits=18, decimal_places=4)
+    unit_cost = models.DecimalField(max_digits=18, decimal_places=4)
+    bom_updated_at = models.DateTimeField()
+    computed_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"{self.bom}: {self.unit_cost}"
+
+
+class ProductProjection(models.Model):
+    """
+    Projected stock change of a product over the next days, built by
+    manufacturing.projection. ``deltas`` packs one little-endian int64 per day
+    from start_date: the cumulative net change from open MOs (production minus
+    consumption) in units of 0.0001. Projected on-hand is the current on-hand
+    plus that day's delta, so stock postings never rewrite the row.
+    """
+
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, primary_key=True, related_name="projection"
+    )
+    start_date = models.DateField()
+    deltas = models.BinaryField()
+    computed_at = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return f"Projection of {self.product_id} from {self.start_date}"
+
+
+class NumberSequence(models.Model):
+    """
+    Block counter backing MO number allocation on databases without native
+    sequences (PostgreSQL uses a real SEQUENCE, see manufacturing.numbering).
+    """
+
+    name = models.CharField(max_length=64, primary_key=True)
+    last_value = models.BigIntegerField(default=0)
+
+    def __str__(self):
+        return f"{self.name}: {self.last_value}"
@@ -0,0 +1,140 @@
+import os
+import threading
+from contextlib import contextmanager
+from typing import List, Tuple
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connection, connections, transaction
+from django.db.models import Max
+
+from .models import ManufacturingOrder, NumberSequence
+
+MO_NUMBER_SEQUENCE = "manufacturing_mo_number_seq"
+
+
+def _block_size() -> int:
+    return max(int(getattr(settings, "MO_NUMBER_BLOCK_SIZE", 50)), 1)
+
+
+def mo_number_prefix(sku: str) -> str:
+    """
+    Prefix for an MO number, chosen by the longest matching SKU prefix in
+    settings.MO_NUMBER_PREFIXES (e.g. {"BIKE-": "MOB"}), else "MO".
+    """
+    prefixes = getattr(settings, "MO_NUMBER_PREFIXES", {}) or {}
+    for sku_prefix in sorted(prefixes, key=len, reverse=True):
+        if sku and sku.startswith(sku_prefix):
+            return prefixes[sku_prefix]
+    return getattr(settings, "MO_NUMBER_DEFAULT_PREFIX", "MO")
+
+
+def _first_free_number() -> int:
+    # numbers used to be derived from the primary key; start past them
+    return (ManufacturingOrder.objects.aggregate(m=Max("id"))["m"] or 0) + 1
+
+
+@contextmanager
+def _autocommit_connection():
+    """
+    A private connection to the default database, in autocommit mode, so the
+    sequence DDL never runs inside (and dies with) a caller's transaction.
+    """
+    conn = connections.create_connection(DEFAULT_DB_ALIAS)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+
+class _BlockAllocator:
+    """
+    Hands out MO numbers from blocks reserved in the database, so a process
+    only goes to the database once per block.
+
+    On PostgreSQL a block is one nextval() on a sequence created (on its own
+    autocommit connection) with INCREMENT BY MO_NUMBER_BLOCK_SIZE. nextval is
+    never rolled back, so a cached block stays ours whatever the caller's
+    transaction does. The block is the sequence's actual increment: changing
+    the setting later needs an ALTER SEQUENCE.
+
+    Elsewhere a NumberSequence row is bumped on the caller's connection (SQLite
+    has a single writer, so a second connection would wait on the caller).
+    Inside a transaction that bump can still roll back, so the block then
+    only serves the current call and its unused rest is dropped.
+
+    Numbers are unique across processes but not gap-free.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = None
+        self._next = 0
+        self._end = 0
+        self._sequence_ready = False
+
+    def _sequence_block(self) -> Tuple[int, int]:
+        if not self._sequence_ready:
+            with _autocommit_connection() as conn, conn.cursor() as cursor:
+                cursor.execute(
+                    f"CREATE SEQUENCE IF NOT EXISTS {MO_NUMBER_SEQUENCE} "
+                    f"INCREMENT BY {_block_size()} START WITH {_first_free_number()}"
+                )
+            self._sequence_ready = True
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT nextval(%s), increment_by FROM pg_sequences "
+                "WHERE schemaname = current_schema() AND sequencename = %s",
+                [MO_NUMBER_SEQUENCE, MO_NUMBER_SEQUENCE],
+            )
+            return cursor.fetchone()
+
+    def _counter_block(self) -> Tuple[int, int]:
+        block = _block_size()
+        with transaction.atomic():
+            seq, created = NumberSequence.objects.select_for_update().get_or_create(
+                name=MO_NUMBER_SEQUENCE,
+                defaults={"last_value": _first_free_number() - 1},
+            )
+            start = seq.last_value + 1
+            seq.last_value += block
+            seq.save(update_fields=["last_value"])
+        return start, block
+
+    def _fetch_block(self) -> None:
+        if connection.vendor == "postgresql":
+            start, block = self._sequence_block()
+        else:
+            start, block = self._counter_block()
+        self._next, self._end = start, start + block
+
+    def take(self, count: int) -> List[int]:
+        numbers: List[int] = []
+        with self._lock:
+            if self._pid != os.getpid():
+                # a forked worker must not reuse its parent's block
+                self._pid, self._next, self._end = os.getpid(), 0, 0
+            while len(numbers) < count:
+                if self._next >= self._end:
+                    self._fetch_block()
+                take = min(count - len(numbers), self._end - self._next)
+                numbers.extend(range(self._next, self._next + take))
+                self._next += take
+            if connection.vendor != "postgresql" and connection.in_atomic_block:
+                # the counter bump may still roll back with the caller
+                self._next = self._end = 0
+        return numbers
+
+
+_allocator = _BlockAllocator()
+
+
+def allocate_mo_numbers(skus: List[str]) -> List[str]:
+    """Return one new MO number per product SKU, e.g. "MO-000042"."""
+    return [
+        f"{mo_number_prefix(sku)}-{n:06d}"
+        for sku, n in zip(skus, _allocator.take(len(skus)))
+    ]
+
+
+def allocate_mo_number(sku: str) -> str:
+    return allocate_mo_numbers([sku])[0]
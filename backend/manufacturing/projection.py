@@ -0,0 +1,183 @@
+"""
+Projected on-hand per product and day.
+
+Every open MO adds its qty of the product on the day the ATP timelines book it
+(promise.supply_dates: the end of its last scheduled work order, else its due
+date) and takes its unconsumed MaterialRequirement quantities (the
+materials_snapshot) of each component on its due date; past-due or undated
+changes count as today and anything beyond the horizon is left out. All
+products are bucketed into one (products x days) int64 grid with NumPy and
+summed along the days in a single pass, in the same 0.0001 units as mrp.
+
+Only the cumulative change is stored (ProductProjection.deltas): current
+on-hand is added when the projection is read, so stock postings do not touch
+it. MO saves, requirement writes and rescheduled work orders queue their
+products, and each transaction rebuilds everything it queued once, after it
+commits. Reads never write: a projection built on an earlier day is served
+from today on until the daily build_stock_projections run replaces it.
+"""
+
+import threading
+from datetime import date, timedelta
+from typing import Dict, Iterable, Optional
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+
+from inventory.models import ProductAvailability
+
+from .models import ManufacturingOrder, MaterialRequirement, ProductProjection
+from .promise import supply_dates
+from .units import from_units, to_units
+
+HORIZON_DAYS = 90
+OPEN_STATUSES = (
+    ManufacturingOrder.Status.PLANNED,
+    ManufacturingOrder.Status.RELEASED,
+    ManufacturingOrder.Status.IN_PROGRESS,
+    ManufacturingOrder.Status.AWAITING_MATERIALS,
+)
+DTYPE = np.dtype("<i8")
+BATCH_SIZE = 1000
+
+# products queued by refresh_for_mos in this thread, rebuilt on commit
+_pending = threading.local()
+
+
+def build_projections(
+    product_ids: Optional[Iterable[int]] = None, today: Optional[date] = None
+) -> int:
+    """
+    Rebuild the stored projections of ``product_ids`` (default: every product)
+    and return how many rows were written. Products without open MO activity
+    in the horizon have their row removed.
+    """
+    today = today or timezone.localdate()
+    today_ord = today.toordinal()
+    scope = None if product_ids is None else sorted(set(product_ids))
+
+    supply = ManufacturingOrder.objects.filter(status__in=OPEN_STATUSES)
+    demand = MaterialRequirement.objects.filter(mo_status__in=OPEN_STATUSES)
+    if scope is not None:
+        supply = supply.filter(product_id__in=scope)
+        demand = demand.filter(component_id__in=scope)
+    pids, dues, qtys = [], [], []
+    for pid, qty, day in supply_dates(supply):
+        pids.append(pid)
+        dues.append(day.toordinal() if day else today_ord)
+        qtys.append(to_units(qty))
+    for pid, due_date, required, consumed in demand.values_list(
+        "component_id", "mo__due_date", "required_qty", "consumed_qty"
+    ):
+        pids.append(pid)
+        dues.append(due_date.toordinal() if due_date else today_ord)
+        qtys.append(-to_units(required - consumed))
+
+    pid_arr = np.asarray(pids, dtype=np.int64)
+    day_arr = np.maximum(np.asarray(dues, dtype=np.int64) - today_ord, 0)
+    qty_arr = np.asarray(qtys, dtype=np.int64)
+    keep = (day_arr < HORIZON_DAYS) & (qty_arr != 0)
+    products, rows = np.unique(pid_arr[keep], return_inverse=True)
+    grid = np.zeros((len(products), HORIZON_DAYS), dtype=np.int64)
+    np.add.at(grid, (rows, day_arr[keep]), qty_arr[keep])
+    cumulative = np.cumsum(grid, axis=1).astype(DTYPE)
+
+    now = timezone.now()
+    written = [int(p) for p in products]
+    with transaction.atomic():
+        stale = ProductProjection.objects.exclude(product_id__in=written)
+        if scope is not None:
+            stale = stale.filter(product_id__in=scope)
+        stale.delete()
+        ProductProjection.objects.bulk_create(
+            [
+                ProductProjection(
+                    product_id=pid,
+                    start_date=today,
+                    deltas=cumulative[i].tobytes(),
+                    computed_at=now,
+                )
+                for i, pid in enumerate(written)
+            ],
+            update_conflicts=True,
+            unique_fields=["product"],
+            update_fields=["start_date", "deltas", "computed_at"],
+            batch_size=BATCH_SIZE,
+        )
+    return len(written)
+
+
+def refresh_for_mos(mo_ids: Iterable[int]):
+    """
+    The MOs were created, rescheduled or closed: rebuild the projections of
+    their products and components when the transaction commits. Calls within
+    one transaction are merged into a single rebuild.
+    """
+    mo_ids = list(mo_ids)
+    if not mo_ids:
+        return
+    product_ids = set(
+        ManufacturingOrder.objects.filter(pk__in=mo_ids).values_list(
+            "product_id", flat=True
+        )
+    ) | set(
+        MaterialRequirement.objects.filter(mo_id__in=mo_ids).values_list(
+            "component_id", flat=True
+        )
+    )
+    if not product_ids:
+        return
+    queued = _pending.__dict__.setdefault("product_ids", set())
+    queued |= product_ids
+    # every call registers the flush, so a rolled-back registration cannot
+    # strand the queue; the first flush after commit takes it all
+    transaction.on_commit(_flush, robust=True)
+
+
+def _flush():
+    product_ids = _pending.__dict__.pop("product_ids", None)
+    if product_ids:
+        build_projections(product_ids)
+
+
+def get_projection(product_id: int, days: int = HORIZON_DAYS, today=None) -> Dict:
+    """
+    Projected on-hand of one product for ``days`` days from today, read from
+    the stored row. A row built on an earlier day is shifted to start today
+    (days past its horizon repeat its last value) and flagged "stale"; a
+    product without a row had no open MO activity at the last build.
+    """
+    today = today or timezone.localdate()
+    days = max(1, min(days, HORIZON_DAYS))
+    row = ProductProjection.objects.filter(product_id=product_id).first()
+    deltas = np.zeros(days, dtype=DTYPE)
+    if row is not None:
+        stored = np.frombuffer(bytes(row.deltas), dtype=DTYPE)
+        offset = max((today - row.start_date).days, 0)
+        window = stored[offset : offset + days]
+        deltas[: len(window)] = window
+        deltas[len(window) :] = stored[-1] if len(stored) else 0
+    on_hand = (
+        ProductAvailability.objects.filter(product_id=product_id)
+        .values_list("on_hand", flat=True)
+        .first()
+    ) or 0
+    projected = to_units(on_hand) + deltas
+    short = np.flatnonzero(projected < 0)
+    return {
+        "product_id": product_id,
+        "start_date": today.isoformat(),
+        "stale": row is not None and row.start_date != today,
+        "on_hand": str(from_units(to_units(on_hand))),
+        "first_shortage_date": (
+            (today + timedelta(days=int(short[0]))).isoformat() if len(short) else None
+        ),
+        "days": [
+            {
+                "date": (today + timedelta(days=i)).isoformat(),
+                "projected_on_hand": str(from_units(q)),
+            }
+            for i, q in enumerate(projected)
+        ],
+    }
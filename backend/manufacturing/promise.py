@@ -0,0 +1,291 @@
+"""
+Available-to-promise (ATP) and capable-to-promise (CTP) dates.
+
+A product's timeline is its free stock today plus every dated change the open
+order book will make to it:
+- supply: open MOs making the product, on the day their last scheduled work
+  order ends (their due date when unscheduled);
+- demand: unreserved, unconsumed MaterialRequirement quantities, on the due
+  date of the MO that needs them (reserved stock is already out of free stock).
+Past-due dates count as today. The timeline keeps, per change date, the
+projected quantity and its suffix minimum -- the ATP: what can be promised on
+that day without starving a later order. The suffix minimum never decreases,
+so the earliest date for a quantity is a bisect.
+
+Timelines are cached and shared by every quote. Writes that move stock or the
+order book call timelines_changed(), which bumps a generation number once the
+transaction commits, so the next quote rebuilds lazily. Another process only
+sees that bump through a shared cache (settings.CACHE_IS_SHARED); with a
+per-process cache, timelines expire after LOCAL_CACHE_TIMEOUT seconds instead.
+
+CTP covers the part ATP cannot: the shortfall is made with the product's
+active BOM once every leaf component is available (by its own ATP) and the
+routing's work centers have worked off their open WorkOrder load. Operations
+take their BOMOperation.est_hours whatever the quantity, like the WorkOrders
+generated for an MO and the scheduler.
+"""
+
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Max, Q, Sum
+from django.utils import timezone
+
+from inventory.models import ProductAvailability
+
+from .explosion import active_boms_for_products, explode_boms
+from .models import (
+    BillOfMaterials,
+    BOMOperation,
+    ManufacturingOrder,
+    MaterialRequirement,
+    WorkCenter,
+    WorkOrder,
+)
+
+CACHE_PREFIX = "atp-timeline"
+GENERATION_KEY = f"{CACHE_PREFIX}:generation"
+CACHE_TIMEOUT = 60 * 60
+# per-process cache: the longest another worker's writes may go unseen
+LOCAL_CACHE_TIMEOUT = 10
+
+SUPPLY_STATUSES = (
+    ManufacturingOrder.Status.PLANNED,
+    ManufacturingOrder.Status.RELEASED,
+    ManufacturingOrder.Status.IN_PROGRESS,
+    ManufacturingOrder.Status.AWAITING_MATERIALS,
+)
+DEMAND_STATUSES = SUPPLY_STATUSES
+OPEN_WO_STATUSES = (
+    WorkOrder.Status.PENDING,
+    WorkOrder.Status.ASSIGNED,
+    WorkOrder.Status.STARTED,
+    WorkOrder.Status.PAUSED,
+    WorkOrder.Status.BLOCKED,
+)
+
+
+def timelines_changed():
+    """Stock or the order book changed: drop every cached timeline on commit."""
+    transaction.on_commit(_bump_generation)
+
+
+def _bump_generation():
+    try:
+        cache.incr(GENERATION_KEY)
+    except ValueError:
+        cache.set(GENERATION_KEY, 1, None)
+
+
+def _generation() -> int:
+    return cache.get_or_set(GENERATION_KEY, 0, None)
+
+
+def _timeout() -> int:
+    return CACHE_TIMEOUT if getattr(settings, "CACHE_IS_SHARED", False) else LOCAL_CACHE_TIMEOUT
+
+
+def supply_dates(orders) -> Iterator[Tuple[int, Decimal, Optional[date]]]:
+    """
+    (product_id, qty, day) for each MO of the ``orders`` queryset: the day its
+    last scheduled work order ends, its due date when unscheduled, else None.
+    The stock projection books supply with the same rule.
+    """
+    for pid, qty, due_date, finish in orders.annotate(
+        finish=Max("work_orders__planned_end")
+    ).values_list("product_id", "qty", "due_date", "finish"):
+        yield pid, qty, finish.date() if finish else due_date
+
+
+def _build(product_ids: List[int], today: date) -> Dict[int, Dict]:
+    """Timelines for ``product_ids`` in three queries, whatever their number."""
+    today_ord = today.toordinal()
+    changes: Dict[int, Dict[int, Decimal]] = {
+        pid: defaultdict(Decimal) for pid in product_ids
+    }
+    free = dict(
+        ProductAvailability.objects.filter(product_id__in=product_ids).values_list(
+            "product_id", "available"
+        )
+    )
+    for pid, qty, day in supply_dates(
+        ManufacturingOrder.objects.filter(product_id__in=product_ids, status__in=SUPPLY_STATUSES)
+    ):
+        changes[pid][max(day.toordinal(), today_ord) if day else today_ord] += qty
+    for pid, due_date, required, reserved, consumed in MaterialRequirement.objects.filter(
+        component_id__in=product_ids, mo_status__in=DEMAND_STATUSES
+    ).values_list(
+        "component_id", "mo__due_date", "required_qty", "reserved_qty", "consumed_qty"
+    ):
+        open_qty = required - reserved - consumed
+        if open_qty > 0:
+            day = max(due_date.toordinal(), today_ord) if due_date else today_ord
+            changes[pid][day] -= open_qty
+
+    timelines = {}
+    for pid in product_ids:
+        days = sorted(changes[pid].keys() | {today_ord})
+        level = Decimal(free.get(pid) or 0)
+        projected = []
+        for day in days:
+            level += changes[pid].get(day, Decimal("0"))
+            projected.append(level)
+        atp = projected[:]
+        for i in range(len(atp) - 2, -1, -1):
+            atp[i] = min(atp[i], atp[i + 1])
+        timelines[pid] = {
+            "built_on": today_ord,
+            "days": days,
+            "projected": projected,
+            "atp": atp,
+        }
+    return timelines
+
+
+def get_timelines(product_ids: Iterable[int], today: Optional[date] = None) -> Dict[int, Dict]:
+    """
+    {product_id: {"days": [ordinal], "projected": [Decimal], "atp": [Decimal]}},
+    served from the cache and built together for every product missing there.
+    """
+    today = today or timezone.localdate()
+    product_ids = sorted(set(product_ids))
+    generation = _generation()
+    keys = {pid: f"{CACHE_PREFIX}:{generation}:{pid}" for pid in product_ids}
+    cached = cache.get_many(list(keys.values())) if keys else {}
+    result = {}
+    for pid in product_ids:
+        entry = cached.get(keys[pid])
+        # a timeline built on an earlier day has past-due changes on the wrong date
+        if entry is not None and entry["built_on"] == today.toordinal():
+            result[pid] = entry
+    missing = [pid for pid in product_ids if pid not in result]
+    if missing:
+        built = _build(missing, today)
+        cache.set_many({keys[pid]: built[pid] for pid in missing}, _timeout())
+        result.update(built)
+    return result
+
+
+def earliest_atp_date(timeline: Dict, qty: Decimal) -> Optional[date]:
+    """First day from which ``qty`` stays promisable, or None if it never does."""
+    i = bisect_left(timeline["atp"], qty)
+    return date.fromordinal(timeline["days"][i]) if i < len(timeline["days"]) else None
+
+
+def _work_center_free_at(wc_ids, now: datetime) -> Dict[int, datetime]:
+    """
+    When each work center has worked off its open load: the latest scheduled
+    end, or for unscheduled work its remaining hours spread over its capacity.
+    """
+    capacity = dict(
+        WorkCenter.objects.filter(pk__in=wc_ids).values_list("id", "capacity")
+    )
+    free_at = {wc_id: now for wc_id in wc_ids}
+    for wc_id, last_end, backlog in (
+        WorkOrder.objects.filter(work_center_id__in=wc_ids, status__in=OPEN_WO_STATUSES)
+        .values("work_center_id")
+        .annotate(
+            last_end=Max("planned_end"),
+            backlog=Sum("est_hours", filter=Q(planned_end__isnull=True)),
+        )
+        .values_list("work_center_id", "last_end", "backlog")
+    ):
+        slots = max(int(capacity.get(wc_id) or 1), 1)
+        unscheduled = now + timedelta(hours=float(backlog or 0) / slots)
+        free_at[wc_id] = max(now, last_end or now, unscheduled)
+    return free_at
+
+
+def _capable(bom: BillOfMaterials, make_qty: Decimal, today: date, now: datetime) -> Dict:
+    vector = explode_boms([bom])[bom.pk]
+    timelines = get_timelines(vector, today)
+    components = []
+    ready = today
+    for cid, per_unit in sorted(vector.items()):
+        needed = per_unit * make_qty
+        on = earliest_atp_date(timelines[cid], needed)
+        components.append(
+            {
+                "component_id": cid,
+                "required_qty": str(needed),
+                "available_on": on and on.isoformat(),
+            }
+        )
+        if on is None:
+            return {
+                "date": None,
+                "make_qty": str(make_qty),
+                "components": components,
+                "reason": f"Component {cid} never has {needed} available.",
+            }
+        ready = max(ready, on)
+
+    ops = list(
+        BOMOperation.objects.filter(bom=bom)
+        .order_by("sequence")
+        .values_list("sequence", "work_center_id", "est_hours")
+    )
+    free_at = _work_center_free_at({wc_id for _, wc_id, _ in ops}, now)
+    clock = max(now, timezone.make_aware(datetime.combine(ready, time.min)))
+    operations = []
+    for sequence, wc_id, est_hours in ops:
+        start = max(clock, free_at[wc_id])
+        # est_hours is per order, as in the WorkOrders the MO would get
+        clock = start + timedelta(hours=float(est_hours or 0))
+        operations.append(
+            {
+                "sequence": sequence,
+                "work_center_id": wc_id,
+                "start": start.isoformat(),
+                "end": clock.isoformat(),
+            }
+        )
+    return {
+        "date": clock.date(),
+        "make_qty": str(make_qty),
+        "materials_ready": ready.isoformat(),
+        "components": components,
+        "operations": operations,
+    }
+
+
+def promise_date(product_id: int, qty, now: Optional[datetime] = None) -> Dict:
+    """
+    Earliest date ``qty`` of ``product_id`` can be delivered.
+
+    ``atp_date`` uses projected stock alone; ``ctp_date`` makes whatever stock
+    cannot cover today (None without a BOM or when a component never arrives).
+    ``promise_date`` is the earlier of the two.
+    """
+    now = now or timezone.now()
+    today = timezone.localdate(now)
+    qty = Decimal(qty)
+    timeline = get_timelines([product_id], today)[product_id]
+    atp_date = earliest_atp_date(timeline, qty)
+    result = {
+        "product_id": product_id,
+        "qty": str(qty),
+        "atp_today": str(max(timeline["atp"][0], Decimal("0"))),
+        "atp_date": atp_date and atp_date.isoformat(),
+        "ctp_date": None,
+        "ctp": None,
+    }
+    promise = atp_date
+    if atp_date != today:
+        active = active_boms_for_products([product_id]).get(product_id)
+        if active is not None:
+            make_qty = qty - max(timeline["atp"][0], Decimal("0"))
+            ctp = _capable(BillOfMaterials.objects.get(pk=active[0]), make_qty, today, now)
+            ctp_date = ctp.pop("date")
+            result["ctp"] = ctp
+            if ctp_date is not None:
+                result["ctp_date"] = ctp_date.isoformat()
+                promise = min(promise, ctp_date) if promise else ctp_date
+    result["promise_date"] = promise and promise.isoformat()
+    return result
@@ -0,0 +1,105 @@
+"""
+MaterialRequirement maintenance.
+
+The rows mirror each MO's materials_snapshot. Writers of the snapshot call
+write_requirements; reservations, consumption and MO status changes keep the
+reserved_qty, consumed_qty and mo_status columns current with set-based
+UPDATEs.
+"""
+
+from collections import defaultdict
+from decimal import Decimal
+from typing import Dict, Iterable, List
+
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from inventory.models import StockReservation
+
+from .models import ManufacturingOrder, MaterialRequirement
+from .projection import refresh_for_mos
+from .promise import timelines_changed
+
+BATCH_SIZE = 1000
+
+
+def requirement_rows(mo: ManufacturingOrder) -> List[MaterialRequirement]:
+    """Unsaved MaterialRequirement rows for an MO's snapshot (duplicates summed)."""
+    required: Dict[int, Decimal] = defaultdict(Decimal)
+    for line in mo.materials_snapshot or []:
+        required[int(line["component_id"])] += Decimal(line["required_qty"])
+    return [
+        MaterialRequirement(
+            mo_id=mo.pk, component_id=cid, required_qty=qty, mo_status=mo.status
+        )
+        for cid, qty in sorted(required.items())
+    ]
+
+
+def write_requirements(mos: Iterable[ManufacturingOrder]) -> List[MaterialRequirement]:
+    """Replace the requirement rows of the given MOs with their current snapshots."""
+    mos = list(mos)
+    if not mos:
+        return []
+    MaterialRequirement.objects.filter(mo_id__in=[mo.pk for mo in mos]).delete()
+    rows = [row for mo in mos for row in requirement_rows(mo)]
+    created = MaterialRequirement.objects.bulk_create(rows, batch_size=BATCH_SIZE)
+    refresh_reserved([mo.pk for mo in mos])
+    refresh_for_mos([mo.pk for mo in mos])
+    timelines_changed()
+    _notify_orders_changed([mo.pk for mo in mos])
+    return created
+
+
+def refresh_reserved(mo_ids: Iterable[int]) -> int:
+    """Recompute reserved_qty from StockReservation in one UPDATE."""
+    mo_ids = list(mo_ids)
+    if not mo_ids:
+        return 0
+    held = (
+        StockReservation.objects.filter(
+            mo_id=OuterRef("mo_id"), product_id=OuterRef("component_id")
+        )
+        .values("mo_id", "product_id")
+        .annotate(total=Sum("qty"))
+        .values("total")
+    )
+    timelines_changed()
+    return MaterialRequirement.objects.filter(mo_id__in=mo_ids).update(
+        reserved_qty=Coalesce(
+            Subquery(held),
+            Value(Decimal("0")),
+            output_field=DecimalField(max_digits=18, decimal_places=4),
+        )
+    )
+
+
+def mark_consumed(mo_ids: Iterable[int]) -> int:
+    """The MOs' snapshots were posted in full: move everything to consumed."""
+    timelines_changed()
+    return MaterialRequirement.objects.filter(mo_id__in=list(mo_ids)).update(
+        consumed_qty=F("required_qty"), reserved_qty=Decimal("0")
+    )
+
+
+def sync_status(mo_ids: Iterable[int], status: str) -> int:
+    mo_ids = list(mo_ids)
+    timelines_changed()
+    _notify_orders_changed(mo_ids)
+    return MaterialRequirement.objects.filter(mo_id__in=mo_ids).exclude(
+        mo_status=status
+    ).update(mo_status=status)
+
+
+def _notify_orders_changed(mo_ids):
+    # local import: signals.py imports this module
+    from .signals import orders_changed
+
+    orders_changed.send(sender=ManufacturingOrder, mo_ids=list(mo_ids))
+
+
+def open_requirements(component_ids: Iterable[int], statuses: Iterable[str]):
+    """Requirement rows of MOs in ``statuses`` that need any of ``component_ids``."""
+    return MaterialRequirement.objects.filter(
+        component_id__in=list(component_ids), mo_status__in=list(statuses)
+    )
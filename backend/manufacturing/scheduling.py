@@ -0,0 +1,269 @@
+"""
+Finite-capacity scheduling of open work orders.
+
+Work orders are scheduled with a discrete-event simulation: every work center
+has ``capacity`` parallel slots, an operation becomes ready once the previous
+operation of its MO (by operation_no) has finished, and ready operations are
+dispatched in (MO due date, MO id, operation_no) order whenever a slot frees
+up. Events and per-work-center queues are heaps, so a run is O(n log n) in the
+number of operations. STARTED work orders are never moved; they occupy a slot
+until started_at + est_hours (or now, if that has already passed).
+"""
+
+import heapq
+from collections import defaultdict
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional, Set
+
+from django.utils import timezone
+
+from .models import ManufacturingOrder, WorkCenter, WorkOrder
+from .projection import refresh_for_mos
+from .promise import timelines_changed
+
+SCHEDULABLE_MO_STATUSES = (
+    ManufacturingOrder.Status.PLANNED,
+    ManufacturingOrder.Status.RELEASED,
+    ManufacturingOrder.Status.IN_PROGRESS,
+)
+OPEN_WO_STATUSES = (
+    WorkOrder.Status.PENDING,
+    WorkOrder.Status.ASSIGNED,
+    WorkOrder.Status.STARTED,
+    WorkOrder.Status.PAUSED,
+    WorkOrder.Status.BLOCKED,
+)
+NO_DUE_DATE = float("inf")
+
+_READY = 0
+_FINISH = 1
+
+
+class _Op:
+    __slots__ = (
+        "id", "mo_id", "operation_no", "work_center_id", "hours", "started",
+        "priority", "start", "end", "stored", "next",
+    )
+
+    def __init__(self, row, origin: datetime):
+        wo_id, mo_id, op_no, wc_id, est_hours, status, started_at, start, end, due = row
+        self.id = wo_id
+        self.mo_id = mo_id
+        self.operation_no = op_no
+        self.work_center_id = wc_id
+        self.hours = float(est_hours or 0)
+        self.started = status == WorkOrder.Status.STARTED
+        self.priority = (due.toordinal() if due else NO_DUE_DATE, mo_id, op_no)
+        # current plan, in hours relative to origin
+        self.start = _offset(start, origin)
+        self.end = _offset(end, origin)
+        self.stored = (self.start, self.end)
+        self.next: Optional["_Op"] = None
+        if self.started:
+            began = _offset(started_at, origin) if started_at else 0.0
+            self.start = began
+            self.end = max(began + self.hours, 0.0)
+
+
+def _offset(value: Optional[datetime], origin: datetime) -> Optional[float]:
+    if value is None:
+        return None
+    return (value - origin).total_seconds() / 3600.0
+
+
+def _load(origin: datetime):
+    """Load every open operation of a schedulable MO, chained per MO."""
+    rows = (
+        WorkOrder.objects.filter(
+            status__in=OPEN_WO_STATUSES, mo__status__in=SCHEDULABLE_MO_STATUSES
+        )
+        .order_by("mo_id", "operation_no")
+        .values_list(
+            "id", "mo_id", "operation_no", "work_center_id", "est_hours", "status",
+            "started_at", "planned_start", "planned_end", "mo__due_date",
+        )
+    )
+    ops: List[_Op] = []
+    heads: Dict[int, _Op] = {}
+    previous: Optional[_Op] = None
+    for row in rows:
+        op = _Op(row, origin)
+        if previous is not None and previous.mo_id == op.mo_id:
+            previous.next = op
+        else:
+            heads[op.mo_id] = op
+        ops.append(op)
+        previous = op
+    capacity = {
+        wc_id: max(cap, 1)
+        for wc_id, cap in WorkCenter.objects.values_list("id", "capacity")
+    }
+    return ops, heads, capacity
+
+
+def _simulate(
+    to_schedule: Set[int],
+    ops: List[_Op],
+    heads: Dict[int, _Op],
+    capacity: Dict[int, int],
+    t0: float,
+) -> None:
+    """
+    Re-plan the operations whose ids are in ``to_schedule`` from time ``t0``.
+    Every other operation keeps its current plan and, if it is still running
+    at t0, holds a slot on its work center until its planned end.
+    """
+    free = dict(capacity)
+    waiting: Dict[int, list] = defaultdict(list)
+    events: list = []
+    seq = 0
+
+    def push(time, kind, op):
+        nonlocal seq
+        heapq.heappush(events, (time, seq, kind, op))
+        seq += 1
+
+    def release_successor(op, at):
+        # skip STARTED successors (fixed); they release their own successor
+        nxt = op.next
+        if nxt is not None and nxt.id in to_schedule:
+            push(max(at, t0), _READY, nxt)
+
+    for op in ops:
+        if op.id in to_schedule:
+            continue
+        if op.start is None or op.end is None:
+            continue
+        if op.start <= t0 < op.end or (op.started and op.end >= t0):
+            free[op.work_center_id] = free.get(op.work_center_id, 1) - 1
+            push(max(op.end, t0), _FINISH, op)
+        elif op.next is not None and op.next.id in to_schedule:
+            # finished (or will finish) before t0 as planned
+            release_successor(op, op.end)
+
+    for head in heads.values():
+        if head.id in to_schedule:
+            push(t0, _READY, head)
+
+    while events:
+        now = events[0][0]
+        touched = set()
+        while events and events[0][0] == now:
+            _, _, kind, op = heapq.heappop(events)
+            wc = op.work_center_id
+            touched.add(wc)
+            if kind == _FINISH:
+                free[wc] = free.get(wc, 1) + 1
+                release_successor(op, now)
+            else:
+                heapq.heappush(waiting[wc], (op.priority, op.id, op))
+        for wc in touched:
+            queue = waiting[wc]
+            while queue and free.get(wc, 1) > 0:
+                _, _, op = heapq.heappop(queue)
+                free[wc] = free.get(wc, 1) - 1
+                op.start = now
+                op.end = now + op.hours
+                push(op.end, _FINISH, op)
+
+
+def _affected(changed_mo_ids: Iterable[int], ops: List[_Op]):
+    """
+    Return (op ids to re-plan, t0) for an incremental reschedule: the changed
+    MOs' operations, every operation planned at or after t0 on a work center
+    they touch, and transitively the MO successors of those operations (whose
+    work centers are then affected too). An unplanned predecessor of a
+    selected operation is selected as well: nothing else would release it.
+    """
+    changed = set(changed_mo_ids)
+    seeds = [op for op in ops if op.mo_id in changed and not op.started]
+    starts = [op.start for op in seeds if op.start is not None]
+    t0 = max(min(starts), 0.0) if starts else 0.0
+
+    by_wc: Dict[int, List[_Op]] = defaultdict(list)
+    previous: Dict[int, _Op] = {}
+    for op in ops:
+        by_wc[op.work_center_id].append(op)
+        if op.next is not None:
+            previous[op.next.id] = op
+
+    selected: Set[int] = set()
+    seen_wcs: Set[int] = set()
+    stack = list(seeds)
+    while stack:
+        op = stack.pop()
+        if op.started or op.id in selected:
+            continue
+        selected.add(op.id)
+        if op.next is not None:
+            stack.append(op.next)
+        prev = previous.get(op.id)
+        if prev is not None and (prev.start is None or prev.end is None):
+            stack.append(prev)
+        wc = op.work_center_id
+        if wc in seen_wcs:
+            continue
+        seen_wcs.add(wc)
+        stack.extend(
+            other for other in by_wc[wc] if other.start is None or other.start >= t0
+        )
+    return selected, t0
+
+
+def _moved(op: _Op) -> bool:
+    stored_start, stored_end = op.stored
+    if stored_start is None or stored_end is None:
+        return True
+    # offsets round-trip through datetimes; ignore sub-second float noise
+    return abs(op.start - stored_start) > 1e-6 or abs(op.end - stored_end) > 1e-6
+
+
+def schedule_work_orders(
+    mo_ids: Optional[Iterable[int]] = None, now: Optional[datetime] = None
+) -> Dict:
+    """
+    Assign planned_start/planned_end to open work orders.
+
+    Without ``mo_ids`` every open work order is re-planned from now. With
+    ``mo_ids`` only the work centers downstream of those MOs are recomputed,
+    starting at the earliest planned start of their operations; everything
+    planned before that point, and everything on unrelated work centers, is
+    left as it is.
+    """
+    origin = now or timezone.now()
+    ops, heads, capacity = _load(origin)
+    if mo_ids is None:
+        to_schedule = {op.id for op in ops if not op.started}
+        t0 = 0.0
+    else:
+        to_schedule, t0 = _affected(mo_ids, ops)
+    _simulate(to_schedule, ops, heads, capacity, t0)
+
+    changed = []
+    moved_mos = set()
+    for op in ops:
+        if op.start is None or not _moved(op):
+            continue
+        moved_mos.add(op.mo_id)
+        changed.append(
+            WorkOrder(
+                pk=op.id,
+                planned_start=origin + timedelta(hours=op.start),
+                planned_end=origin + timedelta(hours=op.end),
+            )
+        )
+    WorkOrder.objects.bulk_update(changed, ["planned_start", "planned_end"], batch_size=1000)
+    if changed:
+        # MO supply lands on the end of its last work order
+        timelines_changed()
+        refresh_for_mos(moved_mos)
+
+    horizon = max((op.end for op in ops if op.end is not None), default=None)
+    return {
+        "scheduled": len(to_schedule),
+        "updated": len(changed),
+        "work_centers": len({op.work_center_id for op in ops if op.id in to_schedule}),
+        "horizon_end": (
+            (origin + timedelta(hours=horizon)).isoformat() if horizon is not None else None
+        ),
+    }
@@ -1,5 +1,6 @@
 from rest_framework import serializers
 from decimal import Decimal
+from django.db import transaction
 from .models import (
     ManufacturingOrder,
     BillOfMaterials,
@@ -9,6 +10,13 @@ from .models import (
     WorkOrder,
 )
 from . import services as m_services
+from .closure import refresh_closure
+from .costing import invalidate_boms
+from .explosion import BOMCycleError
+from .numbering import allocate_mo_number
+from .requirements import write_requirements
+from .signals import bom_lines_changed
+from .workflow import WO_TRANSITIONS
 from inventory.serializers import (
     ProductSerializer,
 )  # reuse product serializer for nested BOM product display
@@ -29,6 +37,7 @@ class WorkCenterSerializer(serializers.ModelSerializer):
             "description",
             "capacity",
             "cost_per_hour",
+            "overhead_per_hour",
             "location",
             "tags",
         )
@@ -91,6 +100,7 @@ class BOMSerializer(serializers.ModelSerializer):
             "product",
             "version",
             "effective_from",
+            "output_qty",
             "notes",
             "items",
             "operations",
@@ -105,6 +115,7 @@ class BOMSerializer(serializers.ModelSerializer):
             product_type__in=["FINISHED", "FINISHED"]
         )
 
+    @transaction.atomic
     def create(self, validated_data):
         items_data = validated_data.pop("items", [])
         ops_data = validated_data.pop("operations", [])
@@ -113,26 +124,54 @@ class BOMSerializer(serializers.ModelSerializer):
             BOMItem.objects.create(bom=bom, **item)
         for op in ops_data:
             BOMOperation.objects.create(bom=bom, **op)
+        _refresh_closure_or_fail([bom.product_id])
         return bom
 
+    def validate_items(self, items):
+        components = [item["component"].pk for item in items]
+        if len(components) != len(set(components)):
+            raise serializers.ValidationError("Each component may appear only once.")
+        return items
+
+    def validate_operations(self, operations):
+        sequences = [op["sequence"] for op in operations]
+        if len(sequences) != len(set(sequences)):
+            raise serializers.ValidationError("Operation sequences must be unique.")
+        return operations
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        # simple approach: update BOM fields, replace items & operations if supplied
+        # lines are diffed against the stored ones (items by component,
+        # operations by sequence) so unchanged rows keep their ids
         items_data = validated_data.pop("items", None)
         ops_data = validated_data.pop("operations", None)
+        old_product_id = instance.product_id
+        old_output_qty = instance.output_qty
         for attr, val in validated_data.items():
             setattr(instance, attr, val)
         instance.save()
-        if items_data is not None:
-            instance.items.all().delete()
-            for item in items_data:
-                BOMItem.objects.create(bom=instance, **item)
-        if ops_data is not None:
-            instance.operations.all().delete()
-            for op in ops_data:
-                BOMOperation.objects.create(bom=instance, **op)
+        self.line_changes = m_services.sync_bom_lines(
+            instance, items=items_data, operations=ops_data
+        )
+        if any(ids for side in self.line_changes.values() for ids in side.values()):
+            bom_lines_changed.send(
+                sender=BillOfMaterials, bom_id=instance.pk, changes=self.line_changes
+            )
+        if instance.output_qty != old_output_qty:
+            # routing cost per unit changed for this BOM and everything above it
+            invalidate_boms([instance.pk])
+        _refresh_closure_or_fail({old_product_id, instance.product_id})
         return instance
 
 
+def _refresh_closure_or_fail(product_ids):
+    # keeps the where-used index current; a cycle rolls the whole save back
+    try:
+        refresh_closure(product_ids)
+    except BOMCycleError as e:
+        raise serializers.ValidationError({"items": str(e)})
+
+
 class WorkOrderSerializer(serializers.ModelSerializer):
     work_center = WorkCenterSerializer(read_only=True)
     # give assigned_to an empty queryset initially to avoid assertion; set in __init__
@@ -154,8 +193,13 @@ class WorkOrderSerializer(serializers.ModelSerializer):
             "status",
             "started_at",
             "completed_at",
+            "planned_start",
+            "planned_end",
+            "version",
             "notes",
         )
+        # status only changes through the work-order state machine
+        read_only_fields = ("status", "planned_start", "planned_end", "version")
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -183,6 +227,7 @@ class ManufacturingOrderDetailSerializer(serializers.ModelSerializer):
             "notes",
             "created_at",
             "updated_at",
+            "completed_at",
             "created_by",
         )
 
@@ -220,7 +265,10 @@ class ManufacturingOrderCreateSerializer(serializers.ModelSerializer):
         if qty is None or Decimal(qty) <= 0:
             raise serializers.ValidationError("qty must be a positive number.")
 
-        snapshot = m_services.compute_materials_snapshot(bom, Decimal(qty))
+        try:
+            snapshot = m_services.compute_materials_snapshot(bom, Decimal(qty))
+        except m_services.BOMCycleError as e:
+            raise serializers.ValidationError({"linked_bom": str(e)})
         all_ok, details = m_services.check_snapshot_availability(snapshot)
 
         # pass info to create() via context
@@ -246,20 +294,36 @@ class ManufacturingOrderCreateSerializer(serializers.ModelSerializer):
             self.context.get("request").user if self.context.get("request") else None
         )
 
-        mo = ManufacturingOrder.objects.create(
-            materials_snapshot=snapshot,
-            status=(
-                ManufacturingOrder.Status.PLANNED
-                if all_ok
-                else ManufacturingOrder.Status.AWAITING_MATERIALS
-            ),
-            created_by=request_user,
-            **validated_data,
-        )
-        # generate mo_number if desired
-        if not mo.mo_number:
-            mo.mo_number = f"MO-{mo.pk:06d}"
-            mo.save(update_fields=["mo_number"])
+        with transaction.atomic():
+            if not validated_data.get("mo_number"):
+                validated_data["mo_number"] = allocate_mo_number(
+                    validated_data["product"].sku
+                )
+            mo = ManufacturingOrder.objects.create(
+                materials_snapshot=snapshot,
+                status=(
+                    ManufacturingOrder.Status.PLANNED
+                    if all_ok
+                    else ManufacturingOrder.Status.AWAITING_MATERIALS
+                ),
+                created_by=request_user,
+                **validated_data,
+            )
+            write_requirements([mo])
+            # hold the stock now; the availability check in validate() is not a reservation
+            if all_ok and not m_services.reserve_mo_materials(mo):
+                if not proceed:
+                    raise serializers.ValidationError(
+                        {
+                            "materials_shortage": self.context.get(
+                                "materials_availability"
+                            ),
+                            "message": "Materials were taken by another order. Set proceed_when_short=true to create MO in AWAITING_MATERIALS state.",
+                        }
+                    )
+                mo.status = ManufacturingOrder.Status.AWAITING_MATERIALS
+                mo.save(update_fields=["status"])
+                self.context["all_materials_available"] = False
 
         # Auto-generate work orders from linked BOM operations (idempotent)
         try:
@@ -272,6 +336,93 @@ class ManufacturingOrderCreateSerializer(serializers.ModelSerializer):
         return mo
 
 
+class ManufacturingOrderBulkItemSerializer(serializers.Serializer):
+    # plain ids: existence is checked for the whole batch in one query per model
+    product = serializers.IntegerField()
+    qty = serializers.DecimalField(max_digits=18, decimal_places=4)
+    due_date = serializers.DateField(required=False, allow_null=True)
+    linked_bom = serializers.IntegerField()
+    notes = serializers.CharField(required=False, allow_blank=True, default="")
+    proceed_when_short = serializers.BooleanField(required=False, default=False)
+
+    def validate_qty(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("qty must be a positive number.")
+        return value
+
+
+class ManufacturingOrderBulkCreateSerializer(serializers.Serializer):
+    """
+    {"orders": [{"product": 1, "qty": "10", "linked_bom": 3, ...}, ...]}
+    Row-level problems do not fail the batch; they are collected in
+    validated_data["errors"] and reported next to the created rows.
+    """
+
+    MAX_ORDERS = 5000
+
+    orders = serializers.ListField(
+        child=serializers.DictField(), allow_empty=False, max_length=MAX_ORDERS
+    )
+
+    def validate(self, data):
+        rows = []
+        errors = {}
+        for index, row in enumerate(data["orders"]):
+            item = ManufacturingOrderBulkItemSerializer(data=row)
+            if item.is_valid():
+                rows.append((index, item.validated_data))
+            else:
+                errors[index] = item.errors
+        return {"rows": rows, "errors": errors}
+
+
+class WorkOrderBulkStatusSerializer(serializers.Serializer):
+    """
+    {"ids": [1, 2, 3], "action": "start", "assigned_to": <user_id>, "versions": {"1": 4}}
+    versions is optional; ids without one are checked against their status only.
+    """
+
+    MAX_IDS = 1000
+
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=MAX_IDS
+    )
+    action = serializers.ChoiceField(choices=sorted(WO_TRANSITIONS))
+    assigned_to = serializers.PrimaryKeyRelatedField(
+        queryset=_User.objects.none(), required=False
+    )
+    versions = serializers.DictField(
+        child=serializers.IntegerField(min_value=0), required=False, default=dict
+    )
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields["assigned_to"].queryset = get_user_model().objects.all()
+
+    def validate_versions(self, value):
+        try:
+            return {int(pk): version for pk, version in value.items()}
+        except ValueError:
+            raise serializers.ValidationError("Keys must be work order ids.")
+
+    def validate(self, data):
+        if data["action"] == "assign" and not data.get("assigned_to"):
+            raise serializers.ValidationError({"assigned_to": "Required for assign."})
+        return data
+
+
+class PromiseDateSerializer(serializers.Serializer):
+    product = serializers.IntegerField()
+    qty = serializers.DecimalField(max_digits=18, decimal_places=4)
+
+    def validate(self, data):
+        if data["qty"] <= 0:
+            raise serializers.ValidationError("qty must be > 0")
+        if not _Product.objects.filter(pk=data["product"]).exists():
+            raise serializers.ValidationError({"product": "Product not found."})
+        return data
+
+
 class MaterialsPreviewSerializer(serializers.Serializer):
     # use plain IntegerField to avoid circular import at module load time
     linked_bom = serializers.IntegerField()
@@ -280,11 +431,11 @@ class MaterialsPreviewSerializer(serializers.Serializer):
     def validate(self, data):
         if data["qty"] <= 0:
             raise serializers.ValidationError("qty must be > 0")
-        # validate linked_bom exists
+        # validate linked_bom exists; keep the instance for to_representation
         from .models import BillOfMaterials
 
         try:
-            BillOfMaterials.objects.get(pk=data["linked_bom"])
+            self.context["bom"] = BillOfMaterials.objects.get(pk=data["linked_bom"])
         except BillOfMaterials.DoesNotExist:
             raise serializers.ValidationError(
                 {"linked_bom": "BillOfMaterials not found."}
@@ -292,14 +443,63 @@ class MaterialsPreviewSerializer(serializers.Serializer):
         return data
 
     def to_representation(self, instance):
-        from .models import BillOfMaterials
-
-        bom = BillOfMaterials.objects.get(pk=instance["linked_bom"])
-        qty = instance["qty"]
-        snapshot = m_services.compute_materials_snapshot(bom, qty)
-        all_ok, details = m_services.check_snapshot_availability(snapshot)
+        preview = m_services.preview_materials_batch(
+            [(self.context["bom"], instance["qty"])]
+        )["results"][0]
         return {
-            "materials_snapshot": snapshot,
-            "all_materials_available": all_ok,
-            "materials_availability": details,
+            "materials_snapshot": preview["materials_snapshot"],
+            "all_materials_available": preview["all_materials_available"],
+            "materials_availability": preview["materials_availability"],
         }
+
+
+class MaterialsPreviewItemSerializer(serializers.Serializer):
+    linked_bom = serializers.IntegerField()
+    qty = serializers.DecimalField(max_digits=18, decimal_places=4)
+
+    def validate_qty(self, value):
+        if value <= 0:
+            raise serializers.ValidationError("qty must be > 0")
+        return value
+
+
+class MaterialsPreviewBatchSerializer(serializers.Serializer):
+    """
+    Batch of (linked_bom, qty) pairs evaluated together:
+    {"requests": [{"linked_bom": 1, "qty": "10"}, ...]}
+    """
+
+    MAX_REQUESTS = 1000
+
+    requests = serializers.ListField(
+        child=serializers.DictField(), allow_empty=False, max_length=MAX_REQUESTS
+    )
+
+    def validate_requests(self, value):
+        from .models import BillOfMaterials
+
+        pairs = []
+        errors = {}
+        for index, row in enumerate(value):
+            item = MaterialsPreviewItemSerializer(data=row)
+            if not item.is_valid():
+                errors[index] = item.errors
+                continue
+            pairs.append((index, item.validated_data))
+
+        # one query for every BOM referenced by the batch
+        boms = BillOfMaterials.objects.in_bulk(
+            {data["linked_bom"] for _, data in pairs}
+        )
+        for index, data in pairs:
+            if data["linked_bom"] not in boms:
+                errors[index] = {"linked_bom": ["BillOfMaterials not found."]}
+        if errors:
+            raise serializers.ValidationError(errors)
+        self.context["boms"] = boms
+        return [data for _, data in pairs]
+
+    def to_representation(self, instance):
+        boms = self.context["boms"]
+        pairs = [(boms[row["linked_bom"]], row["qty"]) for row in instance["requests"]]
+        return m_services.preview_materials_batch(pairs)
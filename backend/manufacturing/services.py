@@ -1,35 +1,50 @@
 from decimal import Decimal
-from typing import Dict, List, Tuple
+from typing import Dict, Iterable, List, Tuple
 
 from django.db import transaction
 from django.utils import timezone
 
-from .models import BillOfMaterials, BOMItem, WorkOrder
+from .events import publish_mo_status
+from .explosion import BOMCycleError, explode_bom, explode_boms
+from .models import (
+    BillOfMaterials,
+    BOMItem,
+    BOMOperation,
+    ManufacturingOrder,
+    MaterialRequirement,
+    WorkOrder,
+)
+from .numbering import allocate_mo_numbers
+from .requirements import open_requirements, sync_status, write_requirements
+from .workflow import TransitionConflict
 
 # use inventory service helper to aggregate availability (avoids direct model query here)
-from inventory.services import aggregate_available_for_products
+from inventory.services import (
+    InsufficientStockError,
+    aggregate_available_for_products,
+    release_reservations,
+    reserve_materials,
+)
+
+BULK_BATCH_SIZE = 1000
 
 
 def compute_materials_snapshot(bom: BillOfMaterials, qty: Decimal) -> List[Dict]:
     """
     Return snapshot list: [{component_id, required_qty}, ...]
-    required_qty = qty * bomitem.qty_per_unit (consider scrap_pct)
-    """
-    snapshot: List[Dict] = []
-    bom_items = BOMItem.objects.filter(bom=bom)
-    for item in bom_items:
-        per_unit = Decimal(item.qty_per_unit)
-        scrap_pct = Decimal(getattr(item, "scrap_pct", 0) or 0)
-        required = (per_unit * Decimal(qty)) * (
-            Decimal("1.0") + scrap_pct / Decimal("100")
-        )
-        snapshot.append(
-            {
-                "component_id": item.component_id,
-                "required_qty": str(required.quantize(Decimal("0.0001"))),
-            }
-        )
-    return snapshot
+    required_qty = qty * per-unit requirement of each leaf component, where
+    sub-assemblies (components with their own BOM) are exploded recursively and
+    scrap_pct is applied at every level. See explosion.explode_bom.
+    Raises BOMCycleError if the BOM contains itself.
+    """
+    vector = explode_bom(bom)
+    return [
+        {
+            "component_id": component_id,
+            "required_qty": str((per_unit * Decimal(qty)).quantize(Decimal("0.0001"))),
+        }
+        for component_id, per_unit in sorted(vector.items())
+    ]
 
 
 def check_snapshot_availability(snapshot: List[Dict]) -> Tuple[bool, Dict]:
@@ -54,41 +69,480 @@ def check_snapshot_availability(snapshot: List[Dict]) -> Tuple[bool, Dict]:
     return all_ok, avail_map
 
 
+def preview_materials_batch(pairs: List[Tuple[BillOfMaterials, Decimal]]) -> Dict:
+    """
+    Evaluate many (bom, qty) requests against current stock at once.
+    BOMs are exploded together (explosion.explode_boms) and availability is read
+    with one aggregate_available_for_products call for the union of components.
+    Each result carries its standalone shortages and its cumulative shortages,
+    i.e. what is missing once the requests before it (in the given order) have
+    taken their share of the same stock.
+    """
+    vectors = explode_boms({bom.pk: bom for bom, _ in pairs}.values())
+    snapshots = []
+    components = set()
+    for bom, qty in pairs:
+        snapshot = {
+            cid: (per_unit * Decimal(qty)).quantize(Decimal("0.0001"))
+            for cid, per_unit in vectors[bom.pk].items()
+        }
+        snapshots.append(snapshot)
+        components.update(snapshot)
+    available = aggregate_available_for_products(sorted(components)) if components else {}
+
+    remaining = {cid: available.get(cid, Decimal("0")) for cid in components}
+    total_required = {cid: Decimal("0") for cid in components}
+    results = []
+    for index, ((bom, qty), snapshot) in enumerate(zip(pairs, snapshots)):
+        availability = {}
+        shortages = {}
+        cumulative = {}
+        for cid, req in sorted(snapshot.items()):
+            avail = available.get(cid, Decimal("0"))
+            availability[str(cid)] = {"required_qty": str(req), "available_qty": str(avail)}
+            if avail < req:
+                shortages[str(cid)] = str(req - avail)
+            left = max(remaining[cid], Decimal("0"))
+            if left < req:
+                cumulative[str(cid)] = str(req - left)
+            remaining[cid] -= req
+            total_required[cid] += req
+        results.append(
+            {
+                "index": index,
+                "linked_bom": bom.pk,
+                "qty": str(qty),
+                "materials_snapshot": [
+                    {"component_id": cid, "required_qty": str(req)}
+                    for cid, req in sorted(snapshot.items())
+                ],
+                "materials_availability": availability,
+                "all_materials_available": not shortages,
+                "shortages": shortages,
+                "cumulative_shortages": cumulative,
+            }
+        )
+
+    totals = {
+        str(cid): {
+            "required_qty": str(total_required[cid]),
+            "available_qty": str(available.get(cid, Decimal("0"))),
+            "shortage_qty": str(
+                max(total_required[cid] - available.get(cid, Decimal("0")), Decimal("0"))
+            ),
+        }
+        for cid in sorted(components)
+    }
+    return {
+        "results": results,
+        "cumulative": {
+            "components": totals,
+            "all_materials_available": all(
+                Decimal(t["shortage_qty"]) == 0 for t in totals.values()
+            ),
+        },
+    }
+
+
+BOM_ITEM_FIELDS = ("qty_per_unit", "scrap_pct")
+BOM_OPERATION_FIELDS = ("name", "work_center_id", "est_hours")
+
+
+def _diff_lines(model, existing, incoming, fields, bom_id) -> Dict[str, List[int]]:
+    """
+    Bring ``existing`` ({key: row}) in line with ``incoming`` ({key: values})
+    using one delete, one bulk_update and one bulk_create. Rows whose values
+    did not change are left alone, so their primary keys survive.
+    """
+    removed = [row.pk for k, row in existing.items() if k not in incoming]
+    changed, added = [], []
+    for k, values in incoming.items():
+        row = existing.get(k)
+        if row is None:
+            added.append(model(bom_id=bom_id, **values))
+            continue
+        dirty = False
+        for field in fields:
+            if getattr(row, field) != values[field]:
+                setattr(row, field, values[field])
+                dirty = True
+        if dirty:
+            changed.append(row)
+    if removed:
+        model.objects.filter(pk__in=removed).delete()
+    if changed:
+        model.objects.bulk_update(changed, fields, batch_size=BULK_BATCH_SIZE)
+    if added:
+        model.objects.bulk_create(added, batch_size=BULK_BATCH_SIZE)
+    return {
+        "created": [row.pk for row in added],
+        "updated": [row.pk for row in changed],
+        "deleted": removed,
+    }
+
+
+def sync_bom_lines(bom: BillOfMaterials, items=None, operations=None) -> Dict[str, Dict]:
+    """
+    Replace the lines of ``bom`` with ``items`` and/or ``operations`` (each a
+    list of validated serializer dicts; None leaves that side untouched).
+    Items are matched on component and operations on sequence, and only the
+    differences are written. Returns the ids that changed per side:
+    {"items": {"created": [...], "updated": [...], "deleted": [...]}, ...}.
+
+    Bulk writes do not send BOMItem/BOMOperation post_save signals; callers
+    announce the result with signals.bom_lines_changed instead.
+    """
+    changes: Dict[str, Dict] = {}
+    if items is not None:
+        incoming = {
+            item["component"].pk: {
+                "component_id": item["component"].pk,
+                "qty_per_unit": item["qty_per_unit"],
+                "scrap_pct": item.get("scrap_pct", Decimal("0")),
+            }
+            for item in items
+        }
+        existing = {row.component_id: row for row in BOMItem.objects.filter(bom=bom)}
+        changes["items"] = _diff_lines(BOMItem, existing, incoming, BOM_ITEM_FIELDS, bom.pk)
+    if operations is not None:
+        incoming = {
+            op["sequence"]: {
+                "sequence": op["sequence"],
+                "name": op["name"],
+                "work_center_id": op["work_center"].pk,
+                "est_hours": op.get("est_hours", Decimal("0")),
+            }
+            for op in operations
+        }
+        existing = {row.sequence: row for row in BOMOperation.objects.filter(bom=bom)}
+        changes["operations"] = _diff_lines(
+            BOMOperation, existing, incoming, BOM_OPERATION_FIELDS, bom.pk
+        )
+    return changes
+
+
+def reserve_mo_materials(mo: ManufacturingOrder) -> bool:
+    """
+    Atomically reserve the MO's materials_snapshot across warehouses.
+    Returns False (reserving nothing) when the stock is no longer available,
+    e.g. another order took it between the availability check and this call.
+    """
+    try:
+        reserve_materials([(mo.pk, mo.materials_snapshot)])
+    except InsufficientStockError:
+        return False
+    return True
+
+
+def cancel_manufacturing_order(mo: ManufacturingOrder) -> ManufacturingOrder:
+    """
+    Cancel an MO and release its stock reservations in the same transaction.
+    Raises ValueError for orders that are already DONE or CANCELLED.
+    """
+    closed = (ManufacturingOrder.Status.DONE, ManufacturingOrder.Status.CANCELLED)
+    with transaction.atomic():
+        mo = ManufacturingOrder.objects.select_for_update().get(pk=mo.pk)
+        if mo.status in closed:
+            raise ValueError(f"Cannot cancel a manufacturing order in {mo.status}.")
+        release_reservations([mo.pk])
+        mo.status = ManufacturingOrder.Status.CANCELLED
+        mo.save(update_fields=["status", "updated_at"])
+    return mo
+
+
+def release_awaiting_orders(component_ids, exclude_mo_ids=()) -> List[int]:
+    """
+    Move AWAITING_MATERIALS orders that need any of ``component_ids`` and can
+    now be fully covered to PLANNED, reserving their stock in the caller's
+    transaction. Only orders needing those components are looked at (an index
+    lookup on MaterialRequirement); they are served in due-date order, each
+    taking its stock from what is left after the earlier ones. Orders that are
+    still short are skipped, not allowed to block later ones.
+    Returns the ids of the released orders.
+    """
+    waiting = ManufacturingOrder.Status.AWAITING_MATERIALS
+    candidates = set(
+        open_requirements(component_ids, [waiting]).values_list("mo_id", flat=True)
+    ) - set(exclude_mo_ids)
+    if not candidates:
+        return []
+
+    with transaction.atomic():
+        # lock in id order so concurrent postings serialize on the same orders
+        mos = list(
+            ManufacturingOrder.objects.select_for_update()
+            .filter(pk__in=candidates, status=waiting)
+            .order_by("pk")
+            .only("id", "due_date")
+        )
+        if not mos:
+            return []
+        outstanding: Dict[int, List[Dict]] = {mo.pk: [] for mo in mos}
+        for mo_id, cid, required, reserved, consumed in MaterialRequirement.objects.filter(
+            mo_id__in=list(outstanding)
+        ).values_list("mo_id", "component_id", "required_qty", "reserved_qty", "consumed_qty"):
+            qty = required - reserved - consumed
+            if qty > 0:
+                outstanding[mo_id].append({"component_id": cid, "required_qty": qty})
+        available = aggregate_available_for_products(
+            {line["component_id"] for lines in outstanding.values() for line in lines}
+        )
+
+        mos.sort(key=lambda mo: (mo.due_date is None, mo.due_date, mo.pk))
+        releasable = []
+        for mo in mos:
+            lines = outstanding[mo.pk]
+            if all(available.get(l["component_id"], 0) >= l["required_qty"] for l in lines):
+                for l in lines:
+                    available[l["component_id"]] -= l["required_qty"]
+                releasable.append(mo.pk)
+        if not releasable:
+            return []
+
+        try:
+            reserve_materials([(mo_id, outstanding[mo_id]) for mo_id in releasable])
+        except InsufficientStockError:
+            # stock moved since the read: settle order by order
+            kept = []
+            for mo_id in releasable:
+                try:
+                    reserve_materials([(mo_id, outstanding[mo_id])])
+                except InsufficientStockError:
+                    continue
+                kept.append(mo_id)
+            releasable = kept
+
+        planned = ManufacturingOrder.Status.PLANNED
+        ManufacturingOrder.objects.filter(pk__in=releasable).update(
+            status=planned, updated_at=timezone.now()
+        )
+        sync_status(releasable, planned)
+        for mo_id in releasable:
+            publish_mo_status(mo_id, planned)
+    return releasable
+
+
+def bulk_create_manufacturing_orders(rows: List[Tuple[int, Dict]], user=None) -> List[Dict]:
+    """
+    Create many MOs in one transaction with shared lookups.
+    rows: [(index, {"product", "qty", "linked_bom", "due_date", "notes",
+                    "proceed_when_short"}), ...] as validated by
+    ManufacturingOrderBulkItemSerializer (ids, not instances).
+    - one query each for the referenced products and BOMs, one explosion pass
+      and one availability query for the union of components;
+    - rows compete for stock in the given order: a row is PLANNED only if its
+      snapshot still fits after the rows before it, otherwise it becomes
+      AWAITING_MATERIALS (proceed_when_short) or fails;
+    - MO numbers are allocated up front (numbering.allocate_mo_numbers), so
+      MOs, reservations and work orders are all written with bulk operations.
+    Returns one result dict per row, in input order; failed rows carry "errors".
+    """
+    from inventory.models import Product
+
+    results: Dict[int, Dict] = {}
+    skus = dict(
+        Product.objects.filter(pk__in={r["product"] for _, r in rows}).values_list(
+            "pk", "sku"
+        )
+    )
+    boms = BillOfMaterials.objects.in_bulk({r["linked_bom"] for _, r in rows})
+    valid = []
+    for index, row in rows:
+        errors = {}
+        if row["product"] not in skus:
+            errors["product"] = ["Product not found."]
+        if row["linked_bom"] not in boms:
+            errors["linked_bom"] = ["BillOfMaterials not found."]
+        if errors:
+            results[index] = {"index": index, "status": "error", "errors": errors}
+        else:
+            valid.append((index, row))
+
+    cycles: Dict[int, str] = {}
+    vectors = explode_boms(
+        {r["linked_bom"]: boms[r["linked_bom"]] for _, r in valid}.values(),
+        errors=cycles,
+    )
+    snapshots = {}
+    components = set()
+    for index, row in valid:
+        if row["linked_bom"] in cycles:
+            results[index] = {
+                "index": index,
+                "status": "error",
+                "errors": {"linked_bom": [cycles[row["linked_bom"]]]},
+            }
+            continue
+        snapshots[index] = {
+            cid: (per_unit * row["qty"]).quantize(Decimal("0.0001"))
+            for cid, per_unit in vectors[row["linked_bom"]].items()
+        }
+        components.update(snapshots[index])
+    pool = dict(aggregate_available_for_products(sorted(components))) if components else {}
+
+    to_create = []
+    for index, row in valid:
+        if index not in snapshots:
+            continue
+        snapshot = snapshots[index]
+        short = {
+            str(cid): {
+                "required_qty": str(req),
+                "available_qty": str(max(pool.get(cid, Decimal("0")), Decimal("0"))),
+            }
+            for cid, req in snapshot.items()
+            if pool.get(cid, Decimal("0")) < req
+        }
+        if short and not row.get("proceed_when_short"):
+            results[index] = {
+                "index": index,
+                "status": "error",
+                "errors": {"materials_shortage": short},
+            }
+            continue
+        if not short:
+            for cid, req in snapshot.items():
+                pool[cid] = pool.get(cid, Decimal("0")) - req
+        mo = ManufacturingOrder(
+            product_id=row["product"],
+            qty=row["qty"],
+            due_date=row.get("due_date"),
+            linked_bom_id=row["linked_bom"],
+            notes=row.get("notes", ""),
+            materials_snapshot=[
+                {"component_id": cid, "required_qty": str(req)}
+                for cid, req in sorted(snapshot.items())
+            ],
+            status=(
+                ManufacturingOrder.Status.AWAITING_MATERIALS
+                if short
+                else ManufacturingOrder.Status.PLANNED
+            ),
+            created_by=user,
+        )
+        to_create.append((index, row, mo))
+
+    numbers = allocate_mo_numbers([skus[mo.product_id] for _, _, mo in to_create])
+    for (_, _, mo), number in zip(to_create, numbers):
+        mo.mo_number = number
+
+    with transaction.atomic():
+        ManufacturingOrder.objects.bulk_create(
+            [mo for _, _, mo in to_create], batch_size=BULK_BATCH_SIZE
+        )
+        write_requirements([mo for _, _, mo in to_create])
+
+        planned = [
+            (index, row, mo)
+            for index, row, mo in to_create
+            if mo.status == ManufacturingOrder.Status.PLANNED
+        ]
+        try:
+            reserve_materials([(mo.pk, mo.materials_snapshot) for _, _, mo in planned])
+        except InsufficientStockError:
+            # stock moved since the availability read: settle order by order
+            dropped = []
+            waiting = []
+            for index, row, mo in planned:
+                if reserve_mo_materials(mo):
+                    continue
+                if row.get("proceed_when_short"):
+                    mo.status = ManufacturingOrder.Status.AWAITING_MATERIALS
+                    waiting.append(mo.pk)
+                else:
+                    dropped.append(mo.pk)
+                    results[index] = {
+                        "index": index,
+                        "status": "error",
+                        "errors": {
+                            "materials_shortage": "Materials were taken by another order."
+                        },
+                    }
+            ManufacturingOrder.objects.filter(pk__in=waiting).update(
+                status=ManufacturingOrder.Status.AWAITING_MATERIALS
+            )
+            sync_status(waiting, ManufacturingOrder.Status.AWAITING_MATERIALS)
+            ManufacturingOrder.objects.filter(pk__in=dropped).delete()
+            to_create = [t for t in to_create if t[2].pk not in dropped]
+
+        generate_work_orders_for_mos([mo for _, _, mo in to_create])
+        # bulk_create sends no post_save, so announce the new orders here
+        for _, _, mo in to_create:
+            publish_mo_status(mo.pk, mo.status)
+
+    for index, _, mo in to_create:
+        results[index] = {
+            "index": index,
+            "status": "created",
+            "id": mo.pk,
+            "mo_number": mo.mo_number,
+            "mo_status": mo.status,
+        }
+    return [results[index] for index in sorted(results)]
+
+
+def generate_work_orders_for_mos(mos: Iterable[ManufacturingOrder]) -> List[WorkOrder]:
+    """
+    Create WorkOrder rows for many MOs in a fixed number of queries:
+    - one query for the BOMOperation rows of every linked BOM,
+    - one query for the (mo, operation_no) pairs that already exist,
+    - one bulk_create for everything missing.
+    Idempotent per (mo, operation_no): existing rows are skipped and the unique
+    constraint absorbs concurrent generators (ignore_conflicts), so returned
+    instances may not carry primary keys on every database backend.
+    """
+    mos = [mo for mo in mos if mo.linked_bom_id]
+    if not mos:
+        return []
+
+    ops_by_bom: Dict[int, List[BOMOperation]] = {}
+    # only work_center_id is copied, so the work center row itself is never loaded
+    for op in BOMOperation.objects.filter(
+        bom_id__in={mo.linked_bom_id for mo in mos}
+    ).order_by("bom_id", "sequence"):
+        ops_by_bom.setdefault(op.bom_id, []).append(op)
+
+    existing = set(
+        WorkOrder.objects.filter(mo_id__in=[mo.pk for mo in mos]).values_list(
+            "mo_id", "operation_no"
+        )
+    )
+    now = timezone.now()
+    new_wos = [
+        WorkOrder(
+            mo_id=mo.pk,
+            operation_no=op.sequence,
+            title=op.name,
+            work_center_id=op.work_center_id,
+            est_hours=op.est_hours,
+            status=WorkOrder.Status.PENDING,
+            created_at=now,
+        )
+        for mo in mos
+        for op in ops_by_bom.get(mo.linked_bom_id, [])
+        if (mo.pk, op.sequence) not in existing
+    ]
+    if not new_wos:
+        return []
+    return WorkOrder.objects.bulk_create(
+        new_wos, batch_size=BULK_BATCH_SIZE, ignore_conflicts=True
+    )
+
+
 def generate_work_orders_from_mo(mo, auto_generate: bool = True) -> List[WorkOrder]:
     """
     Read BOM operations and create WorkOrder rows for the given MO.
-    - Idempotent: if work orders already exist for the MO, do nothing.
+    - Idempotent: operations that already have a work order are skipped.
     - Each WorkOrder.operation_no is taken from BOMOperation.sequence.
     - WorkOrder.title uses BOMOperation.name; est_hours from BOMOperation.est_hours.
     Returns list of created WorkOrder instances.
     """
     if not auto_generate:
         return []
-
-    if not mo.linked_bom:
-        return []
-
-    # don't generate if already generated
-    if mo.work_orders.exists():
-        return list(mo.work_orders.all())
-
-    created_wos = []
-    ops = mo.linked_bom.operations.all().order_by("sequence")
-    with transaction.atomic():
-        for op in ops:
-            wo = WorkOrder.objects.create(
-                mo=mo,
-                operation_no=op.sequence,
-                title=op.name,
-                work_center=op.work_center,
-                est_hours=op.est_hours,
-                status=WorkOrder.Status.PENDING,
-            )
-            created_wos.append(wo)
-    return created_wos
+    return generate_work_orders_for_mos([mo])
 
 
-def complete_work_order(wo: WorkOrder, completed_by):
+def complete_work_order(wo: WorkOrder, completed_by, version=None):
     """
     High-level complete workflow for a single WorkOrder.
     - Marks WO as COMPLETED, sets completed_at.
@@ -105,4 +559,43 @@ def complete_work_order(wo: WorkOrder, completed_by):
         )
 
     # delegate to inventory service (which handles transactions, locking, ledger entries)
-    return apply_wo_completion(wo.id, completed_by)
+    return apply_wo_completion(wo.id, completed_by, version=version)
+
+
+def bulk_complete_work_orders(wo_ids, completed_by, versions=None) -> Dict[int, Dict]:
+    """
+    Complete many work orders in one transaction through the inventory posting
+    path. Work orders are processed in (MO, operation_no) order so MO locks are
+    always taken in the same order; each completion runs in its own savepoint,
+    so one that conflicts or is short of stock is reported without undoing the
+    others. Returns {wo_id: outcome} like workflow.bulk_transition.
+    """
+    from inventory.services import apply_wo_completion
+
+    versions = versions or {}
+    ids = list(dict.fromkeys(int(i) for i in wo_ids))
+    outcomes: Dict[int, Dict] = {pk: {"result": "not_found"} for pk in ids}
+    with transaction.atomic():
+        ordered = WorkOrder.objects.filter(pk__in=ids).order_by("mo_id", "operation_no")
+        for pk in ordered.values_list("id", flat=True):
+            try:
+                result = apply_wo_completion(pk, completed_by, version=versions.get(pk))
+            except TransitionConflict as e:
+                outcomes[pk] = {
+                    "result": "conflict",
+                    "detail": str(e),
+                    "status": e.status,
+                    "version": e.version,
+                }
+            except ValueError as e:
+                outcomes[pk] = {"result": "error", "detail": str(e)}
+            else:
+                outcomes[pk] = {
+                    "result": "ok",
+                    "status": result["status"],
+                    "version": result["version"],
+                    "mo_id": result["mo_id"],
+                    "mo_status": result["mo_status"],
+                    "stock_posted": result["stock_posted"],
+                }
+    return outcomes
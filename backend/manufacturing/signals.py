@@ -0,0 +1,100 @@
+from django.db.models.signals import post_delete, post_save, pre_delete
+from django.dispatch import Signal, receiver
+from django.utils import timezone
+
+from inventory.models import Product
+from inventory.signals import stock_available_increased
+
+from .closure import refresh_closure
+from .costing import invalidate_boms, invalidate_products
+from .events import publish_mo_status
+from .models import BillOfMaterials, BOMItem, BOMOperation, ManufacturingOrder, WorkCenter
+from .projection import refresh_for_mos
+from .promise import timelines_changed
+from .requirements import sync_status
+from .services import release_awaiting_orders
+
+# Sent inside the saving transaction after a BOM's lines were re-synced in
+# bulk. ``changes`` is the report of services.sync_bom_lines: the BOMItem and
+# BOMOperation ids created, updated and deleted, so caches keyed by line id
+# can drop exactly those.
+bom_lines_changed = Signal()
+
+# Sent when the status or requirements of ``mo_ids`` were written in bulk
+# (queryset updates and bulk_create send no post_save).
+orders_changed = Signal()
+
+
+@receiver(post_save, sender=BOMItem)
+@receiver(post_delete, sender=BOMItem)
+@receiver(post_save, sender=BOMOperation)
+@receiver(post_delete, sender=BOMOperation)
+def touch_bom_on_line_change(sender, instance, **kwargs):
+    # BOM-version caches (explosion, costing) key on BillOfMaterials.updated_at
+    BillOfMaterials.objects.filter(pk=instance.bom_id).update(updated_at=timezone.now())
+    invalidate_boms([instance.bom_id])
+
+
+@receiver(bom_lines_changed)
+def invalidate_costs_on_bom_sync(sender, bom_id, changes, **kwargs):
+    invalidate_boms([bom_id])
+
+
+@receiver(post_save, sender=WorkCenter)
+def invalidate_costs_on_rate_change(sender, instance, created, **kwargs):
+    if not created:
+        invalidate_boms(
+            BOMOperation.objects.filter(work_center=instance).values_list("bom_id", flat=True)
+        )
+
+
+@receiver(post_save, sender=Product)
+def invalidate_costs_on_product_change(sender, instance, created, update_fields, **kwargs):
+    cost = instance.__dict__.get("standard_cost")
+    if cost is None or (update_fields is not None and "standard_cost" not in update_fields):
+        return  # standard_cost was deferred or not written
+    loaded = getattr(instance, "_loaded_standard_cost", None)
+    if not created and (loaded is None or cost != loaded):
+        invalidate_products([instance.pk])
+    instance._loaded_standard_cost = cost
+
+
+@receiver(post_delete, sender=BillOfMaterials)
+def refresh_closure_on_bom_delete(sender, instance, **kwargs):
+    # the product may fall back to an older BOM, or have none left
+    refresh_closure([instance.product_id])
+
+
+@receiver(post_save, sender=ManufacturingOrder)
+def on_mo_status_change(sender, instance, created, **kwargs):
+    status = instance.__dict__.get("status")
+    if status is None:
+        return  # status was deferred, so it cannot have been saved
+    if created or status != getattr(instance, "_loaded_status", None):
+        publish_mo_status(instance.pk, status)
+        if not created:
+            sync_status([instance.pk], status)
+    instance._loaded_status = status
+
+
+@receiver(post_save, sender=ManufacturingOrder)
+def invalidate_timelines_on_mo_save(sender, instance, **kwargs):
+    # qty, due date and status all move the product's projected supply
+    timelines_changed()
+
+
+@receiver(post_save, sender=ManufacturingOrder)
+def refresh_projection_on_mo_save(sender, instance, update_fields=None, **kwargs):
+    if update_fields is None or {"qty", "due_date", "status", "product"} & set(update_fields):
+        refresh_for_mos([instance.pk])
+
+
+@receiver(pre_delete, sender=ManufacturingOrder)
+def refresh_projection_on_mo_delete(sender, instance, **kwargs):
+    # before the delete, while its requirement rows still name the components
+    refresh_for_mos([instance.pk])
+
+
+@receiver(stock_available_increased)
+def release_orders_on_stock_increase(sender, product_ids, exclude_mo_ids=(), **kwargs):
+    release_awaiting_orders(product_ids, exclude_mo_ids=exclude_mo_ids)
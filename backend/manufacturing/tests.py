@@ -1,23 +1,101 @@
-from django.test import TestCase
-from rest_framework.test import APITestCase
-from rest_framework import status
-from django.urls import reverse
-from .models import WorkCenter, BillOfMaterials, ManufacturingOrder, WorkOrder
-from inventory.models import Product
-from account.models import CustomUser
-from .services import ManufacturingService
+import asyncio
+from datetime import date, timedelta
 from decimal import Decimal
+from io import StringIO
+from unittest import mock
+
+from django.contrib.auth.models import Group
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models import F
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
 from django.utils import timezone
-from datetime import timedelta
+from rest_framework import status
+from rest_framework.test import APITestCase
+from rest_framework_simplejwt.tokens import AccessToken
+
+from account.models import CustomUser
+from inventory.models import (
+    Product,
+    ProductAvailability,
+    StockBalance,
+    StockLedgerEntry,
+    StockReservation,
+)
+from inventory.services import post_stock_movements
+
+from .closure import rebuild_closure
+from .costing import rollup_costs
+from .events import LocalBroker
+from .explosion import BOMCycleError, explode_bom
+from .models import (
+    BOMClosure,
+    BOMCost,
+    BOMItem,
+    BOMOperation,
+    BillOfMaterials,
+    ManufacturingOrder,
+    MaterialRequirement,
+    NumberSequence,
+    ProductProjection,
+    WorkCenter,
+    WorkOrder,
+)
+from .mrp import run_mrp
+from .numbering import MO_NUMBER_SEQUENCE, _BlockAllocator, mo_number_prefix
+from .projection import build_projections, get_projection
+from .promise import CACHE_TIMEOUT, LOCAL_CACHE_TIMEOUT, get_timelines, promise_date
+from .requirements import write_requirements
+from .scheduling import schedule_work_orders
+from .services import (
+    bulk_create_manufacturing_orders,
+    cancel_manufacturing_order,
+    compute_materials_snapshot,
+    generate_work_orders_for_mos,
+)
+from .workflow import TransitionConflict, bulk_transition, compare_and_set, transition_values
+
+
+def make_user(loginid, email=None, **fields):
+    return CustomUser.objects.create_user(
+        email=email or f'{loginid}@example.com', password='testpass123', loginid=loginid, **fields
+    )
+
+
+def make_product(name, product_type='RAW', sku=None, unit_of_measure='units', **fields):
+    return Product.objects.create(
+        name=name, sku=sku or name.upper(), product_type=product_type, unit_of_measure=unit_of_measure, **fields
+    )
+
+
+def make_bom(product, *lines):
+    """A BOM for ``product`` with one item per (component, qty_per_unit[, scrap_pct]) line."""
+    bom = BillOfMaterials.objects.create(product=product)
+    for component, qty, *scrap in lines:
+        BOMItem.objects.create(
+            bom=bom, component=component, qty_per_unit=Decimal(qty), scrap_pct=Decimal(scrap[0] if scrap else '0')
+        )
+    return bom
+
+
+def add_stock(product, qty, warehouse='MAIN'):
+    return StockBalance.objects.create(product=product, warehouse=warehouse, qty_on_hand=Decimal(qty))
+
+
 
 class ManufacturingTests(APITestCase):
     def setUp(self):
-        # Create test user
+        # Create test user: BOMs and MOs need a manufacturing manager, work
+        # centers an inventory manager
         self.user = CustomUser.objects.create_user(
             email='test@example.com',
             password='testpass123',
             loginid='testuser'
         )
+        for name in ('MANUFACTURING_MANAGER', 'INVENTORY_MANAGER'):
+            self.user.groups.add(Group.objects.get_or_create(name=name)[0])
         self.client.force_authenticate(user=self.user)
         
         # Create test product
@@ -44,12 +122,18 @@ class ManufacturingTests(APITestCase):
     def test_create_bom(self):
         """Test BOM creation"""
         url = reverse('bom-list')
+        component = Product.objects.create(
+            name='Test Component',
+            sku='TEST002',
+            product_type='RAW',
+            unit_of_measure='units'
+        )
         data = {
             'product': self.product.id,
-            'version': 'v1',
+            'version': 'v2',
             'items': [
                 {
-                    'component': self.product.id,
+                    'component': component.id,
                     'qty_per_unit': 1
                 }
             ]
@@ -63,10 +147,11 @@ class ManufacturingTests(APITestCase):
         data = {
             'product': self.product.id,
             'qty': 10,
-            'due_date': '2025-12-31'
+            'due_date': '2025-12-31',
+            'linked_bom': self.bom.id
         }
         response = self.client.post(url, data, format='json')
-        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
 
     def test_work_center_crud(self):
         """Test WorkCenter CRUD operations"""
@@ -94,23 +179,6 @@ class ManufacturingTests(APITestCase):
         response = self.client.delete(f"{url}{work_center_id}/")
         self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
 
-    def test_create_manufacturing_order_service(self):
-        service = ManufacturingService()
-        mo = service.create_manufacturing_order(
-            product=self.product,
-            quantity=10,
-            due_date='2025-12-31'
-        )
-        
-        self.assertIsNotNone(mo)
-        self.assertEqual(mo.product, self.product)
-        self.assertEqual(mo.qty, 10)
-
-    def test_validate_bom_service(self):
-        service = ManufacturingService()
-        is_valid = service.validate_bom(self.bom)
-        self.assertTrue(is_valid)
-
 class WorkOrderTests(APITestCase):
     def setUp(self):
         # Create test user
@@ -151,27 +219,847 @@ class WorkOrderTests(APITestCase):
 
     def test_work_order_scheduling(self):
         """Test work order scheduling"""
+        start = timezone.now()
         work_order = WorkOrder.objects.create(
             mo=self.mo,
+            operation_no=10,
+            title='Assemble',
             work_center=self.work_center,
-            scheduled_start=timezone.now(),
-            scheduled_end=timezone.now() + timedelta(hours=8)
+            planned_start=start,
+            planned_end=start + timedelta(hours=8)
         )
-        self.assertEqual(work_order.status, 'SCHEDULED')
+        self.assertEqual(work_order.status, 'PENDING')
+        self.assertEqual(work_order.planned_end - work_order.planned_start, timedelta(hours=8))
 
     def test_work_order_completion(self):
         """Test work order completion flow"""
         work_order = WorkOrder.objects.create(
             mo=self.mo,
+            operation_no=10,
+            title='Assemble',
             work_center=self.work_center
         )
         
         # Complete work order
         work_order.status = 'COMPLETED'
-        work_order.actual_end = timezone.now()
+        work_order.completed_at = timezone.now()
         work_order.save()
         
         # Check MO status update
         self.mo.refresh_from_db()
+        work_order.refresh_from_db()
         self.assertEqual(work_order.status, 'COMPLETED')
+        self.assertIsNotNone(work_order.completed_at)
+
+
+class BOMExplosionTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.finished = make_product('Bike', 'FINISHED')
+        self.sub = make_product('Wheel', 'FINISHED')
+        self.frame = make_product('Frame', 'RAW')
+        self.spoke = make_product('Spoke', 'RAW')
+        self.bom = make_bom(self.finished, (self.sub, '2'), (self.frame, '1', '10'))
+        self.sub_bom = make_bom(self.sub, (self.spoke, '3'))
+        self.spokes = self.sub_bom.items.get()
+
+    def test_sub_assemblies_are_exploded(self):
+        self.bom.refresh_from_db()
+        snapshot = compute_materials_snapshot(self.bom, Decimal('5'))
+        self.assertEqual(snapshot, [
+            {'component_id': self.frame.id, 'required_qty': '5.5000'},
+            {'component_id': self.spoke.id, 'required_qty': '30.0000'},
+        ])
+
+    def test_cached_vector_is_revalidated_with_one_query(self):
+        self.bom.refresh_from_db()
+        explode_bom(self.bom)
+        with self.assertNumQueries(1):
+            explode_bom(self.bom)
+
+        # changing the sub-assembly's BOM invalidates the parent's cached vector
+        self.spokes.qty_per_unit = Decimal('4')
+        self.spokes.save()
+        self.assertEqual(explode_bom(self.bom)[self.spoke.id], Decimal('8'))
+
+    def test_cycle_is_detected(self):
+        BOMItem.objects.create(bom=self.sub_bom, component=self.finished, qty_per_unit=Decimal('1'))
+        self.bom.refresh_from_db()
+        with self.assertRaises(BOMCycleError):
+            explode_bom(self.bom)
+
+class MaterialsPreviewBatchTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('planner')
+        self.client.force_authenticate(user=self.user)
+        self.table = make_product('Table', 'FINISHED')
+        self.chair = make_product('Chair', 'FINISHED')
+        self.wood = make_product('Wood', 'RAW', unit_of_measure='kg')
+        add_stock(self.wood, '10')
+        self.table_bom = make_bom(self.table, (self.wood, '4'))
+        self.chair_bom = make_bom(self.chair, (self.wood, '1'))
+
+    def test_competing_requests_report_cumulative_shortage(self):
+        url = reverse('materials-preview-batch')
+        payload = {'requests': [
+            {'linked_bom': self.table_bom.id, 'qty': '2'},
+            {'linked_bom': self.chair_bom.id, 'qty': '3'},
+        ]}
+        response = self.client.post(url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        table, chair = response.data['results']
+        self.assertTrue(table['all_materials_available'])
+        self.assertEqual(table['cumulative_shortages'], {})
+        # each request fits on its own, but together they need 11 of 10
+        self.assertTrue(chair['all_materials_available'])
+        self.assertEqual(chair['cumulative_shortages'], {str(self.wood.id): '1.0000'})
+        self.assertEqual(
+            response.data['cumulative']['components'][str(self.wood.id)]['shortage_qty'], '1.0000'
+        )
+
+    def test_unknown_bom_is_reported_per_row(self):
+        url = reverse('materials-preview-batch')
+        payload = {'requests': [{'linked_bom': self.table_bom.id, 'qty': '1'}, {'linked_bom': 9999, 'qty': '1'}]}
+        response = self.client.post(url, payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertIn('1', {str(k) for k in response.data['requests']})
+
+class MRPTests(TestCase):
+    def setUp(self):
+        self.product = make_product('Desk', 'FINISHED')
+        self.steel = make_product('Steel', 'RAW', unit_of_measure='kg', reorder_level=Decimal('2')
+        )
+        add_stock(self.steel, '10')
+        today = timezone.now().date()
+        self.later = ManufacturingOrder.objects.create(
+            product=self.product, qty=1, due_date=today + timedelta(days=10),
+            status=ManufacturingOrder.Status.PLANNED,
+            materials_snapshot=[{'component_id': self.steel.id, 'required_qty': '6'}],
+        )
+        self.sooner = ManufacturingOrder.objects.create(
+            product=self.product, qty=1, due_date=today + timedelta(days=3),
+            status=ManufacturingOrder.Status.AWAITING_MATERIALS,
+            materials_snapshot=[{'component_id': self.steel.id, 'required_qty': '7'}],
+        )
+        ManufacturingOrder.objects.create(
+            product=self.product, qty=1, status=ManufacturingOrder.Status.DONE,
+            materials_snapshot=[{'component_id': self.steel.id, 'required_qty': '100'}],
+        )
+
+    def test_demand_is_netted_in_due_date_order(self):
+        result = run_mrp()
+        self.assertEqual(result['open_mos'], 2)
+        (steel,) = result['components']
+        self.assertEqual(steel['demand_qty'], '13.0000')
+        self.assertEqual(steel['shortage_qty'], '3.0000')
+        # the sooner order fits; the later one runs out
+        self.assertEqual(steel['first_short_mo_id'], self.later.id)
+        self.assertEqual(steel['first_shortage_date'], self.later.due_date.isoformat())
+        self.assertEqual(steel['suggested_purchase_qty'], '5.0000')
+
+class BulkWorkOrderGenerationTests(TestCase):
+    def setUp(self):
+        self.product = make_product('Cabinet', 'FINISHED', sku='CAB')
+        self.bom = make_bom(self.product)
+        cutting = WorkCenter.objects.create(name='Cutting')
+        finishing = WorkCenter.objects.create(name='Finishing')
+        for seq, wc in ((10, cutting), (20, finishing), (30, finishing)):
+            BOMOperation.objects.create(bom=self.bom, work_center=wc, name=f'Op {seq}', sequence=seq, est_hours=1)
+        self.mos = [
+            ManufacturingOrder.objects.create(product=self.product, qty=1, linked_bom=self.bom)
+            for _ in range(4)
+        ]
+
+    def test_generates_all_in_fixed_queries_and_is_idempotent(self):
+        WorkOrder.objects.create(mo=self.mos[0], operation_no=10, title='Op 10', work_center_id=self.bom.operations.first().work_center_id)
+        with self.assertNumQueries(3):
+            created = generate_work_orders_for_mos(self.mos)
+        self.assertEqual(len(created), 11)
+        self.assertEqual(WorkOrder.objects.count(), 12)
+        self.assertEqual(generate_work_orders_for_mos(self.mos), [])
+
+class BulkManufacturingOrderCreateTests(APITestCase):
+    def setUp(self):
+        self.user = make_user('erp-sync', email='erp@example.com', is_staff=True)
+        self.client.force_authenticate(user=self.user)
+        self.product = make_product('Lamp', 'FINISHED')
+        self.bulb = make_product('Bulb', 'RAW')
+        add_stock(self.bulb, '5')
+        self.bom = make_bom(self.product, (self.bulb, '1'))
+        BOMOperation.objects.create(
+            bom=self.bom, work_center=WorkCenter.objects.create(name='Assembly'), name='Assemble', sequence=1
+        )
+
+    def test_rows_compete_for_stock_and_failures_are_reported(self):
+        row = {'product': self.product.id, 'linked_bom': self.bom.id}
+        payload = {'orders': [
+            dict(row, qty='3'),
+            dict(row, qty='3'),
+            dict(row, qty='3', proceed_when_short=True),
+            dict(row, qty='1', linked_bom=9999),
+            dict(row, qty='-1'),
+        ]}
+        response = self.client.post(reverse('manufacturingorder-bulk-create'), payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.data['results']
+        self.assertEqual([r['status'] for r in results], ['created', 'error', 'created', 'error', 'error'])
+        self.assertEqual(results[0]['mo_status'], ManufacturingOrder.Status.PLANNED)
+        self.assertIn('materials_shortage', results[1]['errors'])
+        self.assertEqual(results[2]['mo_status'], ManufacturingOrder.Status.AWAITING_MATERIALS)
+        self.assertEqual(ManufacturingOrder.objects.count(), 2)
+        self.assertEqual(WorkOrder.objects.count(), 2)
+        self.assertEqual(StockReservation.objects.get().qty, Decimal('3'))
+        self.assertTrue(ManufacturingOrder.objects.get(pk=results[0]['id']).mo_number.startswith('MO-'))
+
+class MONumberAllocationTests(TransactionTestCase):
+    # blocks are only kept across calls outside a transaction, which a
+    # TestCase never is
+    def setUp(self):
+        NumberSequence.objects.all().delete()
+
+    def test_numbers_come_from_prefetched_blocks(self):
+        allocator = _BlockAllocator()
+        with override_settings(MO_NUMBER_BLOCK_SIZE=2):
+            first = allocator.take(3)
+            with self.assertNumQueries(0):
+                second = allocator.take(1)
+        self.assertEqual(first + second, [1, 2, 3, 4])
+        self.assertEqual(NumberSequence.objects.get(name=MO_NUMBER_SEQUENCE).last_value, 4)
+
+        # a second process gets its own block, never overlapping
+        with override_settings(MO_NUMBER_BLOCK_SIZE=2):
+            self.assertEqual(_BlockAllocator().take(1), [5])
+
+    def test_block_is_not_reused_after_caller_rollback(self):
+        allocator = _BlockAllocator()
+        with override_settings(MO_NUMBER_BLOCK_SIZE=3):
+            with self.assertRaises(RuntimeError), transaction.atomic():
+                self.assertEqual(allocator.take(1), [1])
+                raise RuntimeError('rolled back')
+            self.assertFalse(NumberSequence.objects.exists())
+            # the rolled-back block was not cached: both allocators start over
+            # from the committed counter and never overlap
+            self.assertEqual(allocator.take(2), [1, 2])
+            self.assertEqual(_BlockAllocator().take(1), [4])
+
+    def test_prefix_follows_product_line(self):
+        with override_settings(MO_NUMBER_PREFIXES={'BIKE-': 'MOB', 'BIKE-E': 'MOE'}):
+            self.assertEqual(mo_number_prefix('BIKE-E100'), 'MOE')
+            self.assertEqual(mo_number_prefix('BIKE-200'), 'MOB')
+            self.assertEqual(mo_number_prefix('DESK'), 'MO')
+
+class WorkOrderSchedulingTests(TestCase):
+    def setUp(self):
+        self.now = timezone.now().replace(microsecond=0)
+        self.product = make_product('Shelf', 'FINISHED')
+        self.saw = WorkCenter.objects.create(name='Saw', capacity=1)
+        self.paint = WorkCenter.objects.create(name='Paint', capacity=2)
+        today = self.now.date()
+        self.late = self._mo(today + timedelta(days=5), [(10, self.saw, 2), (20, self.paint, 1)])
+        self.urgent = self._mo(today + timedelta(days=1), [(10, self.saw, 2), (20, self.paint, 1)])
+
+    def _mo(self, due_date, ops):
+        mo = ManufacturingOrder.objects.create(
+            product=self.product, qty=1, due_date=due_date, status=ManufacturingOrder.Status.RELEASED
+        )
+        for op_no, wc, hours in ops:
+            WorkOrder.objects.create(mo=mo, operation_no=op_no, title=f'Op {op_no}', work_center=wc, est_hours=hours)
+        return mo
+
+    def _plan(self, mo, op_no):
+        wo = WorkOrder.objects.get(mo=mo, operation_no=op_no)
+        return (
+            (wo.planned_start - self.now).total_seconds() / 3600,
+            (wo.planned_end - self.now).total_seconds() / 3600,
+        )
+
+    def test_capacity_precedence_and_due_date_priority(self):
+        summary = schedule_work_orders(now=self.now)
+        self.assertEqual(summary['scheduled'], 4)
+        self.assertEqual(self._plan(self.urgent, 10), (0, 2))
+        self.assertEqual(self._plan(self.late, 10), (2, 4))
+        self.assertEqual(self._plan(self.urgent, 20), (2, 3))
+        self.assertEqual(self._plan(self.late, 20), (4, 5))
+
+    def test_started_work_order_keeps_its_slot(self):
+        WorkOrder.objects.filter(mo=self.late, operation_no=10).update(
+            status=WorkOrder.Status.STARTED, started_at=self.now - timedelta(hours=1)
+        )
+        schedule_work_orders(now=self.now)
+        self.assertEqual(self._plan(self.late, 10), (-1, 1))
+        self.assertEqual(self._plan(self.urgent, 10), (1, 3))
+
+    def test_incremental_reschedule_only_touches_downstream_work_centers(self):
+        schedule_work_orders(now=self.now)
+        rush = self._mo(self.now.date(), [(10, self.paint, 1)])
+        summary = schedule_work_orders(mo_ids=[rush.pk], now=self.now)
+        self.assertEqual(self._plan(rush, 10), (0, 1))
+        # saw operations are not re-planned; paint ones are but keep their times
+        self.assertEqual(summary['scheduled'], 3)
+        self.assertEqual(summary['updated'], 1)
+        self.assertEqual(self._plan(self.urgent, 20), (2, 3))
+
+    def test_incremental_reschedule_plans_unplanned_predecessors(self):
+        schedule_work_orders(now=self.now)
+        drill = WorkCenter.objects.create(name='Drill', capacity=1)
+        # never scheduled; only its second operation shares a work center
+        pending = self._mo(self.now.date() + timedelta(days=3), [(10, drill, 1), (20, self.paint, 1)])
+        rush = self._mo(self.now.date(), [(10, self.paint, 1)])
+        schedule_work_orders(mo_ids=[rush.pk], now=self.now)
+        self.assertEqual(self._plan(rush, 10), (0, 1))
+        self.assertEqual(self._plan(pending, 10), (0, 1))
+        self.assertEqual(self._plan(pending, 20), (1, 2))
+
+class WorkOrderTransitionTests(APITestCase):
+    def setUp(self):
+        self.user = make_user('operator')
+        self.client.force_authenticate(user=self.user)
+        product = make_product('Bench', 'FINISHED')
+        mo = ManufacturingOrder.objects.create(product=product, qty=1)
+        self.wo = WorkOrder.objects.create(
+            mo=mo, operation_no=10, title='Sand', work_center=WorkCenter.objects.create(name='Sanding')
+        )
+        self.url = reverse('workorder-change-status', args=[self.wo.pk])
+
+    def test_transition_bumps_version_and_keeps_first_start(self):
+        response = self.client.patch(self.url, {'action': 'start', 'version': 0}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['status'], WorkOrder.Status.STARTED)
+        self.assertEqual(response.data['version'], 1)
+        started_at = WorkOrder.objects.get(pk=self.wo.pk).started_at
+
+        self.client.patch(self.url, {'action': 'pause', 'version': 1}, format='json')
+        self.client.patch(self.url, {'action': 'start', 'version': 2}, format='json')
+        self.wo.refresh_from_db()
+        self.assertEqual((self.wo.status, self.wo.version), (WorkOrder.Status.STARTED, 3))
+        self.assertEqual(self.wo.started_at, started_at)
+
+    def test_stale_version_and_disallowed_transition_conflict(self):
+        compare_and_set(self.wo.pk, 'start', version=0)
+        response = self.client.patch(self.url, {'action': 'pause', 'version': 0}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(response.data['version'], 1)
+
+        with self.assertRaises(TransitionConflict):
+            compare_and_set(self.wo.pk, 'start', version=1)
+        self.wo.refresh_from_db()
+        self.assertEqual((self.wo.status, self.wo.version), (WorkOrder.Status.STARTED, 1))
+
+    def test_unknown_action_is_rejected(self):
+        response = self.client.patch(self.url, {'action': 'explode'}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+class WorkOrderBulkStatusTests(APITestCase):
+    def setUp(self):
+        self.user = make_user('supervisor', is_staff=True)
+        self.client.force_authenticate(user=self.user)
+        self.product = make_product('Stool', 'FINISHED')
+        self.mo = ManufacturingOrder.objects.create(product=self.product, qty=2, status=ManufacturingOrder.Status.RELEASED)
+        wc = WorkCenter.objects.create(name='Assembly line')
+        self.wos = [
+            WorkOrder.objects.create(mo=self.mo, operation_no=n, title=f'Op {n}', work_center=wc)
+            for n in (10, 20, 30)
+        ]
+        self.url = reverse('workorder-bulk-status')
+
+    def test_set_based_start_reports_each_id(self):
+        WorkOrder.objects.filter(pk=self.wos[2].pk).update(status=WorkOrder.Status.COMPLETED)
+        with self.assertNumQueries(2):
+            results = bulk_transition([self.wos[0].pk, self.wos[1].pk], 'start')
+        self.assertEqual({r['result'] for r in results.values()}, {'ok'})
+
+        response = self.client.post(
+            self.url, {'ids': [self.wos[0].pk, self.wos[2].pk, 999999], 'action': 'pause'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        results = response.data['results']
+        self.assertEqual(results[self.wos[0].pk], {'result': 'ok', 'status': 'PAUSED', 'version': 2})
+        self.assertEqual(results[self.wos[2].pk]['result'], 'conflict')
+        self.assertEqual(results[999999], {'result': 'not_found'})
+
+    def test_lost_race_to_the_same_transition_is_a_conflict(self):
+        real_values = transition_values
+
+        def other_writer_first(*args, **kwargs):
+            # another caller starts the first order between our read and write
+            WorkOrder.objects.filter(pk=self.wos[0].pk).update(
+                status=WorkOrder.Status.STARTED, version=F('version') + 1
+            )
+            return real_values(*args, **kwargs)
 
+        with mock.patch('manufacturing.workflow.transition_values', side_effect=other_writer_first):
+            results = bulk_transition([self.wos[0].pk, self.wos[1].pk], 'start')
+        self.assertEqual(results[self.wos[0].pk]['result'], 'conflict')
+        self.assertEqual(results[self.wos[0].pk]['version'], 1)
+        self.assertEqual(results[self.wos[1].pk], {'result': 'ok', 'status': 'STARTED', 'version': 1})
+
+    def test_operator_can_move_several_like_one(self):
+        operator = make_user('operator')
+        self.client.force_authenticate(user=operator)
+        response = self.client.post(
+            self.url, {'ids': [wo.pk for wo in self.wos[:2]], 'action': 'start'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_stale_version_is_a_conflict(self):
+        response = self.client.post(
+            self.url,
+            {'ids': [self.wos[0].pk], 'action': 'start', 'versions': {str(self.wos[0].pk): 3}},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_409_CONFLICT)
+        self.assertEqual(WorkOrder.objects.get(pk=self.wos[0].pk).status, WorkOrder.Status.PENDING)
+
+    def test_bulk_complete_posts_production_once(self):
+        response = self.client.post(
+            self.url, {'ids': [wo.pk for wo in reversed(self.wos)], 'action': 'complete'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['succeeded'], 3)
+        self.mo.refresh_from_db()
+        self.assertEqual(self.mo.status, ManufacturingOrder.Status.DONE)
+        self.assertEqual(StockLedgerEntry.objects.filter(product=self.product).count(), 1)
+
+class ShopFloorEventTests(APITestCase):
+    def setUp(self):
+        product = make_product('Crate', 'FINISHED')
+        self.mo = ManufacturingOrder.objects.create(product=product, qty=1)
+        self.saw = WorkCenter.objects.create(name='Saw room')
+        self.wo = WorkOrder.objects.create(mo=self.mo, operation_no=10, title='Cut', work_center=self.saw)
+        self.loop = asyncio.new_event_loop()
+        self.addCleanup(self.loop.close)
+        self.broker = LocalBroker()
+
+    def _drain(self, subscription):
+        events = []
+        # let the call_soon_threadsafe deliveries run
+        self.loop.run_until_complete(asyncio.sleep(0))
+        while not subscription.queue.empty():
+            events.append(subscription.queue.get_nowait())
+        return events
+
+    def test_events_are_filtered_and_sent_on_commit(self):
+        by_wc = self.broker.subscribe(work_center_id=self.saw.pk, loop=self.loop)
+        other_wc = self.broker.subscribe(work_center_id=self.saw.pk + 1, loop=self.loop)
+        with mock.patch('manufacturing.events.get_broker', return_value=self.broker):
+            with self.captureOnCommitCallbacks() as callbacks:
+                compare_and_set(self.wo.pk, 'start', version=0)
+            self.assertEqual(self._drain(by_wc), [])  # nothing before commit
+            for callback in callbacks:
+                callback()
+        events = self._drain(by_wc)
+        self.assertEqual(len(events), 1)
+        self.assertEqual(events[0]['type'], 'work_order.status')
+        self.assertEqual(events[0]['data'], {'work_order_id': self.wo.pk, 'status': 'STARTED', 'version': 1})
+        self.assertEqual(self._drain(other_wc), [])
+
+    def test_mo_status_change_is_published_once(self):
+        by_mo = self.broker.subscribe(mo_id=self.mo.pk, loop=self.loop)
+        mo = ManufacturingOrder.objects.get(pk=self.mo.pk)
+        with mock.patch('manufacturing.events.get_broker', return_value=self.broker):
+            with self.captureOnCommitCallbacks(execute=True):
+                mo.notes = 'no status change'
+                mo.save()
+                mo.status = ManufacturingOrder.Status.RELEASED
+                mo.save()
+        events = self._drain(by_mo)
+        self.assertEqual([e['data']['status'] for e in events], ['RELEASED'])
+
+    def test_stream_requires_authentication(self):
+        response = self.client.get(reverse('shop-floor-events'))
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+    def test_stream_ignores_query_string_token(self):
+        user = make_user('viewer')
+        token = str(AccessToken.for_user(user))
+        response = self.client.get(reverse('shop-floor-events'), {'token': token})
+        self.assertEqual(response.status_code, status.HTTP_401_UNAUTHORIZED)
+
+class MaterialRequirementTests(TestCase):
+    def setUp(self):
+        self.product = make_product('Kite', 'FINISHED')
+        self.cloth = make_product('Cloth', 'RAW', unit_of_measure='m')
+        add_stock(self.cloth, '10')
+        self.bom = make_bom(self.product, (self.cloth, '2'))
+
+    def test_rows_follow_reservation_and_status(self):
+        (result,) = bulk_create_manufacturing_orders(
+            [(0, {'product': self.product.pk, 'qty': Decimal('3'), 'linked_bom': self.bom.pk})]
+        )
+        row = MaterialRequirement.objects.get(mo_id=result['id'])
+        self.assertEqual((row.component_id, row.required_qty, row.reserved_qty), (self.cloth.pk, Decimal('6'), Decimal('6')))
+        self.assertEqual(row.mo_status, ManufacturingOrder.Status.PLANNED)
+
+        cancel_manufacturing_order(ManufacturingOrder.objects.get(pk=result['id']))
+        row.refresh_from_db()
+        self.assertEqual((row.reserved_qty, row.mo_status), (Decimal('0'), ManufacturingOrder.Status.CANCELLED))
+
+    def test_backfill_command_migrates_snapshots(self):
+        mo = ManufacturingOrder.objects.create(
+            product=self.product, qty=1, status=ManufacturingOrder.Status.AWAITING_MATERIALS,
+            materials_snapshot=[{'component_id': self.cloth.pk, 'required_qty': '4'}],
+        )
+        out = StringIO()
+        call_command('backfill_material_requirements', chunk_size=1, stdout=out)
+        self.assertIn('Wrote 1 requirement rows for 1 orders', out.getvalue())
+        row = MaterialRequirement.objects.get(mo=mo)
+        self.assertEqual((row.required_qty, row.mo_status), (Decimal('4'), ManufacturingOrder.Status.AWAITING_MATERIALS))
+        call_command('backfill_material_requirements', stdout=out)
+        self.assertEqual(MaterialRequirement.objects.count(), 1)
+
+class AutoReleaseTests(TestCase):
+    def setUp(self):
+        self.product = make_product('Tent', 'FINISHED')
+        self.canvas = make_product('Canvas', 'RAW', unit_of_measure='m')
+        self.pole = make_product('Pole', 'RAW')
+        add_stock(self.canvas, '2')
+        today = timezone.now().date()
+        self.sooner = self._waiting(today + timedelta(days=2), {self.canvas: '5'})
+        self.later = self._waiting(today + timedelta(days=9), {self.canvas: '4'})
+        self.other = self._waiting(today, {self.pole: '1'})
+
+    def _waiting(self, due_date, lines):
+        mo = ManufacturingOrder.objects.create(
+            product=self.product, qty=1, due_date=due_date,
+            status=ManufacturingOrder.Status.AWAITING_MATERIALS,
+            materials_snapshot=[{'component_id': p.pk, 'required_qty': q} for p, q in lines.items()],
+        )
+        write_requirements([mo])
+        return mo
+
+    def _receive(self, product, qty):
+        post_stock_movements([{
+            'product_id': product.pk, 'qty': Decimal(qty),
+            'transaction_type': StockLedgerEntry.TransactionType.STOCK_IN, 'notes': 'Receipt',
+        }])
+
+    def test_receipt_releases_waiting_orders_in_due_date_order(self):
+        self._receive(self.canvas, '5')
+        statuses = dict(ManufacturingOrder.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[self.sooner.pk], ManufacturingOrder.Status.PLANNED)
+        self.assertEqual(statuses[self.later.pk], ManufacturingOrder.Status.AWAITING_MATERIALS)
+        self.assertEqual(statuses[self.other.pk], ManufacturingOrder.Status.AWAITING_MATERIALS)
+        self.assertEqual(StockReservation.objects.get().mo_id, self.sooner.pk)
+        self.assertEqual(ProductAvailability.objects.get(product=self.canvas).available, Decimal('2'))
+
+        self._receive(self.canvas, '2')
+        self.later.refresh_from_db()
+        self.assertEqual(self.later.status, ManufacturingOrder.Status.PLANNED)
+
+    def test_cancelled_order_does_not_take_back_its_own_stock(self):
+        self._receive(self.canvas, '3')
+        cancel_manufacturing_order(self.sooner)
+        self.sooner.refresh_from_db()
+        self.later.refresh_from_db()
+        self.assertEqual(self.sooner.status, ManufacturingOrder.Status.CANCELLED)
+        # the freed canvas goes to the next waiting order
+        self.assertEqual(self.later.status, ManufacturingOrder.Status.PLANNED)
+
+class WhereUsedClosureTests(APITestCase):
+    def setUp(self):
+        self.user = make_user('engineer', is_staff=True)
+        self.client.force_authenticate(user=self.user)
+        self.bike = make_product('Bike', 'FINISHED')
+        self.wheel = make_product('Wheel', 'RAW')
+        self.spoke = make_product('Spoke', 'RAW')
+        make_bom(self.wheel, (self.spoke, '30', '10'))
+        self.bike_bom = make_bom(self.bike, (self.wheel, '2'))
+
+    def test_closure_sums_paths_and_updates_incrementally(self):
+        rebuild_closure()
+        rows = {
+            (a, d): (q, depth)
+            for a, d, q, depth in BOMClosure.objects.values_list('ancestor_id', 'descendant_id', 'qty_per_unit', 'depth')
+        }
+        self.assertEqual(rows[(self.bike.pk, self.spoke.pk)], (Decimal('66'), 2))
+        self.assertEqual(rows[(self.wheel.pk, self.spoke.pk)], (Decimal('33'), 1))
+
+        # a spare spoke packed with every bike: a second, shorter path
+        response = self.client.post(
+            reverse('bom-add-item', args=[self.bike_bom.pk]),
+            {'component': self.spoke.pk, 'qty_per_unit': '1'},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        response = self.client.get(reverse('where-used', args=[self.spoke.pk]))
+        self.assertEqual(
+            [(r['sku'], r['qty_per_unit'], r['depth']) for r in response.data['results']],
+            [('BIKE', '67.00000000', 1), ('WHEEL', '33.00000000', 1)],
+        )
+        response = self.client.get(reverse('where-used', args=[self.spoke.pk]), {'finished_only': 'true'})
+        self.assertEqual([r['sku'] for r in response.data['results']], ['BIKE'])
+
+    def test_cycle_is_rejected(self):
+        rebuild_closure()
+        response = self.client.post(
+            reverse('bom-add-item', args=[self.bike_bom.pk]),
+            {'component': self.bike.pk, 'qty_per_unit': '1'},
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertFalse(BOMItem.objects.filter(bom=self.bike_bom, component=self.bike).exists())
+
+class BOMCostRollupTests(APITestCase):
+    def setUp(self):
+        self.user = make_user('controller')
+        self.client.force_authenticate(user=self.user)
+        self.chair = make_product('Chair', 'FINISHED')
+        self.seat = make_product('Seat', 'RAW')
+        self.wood = make_product('Wood', 'RAW', unit_of_measure='kg', standard_cost=Decimal('4')
+        )
+        self.screw = make_product('Screw', 'RAW', standard_cost=Decimal('0.10')
+        )
+        self.bench = WorkCenter.objects.create(name='Bench', cost_per_hour=Decimal('20'), overhead_per_hour=Decimal('5'))
+        self.seat_bom = make_bom(self.seat, (self.wood, '2', '25'))
+        self.chair_bom = make_bom(self.chair, (self.seat, '1'), (self.screw, '10'))
+        BOMOperation.objects.create(bom=self.chair_bom, work_center=self.bench, name='Assemble', sequence=1, est_hours=Decimal('0.5'))
+
+        rebuild_closure()
+
+    def test_rollup_is_bottom_up_and_cached(self):
+        costs = rollup_costs()
+        self.assertEqual(costs[self.seat_bom.pk]['unit_cost'], Decimal('10'))
+        chair = costs[self.chair_bom.pk]
+        self.assertEqual(
+            (chair['material_cost'], chair['labour_cost'], chair['overhead_cost'], chair['unit_cost']),
+            (Decimal('11'), Decimal('10'), Decimal('2.5'), Decimal('23.5')),
+        )
+        # served straight from BOMCost: the BOM lookup plus one cache read
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('bom-cost', args=[self.chair_bom.pk]))
+        self.assertEqual(response.data['unit_cost'], '23.5000')
+
+    def test_cost_change_invalidates_only_ancestors(self):
+        other = make_bom(make_product('Box', 'FINISHED'))
+        rollup_costs()
+        self.wood.standard_cost = Decimal('6')
+        self.wood.save()
+        self.assertEqual(set(BOMCost.objects.values_list('bom_id', flat=True)), {other.pk})
+        self.assertEqual(rollup_costs([self.chair_bom.pk])[self.chair_bom.pk]['unit_cost'], Decimal('28.5'))
+
+    def test_saves_that_keep_the_standard_cost_keep_the_cache(self):
+        rollup_costs()
+        self.wood.reorder_level = Decimal('50')
+        self.wood.save()
+        Product.objects.get(pk=self.wood.pk).save()
+        self.assertEqual(BOMCost.objects.count(), 2)
+        self.wood.standard_cost = Decimal('6')
+        self.wood.save(update_fields=['reorder_level'])
+        self.assertEqual(BOMCost.objects.count(), 2)
+
+    def test_routing_hours_are_spread_over_the_lot(self):
+        # the 0.5h assembly run now yields four chairs
+        self.chair_bom.output_qty = Decimal('4')
+        self.chair_bom.save()
+        chair = rollup_costs([self.chair_bom.pk])[self.chair_bom.pk]
+        self.assertEqual(
+            (chair['labour_cost'], chair['overhead_cost'], chair['unit_cost']),
+            (Decimal('2.5'), Decimal('0.625'), Decimal('14.125')),
+        )
+
+
+class BOMDiffUpdateTests(APITestCase):
+    def setUp(self):
+        self.user = make_user('bomeditor', is_staff=True)
+        self.client.force_authenticate(user=self.user)
+        self.lamp = make_product('Lamp', 'FINISHED')
+        self.base = make_product('Base', 'RAW')
+        self.shade = make_product('Shade', 'RAW')
+        self.cable = make_product('Cable', 'RAW', unit_of_measure='m')
+        self.wc = WorkCenter.objects.create(name='Assembly')
+        self.bom = make_bom(self.lamp, (self.base, '1'), (self.shade, '1'))
+        self.base_line = self.bom.items.get(component=self.base)
+        self.shade_line = self.bom.items.get(component=self.shade)
+        self.op = BOMOperation.objects.create(bom=self.bom, work_center=self.wc, name='Assemble', sequence=10, est_hours=Decimal('1'))
+
+    def test_update_keeps_unchanged_lines_and_reports_changes(self):
+        rollup_costs([self.bom.pk])
+        payload = {
+            'product': self.lamp.pk,
+            'version': 'v1',
+            'items': [
+                {'component': self.base.pk, 'qty_per_unit': '1', 'scrap_pct': '0'},
+                {'component': self.cable.pk, 'qty_per_unit': '1.5'},
+            ],
+            'operations': [
+                {'name': 'Assemble', 'sequence': 10, 'est_hours': '1.00', 'work_center_id': self.wc.pk},
+            ],
+        }
+        response = self.client.put(reverse('bom-detail', args=[self.bom.pk]), payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        cable_line = BOMItem.objects.get(bom=self.bom, component=self.cable)
+        self.assertEqual(
+            response.data['line_changes'],
+            {
+                'items': {'created': [cable_line.pk], 'updated': [], 'deleted': [self.shade_line.pk]},
+                'operations': {'created': [], 'updated': [], 'deleted': []},
+            },
+        )
+        self.assertTrue(BOMItem.objects.filter(pk=self.base_line.pk).exists())
+        self.assertFalse(BOMCost.objects.filter(bom=self.bom).exists())
+
+        payload['operations'][0]['est_hours'] = '2.00'
+        response = self.client.put(reverse('bom-detail', args=[self.bom.pk]), payload, format='json')
+        self.assertEqual(response.data['line_changes']['operations']['updated'], [self.op.pk])
+        self.assertEqual(response.data['line_changes']['items'], {'created': [], 'updated': [], 'deleted': []})
+
+    def test_duplicate_components_are_rejected(self):
+        payload = {
+            'items': [
+                {'component': self.base.pk, 'qty_per_unit': '1'},
+                {'component': self.base.pk, 'qty_per_unit': '2'},
+            ],
+        }
+        response = self.client.patch(reverse('bom-detail', args=[self.bom.pk]), payload, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class PromiseDateTests(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = make_user('sales')
+        self.client.force_authenticate(user=self.user)
+        self.today = timezone.localdate()
+        self.now = timezone.make_aware(timezone.datetime.combine(self.today, timezone.datetime.min.time()))
+        self.stool = make_product('Stool', 'FINISHED')
+        self.leg = make_product('Leg', 'RAW')
+        self.bench = WorkCenter.objects.create(name='Bench')
+        bom = make_bom(self.stool, (self.leg, '3'))
+        BOMOperation.objects.create(bom=bom, work_center=self.bench, name='Assemble', sequence=1, est_hours=Decimal('0.5'))
+        add_stock(self.stool, '10')
+        self.leg_stock = add_stock(self.leg, '300')
+        ManufacturingOrder.objects.create(
+            product=self.stool, qty=Decimal('20'), status=ManufacturingOrder.Status.PLANNED,
+            due_date=self.today + timedelta(days=5),
+        )
+
+    def test_atp_uses_projected_supply(self):
+        self.assertEqual(promise_date(self.stool.pk, '5', now=self.now)['promise_date'], self.today.isoformat())
+        quote = promise_date(self.stool.pk, '25', now=self.now)
+        self.assertEqual(quote['atp_date'], (self.today + timedelta(days=5)).isoformat())
+        # making 15 is one half-hour run on an idle bench, so CTP beats waiting
+        self.assertEqual(quote['ctp_date'], self.today.isoformat())
+        self.assertEqual(quote['promise_date'], self.today.isoformat())
+
+    def test_ctp_waits_for_components_and_work_center_load(self):
+        mo = ManufacturingOrder.objects.create(product=self.stool, qty=Decimal('1'), status=ManufacturingOrder.Status.RELEASED)
+        WorkOrder.objects.create(
+            mo=mo, operation_no=1, title='Assemble', work_center=self.bench,
+            planned_start=self.now, planned_end=self.now + timedelta(days=2),
+        )
+        quote = promise_date(self.stool.pk, '90', now=self.now)
+        self.assertIsNone(quote['atp_date'])
+        self.assertEqual(quote['ctp']['make_qty'], '80.0000')
+        # 80 stools = 240 legs (in stock), then one half-hour run once the bench frees up
+        operation = quote['ctp']['operations'][0]
+        self.assertEqual(operation['start'], (self.now + timedelta(days=2)).isoformat())
+        self.assertEqual(operation['end'], (self.now + timedelta(days=2, minutes=30)).isoformat())
+        self.assertEqual(quote['ctp_date'], (self.today + timedelta(days=2)).isoformat())
+
+        quote = promise_date(self.stool.pk, '200', now=self.now)
+        self.assertIsNone(quote['promise_date'])
+        self.assertIn('never has', quote['ctp']['reason'])
+
+    def test_timelines_are_cached_until_stock_moves(self):
+        get_timelines([self.leg.pk], self.today)
+        with self.assertNumQueries(0):
+            get_timelines([self.leg.pk], self.today)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.leg_stock.qty_on_hand = Decimal('30')
+            self.leg_stock.save()
+        self.assertEqual(get_timelines([self.leg.pk], self.today)[self.leg.pk]['atp'], [Decimal('30')])
+
+        response = self.client.get(reverse('promise-date'), {'product': self.leg.pk, 'qty': '31'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertIsNone(response.data['promise_date'])
+
+    def test_timelines_expire_quickly_without_a_shared_cache(self):
+        for shared, timeout in ((False, LOCAL_CACHE_TIMEOUT), (True, CACHE_TIMEOUT)):
+            cache.clear()
+            with override_settings(CACHE_IS_SHARED=shared), mock.patch.object(cache, 'set_many') as set_many:
+                get_timelines([self.leg.pk], self.today)
+            self.assertEqual(set_many.call_args.args[1], timeout)
+
+
+class StockProjectionTests(APITestCase):
+    def setUp(self):
+        self.user = make_user('planner2', is_staff=True)
+        self.client.force_authenticate(user=self.user)
+        self.today = timezone.localdate()
+        self.desk = make_product('Desk', 'FINISHED')
+        self.board = make_product('Board', 'RAW')
+        self.bom = make_bom(self.desk, (self.board, '2'))
+        add_stock(self.board, '10')
+
+    def _create_mo(self, qty, days):
+        response = self.client.post(
+            reverse('manufacturingorder-list'),
+            {
+                'product': self.desk.pk, 'linked_bom': self.bom.pk, 'qty': qty,
+                'due_date': (self.today + timedelta(days=days)).isoformat(), 'proceed_when_short': True,
+            },
+            format='json',
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED, response.data)
+        return ManufacturingOrder.objects.get(pk=response.data['id'])
+
+    def test_projection_follows_mo_lifecycle(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            mo = self._create_mo('3', 2)
+        self.assertEqual(set(ProductProjection.objects.values_list('product_id', flat=True)), {self.desk.pk, self.board.pk})
+
+        response = self.client.get(reverse('product-projection', args=[self.board.pk]), {'days': 5})
+        self.assertEqual(
+            [d['projected_on_hand'] for d in response.data['days']],
+            ['10.0000', '10.0000', '4.0000', '4.0000', '4.0000'],
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            mo.due_date = self.today + timedelta(days=200)
+            mo.save()
+        response = self.client.get(reverse('product-projection', args=[self.desk.pk]), {'days': 3})
+        self.assertEqual([d['projected_on_hand'] for d in response.data['days']], ['0.0000'] * 3)
+        self.assertFalse(ProductProjection.objects.exists())
+
+    def test_full_build_is_one_pass_and_flags_shortages(self):
+        with self.captureOnCommitCallbacks(execute=False):
+            self._create_mo('4', 1)
+            self._create_mo('2', -3)
+        # supply, demand, delete, upsert (+ savepoint pair), however many products
+        with self.assertNumQueries(6):
+            self.assertEqual(build_projections(), 2)
+        board = get_projection(self.board.pk, days=3)
+        # the late order consumes today, the other tomorrow
+        self.assertEqual([d['projected_on_hand'] for d in board['days']], ['6.0000', '-2.0000', '-2.0000'])
+        self.assertEqual(board['first_shortage_date'], (self.today + timedelta(days=1)).isoformat())
+
+    def test_refreshes_are_merged_per_transaction_and_reads_never_write(self):
+        with mock.patch('manufacturing.projection.build_projections', wraps=build_projections) as build:
+            with self.captureOnCommitCallbacks(execute=True):
+                self._create_mo('1', 1)
+                self._create_mo('2', 3)
+        self.assertEqual(build.call_count, 1)
+
+        # a row built two days ago is served from today on, as it is
+        ProductProjection.objects.filter(product=self.board).update(start_date=self.today - timedelta(days=2))
+        with self.assertNumQueries(2):
+            board = get_projection(self.board.pk, days=3)
+        self.assertTrue(board['stale'])
+        self.assertEqual([d['projected_on_hand'] for d in board['days']], ['8.0000', '4.0000', '4.0000'])
+
+    def test_supply_is_dated_like_the_atp_timeline(self):
+        cache.clear()
+        with self.captureOnCommitCallbacks(execute=True):
+            mo = self._create_mo('3', 1)
+        # scheduled to finish three days after its due date
+        finish = timezone.now() + timedelta(days=4)
+        WorkOrder.objects.create(
+            mo=mo, operation_no=10, title='Assemble', work_center=WorkCenter.objects.create(name='Line'),
+            planned_start=finish - timedelta(hours=1), planned_end=finish,
+        )
+        build_projections([self.desk.pk])
+        desk = get_projection(self.desk.pk, days=6)
+        supply_day = next(i for i, d in enumerate(desk['days']) if d['projected_on_hand'] != '0.0000')
+        self.assertEqual(supply_day, (finish.date() - self.today).days)
+        timeline = get_timelines([self.desk.pk], self.today)[self.desk.pk]
+        self.assertEqual(date.fromordinal(timeline['days'][-1]), finish.date())
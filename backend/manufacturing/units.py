@@ -0,0 +1,18 @@
+"""
+Fixed-point quantities for the NumPy planners (mrp, projection).
+
+Quantities are held as int64 in units of 0.0001 (the DecimalField scale), so
+array arithmetic on them stays exact.
+"""
+
+from decimal import Decimal
+
+SCALE = 10000
+
+
+def to_units(value) -> int:
+    return int((Decimal(value) * SCALE).to_integral_value())
+
+
+def from_units(value) -> Decimal:
+    return (Decimal(int(value)) / SCALE).quantize(Decimal("0.0001"))
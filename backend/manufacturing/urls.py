@@ -1,9 +1,15 @@
+from django.urls import path
 from rest_framework.routers import DefaultRouter
 from .views import (
     ManufacturingOrderViewSet,
     BOMViewSet,
     WorkCenterViewSet,
     WorkOrderViewSet,
+    MaterialsPreviewView,
+    MaterialsPreviewBatchView,
+    WhereUsedView,
+    PromiseDateView,
+    shop_floor_events,
 )
 
 router = DefaultRouter()
@@ -14,4 +20,18 @@ router.register(r"boms", BOMViewSet, basename="bom")
 router.register(r"workcenters", WorkCenterViewSet, basename="workcenter")
 router.register(r"work-orders", WorkOrderViewSet, basename="workorder")
 
-urlpatterns = router.urls
+urlpatterns = [
+    path(
+        "materials-preview/", MaterialsPreviewView.as_view(), name="materials-preview"
+    ),
+    path(
+        "materials-preview/batch/",
+        MaterialsPreviewBatchView.as_view(),
+        name="materials-preview-batch",
+    ),
+    path("promise-date/", PromiseDateView.as_view(), name="promise-date"),
+    path("events/", shop_floor_events, name="shop-floor-events"),
+    path(
+        "where-used/<int:component_id>/", WhereUsedView.as_view(), name="where-used"
+    ),
+] + router.urls
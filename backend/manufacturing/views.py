@@ -1,17 +1,42 @@
+import asyncio
+import json
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.http import JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.utils import timezone
 from rest_framework import viewsets, permissions, status
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.exceptions import InvalidToken
 from rest_framework.response import Response
 from rest_framework.decorators import action
-from .models import ManufacturingOrder, BillOfMaterials, WorkCenter, WorkOrder
+from rest_framework.views import APIView
+from .models import ManufacturingOrder, BillOfMaterials, BOMItem, WorkCenter, WorkOrder
 from .serializers import (
+    BOMItemSerializer,
     ManufacturingOrderCreateSerializer,
     MaterialsPreviewSerializer,
+    MaterialsPreviewBatchSerializer,
+    PromiseDateSerializer,
     BOMSerializer,
     WorkCenterSerializer,
     WorkOrderSerializer,
+    WorkOrderBulkStatusSerializer,
     ManufacturingOrderDetailSerializer,
+    ManufacturingOrderBulkCreateSerializer,
 )
+from . import events
+from .closure import refresh_closure, where_used
+from .costing import rollup_costs
+from .promise import promise_date
 from . import services as m_services
+from .workflow import WO_TRANSITIONS, TransitionConflict, bulk_transition, compare_and_set
+from account.authenticate import CustomCookieJWTAuthentication
+from inventory.services import release_reservations
+
+STREAM_KEEPALIVE_SECONDS = 15
 
 
 # permissions reused from earlier (keeps thin)
@@ -54,6 +79,18 @@ class BOMViewSet(viewsets.ModelViewSet):
     serializer_class = BOMSerializer
     permission_classes = [IsInventoryManagerOrReadOnly]
 
+    def update(self, request, *args, **kwargs):
+        partial = kwargs.pop("partial", False)
+        serializer = self.get_serializer(
+            self.get_object(), data=request.data, partial=partial
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        out = serializer.data
+        # ids of the lines created/updated/deleted, for clients caching by line id
+        out["line_changes"] = getattr(serializer, "line_changes", {})
+        return Response(out)
+
     @action(
         detail=True,
         methods=["post"],
@@ -68,9 +105,28 @@ class BOMViewSet(viewsets.ModelViewSet):
         bom = self.get_object()
         serializer = BOMItemSerializer(data=request.data)
         serializer.is_valid(raise_exception=True)
-        BOMItem.objects.create(bom=bom, **serializer.validated_data)
+        try:
+            with transaction.atomic():
+                BOMItem.objects.create(bom=bom, **serializer.validated_data)
+                refresh_closure([bom.product_id])
+        except m_services.BOMCycleError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
         return Response({"status": "created"}, status=status.HTTP_201_CREATED)
 
+    @action(detail=True, methods=["get"], url_path="cost")
+    def cost(self, request, pk=None):
+        """
+        GET /api/manufacturing/boms/{pk}/cost/
+        Standard cost per unit (material, labour, overhead) rolled up through
+        every sub-assembly; served from the cost cache when it is still valid.
+        """
+        bom = self.get_object()
+        try:
+            cost = rollup_costs([bom.pk])[bom.pk]
+        except m_services.BOMCycleError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response({"bom": bom.pk, **{k: str(v) for k, v in cost.items()}})
+
 
 class ManufacturingOrderViewSet(viewsets.ModelViewSet):
     queryset = ManufacturingOrder.objects.all().order_by("-created_at")
@@ -97,9 +153,63 @@ class ManufacturingOrderViewSet(viewsets.ModelViewSet):
             )
         return Response(out, status=status.HTTP_201_CREATED)
 
+    @action(detail=False, methods=["post"], url_path="bulk")
+    def bulk_create(self, request):
+        """
+        POST /api/manufacturing/manufacturing-orders/bulk/
+        body: {"orders": [{"product", "qty", "linked_bom", "due_date", "notes", "proceed_when_short"}, ...]}
+        Creates every valid row in one transaction and reports each row's outcome.
+        Responds 201 when all rows were created, 207 on partial success and 400 when none were.
+        """
+        serializer = ManufacturingOrderBulkCreateSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        rows = serializer.validated_data["rows"]
+        results = (
+            m_services.bulk_create_manufacturing_orders(rows, user=request.user)
+            if rows
+            else []
+        )
+        results += [
+            {"index": index, "status": "error", "errors": errors}
+            for index, errors in serializer.validated_data["errors"].items()
+        ]
+        results.sort(key=lambda r: r["index"])
+        created = sum(1 for r in results if r["status"] == "created")
+        if created == len(results):
+            code = status.HTTP_201_CREATED
+        elif created:
+            code = status.HTTP_207_MULTI_STATUS
+        else:
+            code = status.HTTP_400_BAD_REQUEST
+        return Response(
+            {"created": created, "failed": len(results) - created, "results": results},
+            status=code,
+        )
+
+    def perform_destroy(self, instance):
+        # give reserved stock back before the reservations cascade away
+        with transaction.atomic():
+            release_reservations([instance.pk])
+            instance.delete()
+
+    @action(detail=True, methods=["post"], url_path="cancel")
+    def cancel(self, request, pk=None):
+        """
+        POST /api/manufacturing/manufacturing-orders/{id}/cancel/
+        Cancels the MO and releases its stock reservations.
+        """
+        mo = self.get_object()
+        try:
+            mo = m_services.cancel_manufacturing_order(mo)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(ManufacturingOrderDetailSerializer(mo).data)
+
 
 class WorkOrderViewSet(viewsets.ModelViewSet):
-    queryset = WorkOrder.objects.all().order_by("mo", "operation_no")
+    queryset = (
+        WorkOrder.objects.select_related("work_center").order_by("mo", "operation_no")
+    )
     serializer_class = WorkOrderSerializer
     permission_classes = [IsManufacturingManagerOrReadOnly]
 
@@ -111,52 +221,290 @@ class WorkOrderViewSet(viewsets.ModelViewSet):
     )
     def change_status(self, request, pk=None):
         """
-        PATCH /api/manufacturing/work-orders/{id}/status/  body: {"action": "start"|"pause"|"complete"|"assign", "assigned_to": <user_id>}
+        PATCH /api/manufacturing/work-orders/{id}/status/
+        body: {"action": "assign"|"start"|"pause"|"block"|"complete", "assigned_to": <user_id>, "version": <n>}
+        Transitions follow manufacturing.workflow.WO_TRANSITIONS and are applied
+        as a compare-and-set on (status, version); a stale version or a
+        disallowed transition returns 409 with the current status and version.
         On complete -> call manufacturing.services.complete_work_order (it will call inventory apply_wo_completion if available)
         """
         wo = self.get_object()
         action = request.data.get("action")
         user = request.user
+        if action not in WO_TRANSITIONS:
+            return Response(
+                {"detail": "unknown action"}, status=status.HTTP_400_BAD_REQUEST
+            )
+        version = request.data.get("version", wo.version)
+        try:
+            version = int(version)
+        except (TypeError, ValueError):
+            return Response(
+                {"version": "A valid integer is required."},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
 
+        values = {}
         if action == "assign":
             assigned_to = request.data.get("assigned_to")
-            if assigned_to:
-                from django.contrib.auth import get_user_model
+            User = get_user_model()
+            try:
+                values["assigned_to"] = User.objects.get(pk=assigned_to)
+            except (User.DoesNotExist, ValueError, TypeError):
+                return Response(
+                    {"detail": "User not found"}, status=status.HTTP_400_BAD_REQUEST
+                )
 
-                User = get_user_model()
-                try:
-                    assignee = User.objects.get(pk=assigned_to)
-                except User.DoesNotExist:
-                    return Response(
-                        {"detail": "User not found"}, status=status.HTTP_400_BAD_REQUEST
-                    )
-                wo.assigned_to = assignee
-                wo.status = WorkOrder.Status.ASSIGNED
-                wo.save(update_fields=["assigned_to", "status"])
-                return Response(WorkOrderSerializer(wo).data)
-
-        if action == "start":
-            wo.status = WorkOrder.Status.STARTED
-            wo.started_at = timezone.now()
-            wo.save(update_fields=["status", "started_at"])
-            return Response(WorkOrderSerializer(wo).data)
-
-        if action == "pause":
-            wo.status = WorkOrder.Status.PAUSED
-            wo.save(update_fields=["status"])
-            return Response(WorkOrderSerializer(wo).data)
-
-        if action == "complete":
-            # delegate to service (may call inventory.services.apply_wo_completion)
+        try:
+            if version != wo.version:
+                raise TransitionConflict(
+                    f"Work order was modified concurrently (version {wo.version}, expected {version}).",
+                    status=wo.status,
+                    version=wo.version,
+                )
+            if action == "complete":
+                # delegate to service (may call inventory.services.apply_wo_completion)
+                return Response(
+                    m_services.complete_work_order(wo, completed_by=user, version=version)
+                )
+            now = timezone.now()
+            wo.version = compare_and_set(
+                wo.pk,
+                action,
+                version=version,
+                scope=(wo.mo_id, wo.work_center_id),
+                now=now,
+                **values,
+            )
+        except TransitionConflict as e:
+            return Response(
+                {"detail": str(e), "status": e.status, "version": e.version},
+                status=status.HTTP_409_CONFLICT,
+            )
+        except NotImplementedError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_501_NOT_IMPLEMENTED)
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        # the row was at the version we loaded, so its new state is known here
+        wo.status = WO_TRANSITIONS[action].target
+        wo.updated_at = now
+        if action == "start" and wo.started_at is None:
+            wo.started_at = now
+        for field, value in values.items():
+            setattr(wo, field, value)
+        return Response(WorkOrderSerializer(wo).data)
+
+    @action(
+        detail=False,
+        methods=["post"],
+        # same audience as change_status: bulk moves use the same state machine
+        permission_classes=[permissions.IsAuthenticated],
+        url_path="bulk-status",
+    )
+    def bulk_status(self, request):
+        """
+        POST /api/manufacturing/work-orders/bulk-status/
+        body: {"ids": [...], "action": "start"|"pause"|"assign"|"block"|"complete", "assigned_to": <user_id>, "versions": {<id>: <n>}}
+        start/pause/assign/block run as one set-based UPDATE; complete posts
+        stock for every work order in a single transaction. Returns a per-id
+        outcome map; 200 when every id succeeded, 207 on partial success and
+        409 when none did.
+        """
+        serializer = WorkOrderBulkStatusSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        data = serializer.validated_data
+        if data["action"] == "complete":
+            results = m_services.bulk_complete_work_orders(
+                data["ids"], completed_by=request.user, versions=data["versions"]
+            )
+        else:
+            values = {}
+            if data["action"] == "assign":
+                values["assigned_to"] = data["assigned_to"]
+            results = bulk_transition(
+                data["ids"], data["action"], versions=data["versions"], **values
+            )
+        succeeded = sum(1 for r in results.values() if r["result"] == "ok")
+        if succeeded == len(results):
+            code = status.HTTP_200_OK
+        elif succeeded:
+            code = status.HTTP_207_MULTI_STATUS
+        else:
+            code = status.HTTP_409_CONFLICT
+        return Response(
+            {"succeeded": succeeded, "failed": len(results) - succeeded, "results": results},
+            status=code,
+        )
+
+    @action(detail=False, methods=["post"], url_path="schedule")
+    def schedule(self, request):
+        """
+        POST /api/manufacturing/work-orders/schedule/  body: {"mo_ids": [<id>, ...]} (optional)
+        Runs the finite-capacity scheduler; with mo_ids only the work centers
+        downstream of those MOs are rescheduled.
+        """
+        from .scheduling import schedule_work_orders
+
+        mo_ids = request.data.get("mo_ids")
+        if mo_ids is not None:
             try:
-                result = m_services.complete_work_order(wo, completed_by=user)
-            except NotImplementedError as e:
+                mo_ids = [int(m) for m in mo_ids]
+            except (TypeError, ValueError):
                 return Response(
-                    {"detail": str(e)}, status=status.HTTP_501_NOT_IMPLEMENTED
+                    {"mo_ids": "Must be a list of manufacturing order ids."},
+                    status=status.HTTP_400_BAD_REQUEST,
                 )
-            except Exception as e:
-                return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
-            return Response(result)
+        with transaction.atomic():
+            summary = schedule_work_orders(mo_ids=mo_ids)
+        return Response(summary)
+
+
+class WhereUsedView(APIView):
+    """
+    GET /api/manufacturing/where-used/{component_id}/?max_depth=<n>&finished_only=true
+    Every product whose active BOM uses the component directly or through
+    sub-assemblies, with the total quantity per unit and the shortest depth.
+    """
+
+    def get(self, request, component_id):
+        max_depth = request.query_params.get("max_depth")
+        if max_depth is not None:
+            try:
+                max_depth = int(max_depth)
+            except ValueError:
+                return Response(
+                    {"max_depth": "Must be an integer."},
+                    status=status.HTTP_400_BAD_REQUEST,
+                )
+        finished_only = request.query_params.get("finished_only") in ("1", "true", "True")
+        rows = where_used(component_id, max_depth=max_depth, finished_only=finished_only)
         return Response(
-            {"detail": "unknown action"}, status=status.HTTP_400_BAD_REQUEST
+            {
+                "component": component_id,
+                "results": [
+                    {
+                        "product_id": row.ancestor_id,
+                        "sku": row.ancestor.sku,
+                        "name": row.ancestor.name,
+                        "product_type": row.ancestor.product_type,
+                        "qty_per_unit": str(row.qty_per_unit),
+                        "depth": row.depth,
+                    }
+                    for row in rows
+                ],
+            }
         )
+
+
+class PromiseDateView(APIView):
+    """
+    GET /api/manufacturing/promise-date/?product=<id>&qty=500
+    Earliest delivery date for the quantity: from projected stock (ATP) or by
+    making the shortfall with the product's BOM and work centers (CTP).
+    """
+
+    def get(self, request):
+        serializer = PromiseDateSerializer(data=request.query_params)
+        serializer.is_valid(raise_exception=True)
+        try:
+            result = promise_date(
+                serializer.validated_data["product"], serializer.validated_data["qty"]
+            )
+        except m_services.BOMCycleError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(result)
+
+
+class MaterialsPreviewView(APIView):
+    """
+    POST /api/manufacturing/materials-preview/  body: {"linked_bom": <id>, "qty": "10"}
+    Returns the materials snapshot and availability without creating an MO.
+    """
+
+    serializer_class = MaterialsPreviewSerializer
+
+    def post(self, request):
+        serializer = self.serializer_class(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        try:
+            return Response(serializer.data)
+        except m_services.BOMCycleError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+
+class MaterialsPreviewBatchView(MaterialsPreviewView):
+    """
+    POST /api/manufacturing/materials-preview/batch/
+    body: {"requests": [{"linked_bom": <id>, "qty": "10"}, ...]}
+    Evaluates every pair with one BOM fetch, one explosion pass and one
+    availability query; results include per-request and cumulative shortages.
+    """
+
+    serializer_class = MaterialsPreviewBatchSerializer
+
+
+def _stream_user(request):
+    """
+    JWT from the Authorization header or the access cookie. Browsers use the
+    cookie: EventSource cannot set headers but sends cookies with
+    withCredentials. Tokens are not accepted in the query string, which
+    would write them into proxy and access logs.
+    """
+    auth = CustomCookieJWTAuthentication()
+    try:
+        result = auth.authenticate(request)
+    except (InvalidToken, AuthenticationFailed):
+        return None
+    return result[0] if result else None
+
+
+async def shop_floor_events(request):
+    """
+    GET /api/manufacturing/events/?work_center=<id>&mo=<id>
+    Server-sent event stream of work order transitions, MO status changes and
+    stock postings, delivered as their transactions commit. Both filters are
+    optional; a comment line is sent every STREAM_KEEPALIVE_SECONDS so idle
+    proxies keep the connection open.
+
+    Serve this under ASGI (backend.asgi:application, e.g. uvicorn or daphne):
+    under WSGI the async stream ties up a worker for as long as each client
+    stays connected.
+    """
+    user = await sync_to_async(_stream_user)(request)
+    if user is None or not user.is_active:
+        return JsonResponse(
+            {"detail": "Authentication credentials were not provided."}, status=401
+        )
+    filters = {}
+    for param, key in (("work_center", "work_center_id"), ("mo", "mo_id")):
+        value = request.GET.get(param)
+        if value:
+            try:
+                filters[key] = int(value)
+            except ValueError:
+                return JsonResponse({param: "Must be an integer id."}, status=400)
+
+    async def stream():
+        subscription = events.get_broker().subscribe(**filters)
+        try:
+            yield "retry: 3000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        subscription.queue.get(), STREAM_KEEPALIVE_SECONDS
+                    )
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                yield (
+                    f"id: {event['id']}\nevent: {event['type']}\n"
+                    f"data: {json.dumps(event)}\n\n"
+                )
+        finally:
+            subscription.close()
+
+    response = StreamingHttpResponse(stream(), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
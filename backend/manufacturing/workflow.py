@@ -0,0 +1,200 @@
+"""
+WorkOrder state machine.
+
+Every transition is a single compare-and-set UPDATE: the row only changes if
+its status is one the action allows and its version is still the one the
+caller read. No row locks are taken; a caller that loses the race gets a
+TransitionConflict carrying the row's current status and version.
+"""
+
+import uuid
+from typing import Dict, NamedTuple, Optional, Tuple
+
+from django.db.models import DateTimeField, F, Q, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .events import publish_work_order_changes
+from .models import WorkOrder
+
+S = WorkOrder.Status
+
+
+class Transition(NamedTuple):
+    target: str
+    sources: Tuple[str, ...]
+
+
+WO_TRANSITIONS: Dict[str, Transition] = {
+    "assign": Transition(S.ASSIGNED, (S.PENDING, S.ASSIGNED, S.PAUSED, S.BLOCKED)),
+    "start": Transition(S.STARTED, (S.PENDING, S.ASSIGNED, S.PAUSED, S.BLOCKED)),
+    "pause": Transition(S.PAUSED, (S.STARTED,)),
+    "block": Transition(S.BLOCKED, (S.PENDING, S.ASSIGNED, S.STARTED, S.PAUSED)),
+    "complete": Transition(S.COMPLETED, (S.PENDING, S.ASSIGNED, S.STARTED, S.PAUSED)),
+}
+
+
+class TransitionConflict(ValueError):
+    """The work order was not in an allowed status, or was changed concurrently."""
+
+    def __init__(self, message, status=None, version=None):
+        super().__init__(message)
+        self.status = status
+        self.version = version
+
+
+def transition_values(action: str, now=None, **values) -> Dict:
+    """Column values written by ``action`` besides status and version."""
+    now = now or timezone.now()
+    if action == "start":
+        # resuming a paused order keeps its original start time
+        values.setdefault(
+            "started_at", Coalesce(F("started_at"), Value(now), output_field=DateTimeField())
+        )
+    elif action == "complete":
+        values.setdefault("completed_at", now)
+    values.setdefault("updated_at", now)
+    return values
+
+
+def get_transition(action: str) -> Transition:
+    try:
+        return WO_TRANSITIONS[action]
+    except KeyError:
+        raise ValueError(f"Unknown action '{action}'.")
+
+
+def compare_and_set(
+    wo_id: int, action: str, version: Optional[int] = None, scope=None, **values
+) -> int:
+    """
+    Apply ``action`` to work order ``wo_id`` in one UPDATE and return its new
+    version. ``version`` is the version the caller last saw; without it only
+    the status rule is checked. Raises TransitionConflict when no row matched.
+    ``scope`` is the (mo_id, work_center_id) of the work order, used for the
+    shop-floor event; it is looked up when not given.
+    """
+    transition = get_transition(action)
+    qs = WorkOrder.objects.filter(pk=wo_id, status__in=transition.sources)
+    if version is not None:
+        qs = qs.filter(version=version)
+    updated = qs.update(
+        status=transition.target,
+        version=F("version") + 1,
+        **transition_values(action, **values),
+    )
+    if updated:
+        new_version = version + 1 if version is not None else _current(wo_id)[1]
+        if scope is None:
+            scope = WorkOrder.objects.values_list("mo_id", "work_center_id").get(pk=wo_id)
+        publish_work_order_changes([(wo_id, *scope, transition.target, new_version)])
+        return new_version
+    status, current = _current(wo_id)
+    raise _conflict(action, transition, status, current, version)
+
+
+def _current(wo_id: int):
+    row = WorkOrder.objects.filter(pk=wo_id).values_list("status", "version").first()
+    if row is None:
+        raise WorkOrder.DoesNotExist(f"Work order {wo_id} does not exist.")
+    return row
+
+
+def _conflict(action, transition, status, current, version) -> TransitionConflict:
+    if status not in transition.sources:
+        message = f"Cannot {action} a work order that is {status}."
+    else:
+        message = (
+            f"Work order was modified concurrently (version {current}, expected {version})."
+        )
+    return TransitionConflict(message, status=status, version=current)
+
+
+def bulk_transition(
+    wo_ids, action: str, versions: Optional[Dict[int, int]] = None, **values
+) -> Dict[int, Dict]:
+    """
+    Apply ``action`` to many work orders with one set-based UPDATE.
+
+    Rows are read once to pick the eligible ones (allowed status and, where
+    ``versions`` gives one, the expected version); the UPDATE then re-checks
+    each row's (id, version) pair so a concurrent writer between the read and
+    the write is detected, and only in that case are the rows read back. The
+    UPDATE also stamps a per-call token, so a row another caller moved to the
+    same status and version is not mistaken for one of ours.
+    Returns {wo_id: outcome} where outcome has "result" ("ok", "conflict" or
+    "not_found") plus the row's status and version.
+    """
+    transition = get_transition(action)
+    versions = versions or {}
+    ids = list(dict.fromkeys(int(i) for i in wo_ids))
+    current = {}
+    scopes = {}
+    for pk, status, version, mo_id, wc_id in WorkOrder.objects.filter(
+        pk__in=ids
+    ).values_list("id", "status", "version", "mo_id", "work_center_id"):
+        current[pk] = (status, version)
+        scopes[pk] = (mo_id, wc_id)
+    outcomes: Dict[int, Dict] = {}
+    eligible: Dict[int, int] = {}
+    for pk in ids:
+        if pk not in current:
+            outcomes[pk] = {"result": "not_found"}
+            continue
+        status, version = current[pk]
+        expected = versions.get(pk, version)
+        if status not in transition.sources or version != expected:
+            error = _conflict(action, transition, status, version, expected)
+            outcomes[pk] = {
+                "result": "conflict",
+                "detail": str(error),
+                "status": status,
+                "version": version,
+            }
+        else:
+            eligible[pk] = version
+
+    if eligible:
+        match = Q()
+        for pk, version in eligible.items():
+            match |= Q(pk=pk, version=version)
+        token = uuid.uuid4()
+        updated = WorkOrder.objects.filter(match, status__in=transition.sources).update(
+            status=transition.target,
+            version=F("version") + 1,
+            transition_token=token,
+            **transition_values(action, **values),
+        )
+        landed = dict.fromkeys(eligible, True)
+        if updated != len(eligible):
+            # someone else moved some of these rows in between; find out which
+            landed = dict.fromkeys(eligible, False)
+            rows = WorkOrder.objects.filter(pk__in=list(eligible)).values_list(
+                "id", "status", "version", "transition_token"
+            )
+            for pk, status, version, row_token in rows:
+                landed[pk] = row_token == token
+                if not landed[pk]:
+                    outcomes[pk] = {
+                        "result": "conflict",
+                        "detail": str(
+                            _conflict(action, transition, status, version, eligible[pk])
+                        ),
+                        "status": status,
+                        "version": version,
+                    }
+        for pk, version in eligible.items():
+            if landed[pk]:
+                outcomes[pk] = {
+                    "result": "ok",
+                    "status": transition.target,
+                    "version": version + 1,
+                }
+            else:
+                outcomes.setdefault(pk, {"result": "not_found"})
+        publish_work_order_changes(
+            (pk, *scopes[pk], transition.target, version + 1)
+            for pk, version in eligible.items()
+            if landed[pk]
+        )
+    return {pk: outcomes[pk] for pk in ids}